@@ -1,7 +1,8 @@
 from django.contrib import admin
 
-from .models import Manager, ClassicLeague, HeadToHeadLeague, FPLLeague
+from .models import Manager, ClassicLeague, HeadToHeadLeague, FPLLeague, RefreshJob
 
 admin.site.register(Manager)
 admin.site.register(ClassicLeague)
 admin.site.register(HeadToHeadLeague)
+admin.site.register(RefreshJob)
@@ -0,0 +1,197 @@
+import asyncio
+import json
+import time
+from http.cookies import SimpleCookie
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from fpl.client import AUTH_ERROR_STATUSES, BaseFPLClient, RETRY_STATUSES
+from fpl.models import HeadToHeadLeague
+from fpl.ratelimit import parse_retry_after
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+
+class AsyncFPLClient(BaseFPLClient):
+    """asyncio counterpart of fpl.client.FPLClient sharing its timeouts, retry budget and metrics."""
+
+    def __init__(self, base_url=None, concurrency=None):
+        if aiohttp is None:
+            raise ImproperlyConfigured('aiohttp is required for asynchronous FPL ingestion')
+        super().__init__(base_url)
+        self.concurrency = concurrency or settings.FPL_ASYNC_CONCURRENCY
+        self.session = None
+        self._semaphore = None
+
+    async def __aenter__(self):
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        # unsafe allows cookies from IP address hosts such as a local fpl.stub_server
+        self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.concurrency),
+                                             cookie_jar=aiohttp.CookieJar(unsafe=True))
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.session.close()
+
+    async def _request(self, method, url, endpoint, **kwargs):
+        connect, read = self.timeout(endpoint)
+        timeout = aiohttp.ClientTimeout(sock_connect=connect, sock_read=read)
+        loop = asyncio.get_event_loop()
+        attempt = 0
+        async with self._semaphore:
+            while True:
+                rate_limiter = self.rate_limiter
+                if rate_limiter is not None:
+                    # reserve and feedback block on the shared cache lock, so they are kept off the event loop
+                    await asyncio.sleep(await loop.run_in_executor(None, rate_limiter.reserve))
+                started = time.monotonic()
+                try:
+                    async with self.session.request(method, url, timeout=timeout, **kwargs) as response:
+                        response.raise_for_status()
+                        body = await response.read()
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    self._record(endpoint, started, error=True)
+                    if rate_limiter is not None and isinstance(e, aiohttp.ClientResponseError):
+                        retry_after = e.headers.get('Retry-After') if e.headers else None
+                        await loop.run_in_executor(None, rate_limiter.feedback, e.status,
+                                                   parse_retry_after(retry_after))
+                    retryable = not isinstance(e, aiohttp.ClientResponseError) or e.status in RETRY_STATUSES
+                    if not retryable or attempt >= settings.FPL_HTTP_MAX_RETRIES:
+                        raise
+                    await asyncio.sleep(0.5 * 2 ** attempt)
+                    attempt += 1
+                    continue
+                self._record(endpoint, started)
+                return body
+
+    async def get(self, path, params=None):
+        url = self.base_url + path
+        endpoint = self.endpoint(path)
+        cache = self.cache
+        cacheable = cache is not None and cache.ttl(endpoint) > 0
+        # The response cache reads and writes files, so it is used off the event loop
+        loop = asyncio.get_event_loop()
+        if cacheable:
+            key = cache.make_key(path, params)
+            data = await loop.run_in_executor(None, cache.get, endpoint, key)
+            if data is not None:
+                return data
+
+        try:
+            body = await self._request('GET', url, endpoint, params=params)
+        except aiohttp.ClientResponseError as e:
+            if self.credentials is None or e.status not in AUTH_ERROR_STATUSES:
+                raise
+            await self.authenticate(*self.credentials, force=True)
+            body = await self._request('GET', url, endpoint, params=params)
+        data = json.loads(body.decode('utf-8'))
+        if cacheable:
+            await loop.run_in_executor(None, cache.set, endpoint, key, data)
+        return data
+
+    async def login(self, username, password):
+        await self._request('GET', settings.FPL_HOMEPAGE_URL, 'login')
+        csrftoken = self.session.cookie_jar.filter_cookies(settings.FPL_HOMEPAGE_URL)['csrftoken'].value
+        await self._request('POST', settings.FPL_LOGIN_URL, 'login',
+                            data=self._login_data(csrftoken, username, password))
+
+    async def authenticate(self, username, password, force=False):
+        self.credentials = (username, password)
+        cookies = None if force else self._cached_cookies(username)
+        if cookies is None:
+            self.session.cookie_jar.clear()
+            await self.login(username, password)
+            self._cache_cookies(username, [
+                {'name': morsel.key, 'value': morsel.value, 'domain': morsel['domain'], 'path': morsel['path'] or '/',
+                 'expires': None}
+                for morsel in self.session.cookie_jar
+            ])
+        else:
+            for cookie in cookies:
+                morsel = SimpleCookie()
+                morsel[cookie['name']] = cookie['value']
+                morsel[cookie['name']]['domain'] = cookie['domain']
+                morsel[cookie['name']]['path'] = cookie['path']
+                self.session.cookie_jar.update_cookies(morsel)
+
+
+async def fetch_calendar(client):
+    fixtures, bootstrap_static = await asyncio.gather(client.get('fixtures'), client.get('bootstrap-static'))
+    return {
+        'fixtures': fixtures,
+        'bootstrap-static': bootstrap_static
+    }
+
+
+async def fetch_league_pages(client, league):
+    if not isinstance(league, HeadToHeadLeague):
+        pages = []
+        has_next = True
+        page_number = 1
+        while has_next:
+            page = await client.get('leagues-classic-standings/{fpl_league_id}?ls-page={page_number}'.format(
+                fpl_league_id=league.fpl_league_id,
+                page_number=page_number
+            ))
+            pages.append(page)
+            page_number += 1
+            has_next = page['standings']['has_next']
+        return pages, [manager['entry'] for page in pages for manager in page['standings']['results']]
+
+    pages = []
+    has_next = True
+    page_number = 1
+    while has_next:
+        page = await client.get('leagues-entries-and-h2h-matches/league/{fpl_league_id}?page={page_number}'.format(
+            fpl_league_id=league.fpl_league_id,
+            page_number=page_number
+        ))
+        pages.append(page)
+        page_number += 1
+        has_next = page['matches']['has_next']
+    return pages, [manager['entry'] for manager in pages[-1]['league-entries']]
+
+
+async def fetch_leagues(client, leagues):
+    """Fetch everything process_payouts needs for each league concurrently on the running event loop.
+
+    Returns a dict mapping each league to the data argument accepted by its process_payouts. The gameweek calendar is
+    fetched once and manager histories are fetched once per manager, however many leagues they appear in.
+    """
+    history_tasks = {}
+
+    async def fetch_league(league):
+        pages, manager_ids = await fetch_league_pages(client, league)
+        for manager_id in manager_ids:
+            if manager_id not in history_tasks:
+                history_tasks[manager_id] = asyncio.ensure_future(client.get('entry/{fpl_manager_id}/history'.format(
+                    fpl_manager_id=manager_id
+                )))
+        histories = await asyncio.gather(*[history_tasks[manager_id] for manager_id in manager_ids])
+        return {
+            'pages': pages,
+            'histories': dict(zip(manager_ids, histories))
+        }
+
+    if any(isinstance(league, HeadToHeadLeague) for league in leagues):
+        await client.authenticate(settings.FPL_USERNAME, settings.FPL_PASSWORD)
+    calendar, *league_data = await asyncio.gather(fetch_calendar(client), *[fetch_league(league) for league in leagues])
+    return {league: dict(calendar, **data) for league, data in zip(leagues, league_data)}
+
+
+def ingest_leagues(leagues, base_url=None, concurrency=None):
+    """Fetch data for leagues on a new event loop, returning the same mapping as fetch_leagues."""
+
+    async def run():
+        async with AsyncFPLClient(base_url, concurrency) as client:
+            return await fetch_leagues(client, leagues)
+
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(run())
+    finally:
+        loop.close()
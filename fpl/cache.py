@@ -0,0 +1,320 @@
+import atexit
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+import time
+import zlib
+from collections import defaultdict
+from contextlib import contextmanager
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.files import locks
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+COMPRESSED = b'z'
+UNCOMPRESSED = b'p'
+
+
+def _incr(cache, key, delta=1):
+    if not cache.add(key, delta, None):
+        try:
+            cache.incr(key, delta)
+        except ValueError:
+            # Culled between add and incr
+            cache.set(key, delta, None)
+
+
+class LockingFileBasedCache(FileBasedCache):
+    """FileBasedCache whose add and incr are atomic across the processes of a host.
+
+    fpl.ratelimit takes its lock with cache.add and PageCache counts with cache.incr, neither of which is atomic on
+    Django's FileBasedCache. Both are serialised here with an exclusive lock on a file in the cache directory.
+    """
+
+    @contextmanager
+    def _locked(self):
+        self._createdir()
+        with open(os.path.join(self._dir, 'cache.lock'), 'wb') as f:
+            locks.lock(f, locks.LOCK_EX)
+            try:
+                yield
+            finally:
+                locks.unlock(f)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        with self._locked():
+            return super().add(key, value, timeout, version)
+
+    def incr(self, key, delta=1, version=None):
+        with self._locked():
+            return super().incr(key, delta, version)
+
+
+class ResponseCache:
+    """Disk backed cache of decoded FPL API responses.
+
+    Entries are keyed by endpoint path and parameters and expire after a per-endpoint TTL. Expired entries are kept
+    so their validators can be used for conditional requests until the cache grows past max_size, at which point the
+    least recently used entries are evicted. Hits and misses are counted per endpoint in the process and added to
+    the Django cache cache_alias at most every stats_interval seconds, so that the totals cover every process sharing
+    it without a write to the shared cache on every lookup.
+    """
+
+    def __init__(self, location, max_size, ttls, cache_alias, compress=False, stats_interval=10):
+        self.location = location
+        self.max_size = max_size
+        self.ttls = ttls
+        self.cache_alias = cache_alias
+        self.compress = compress
+        self.stats_interval = stats_interval
+        self._pending_stats = defaultdict(int)
+        self._stats_flushed = time.monotonic()
+        self._size = None
+        self._lock = threading.Lock()
+        os.makedirs(self.location, exist_ok=True)
+
+    @staticmethod
+    def make_key(path, params=None):
+        if params:
+            path = '{path}#{params}'.format(path=path, params=urlencode(sorted(params.items())))
+        return path
+
+    def ttl(self, endpoint):
+        return self.ttls.get(endpoint, self.ttls.get('default', 0))
+
+    def _path(self, key):
+        return os.path.join(self.location, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.cache')
+
+    def get_entry(self, key):
+        """Return the stored entry for key whether or not it has expired, or None."""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                payload = f.read()
+        except FileNotFoundError:
+            return None
+        if payload[:1] == COMPRESSED:
+            payload = UNCOMPRESSED + zlib.decompress(payload[1:])
+        try:
+            entry = pickle.loads(payload[1:])
+        except (pickle.UnpicklingError, EOFError):
+            return None
+        if entry['key'] != key:
+            return None
+        # Reads refresh the modification time, which eviction uses as the last access time
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return entry
+
+    def get(self, endpoint, key):
+        """Return the data stored for key if it has not expired, counting the lookup as a hit or a miss."""
+        entry = self.get_entry(key)
+        fresh = entry is not None and entry['expires'] > time.time()
+        self._count(endpoint, 'hits' if fresh else 'misses')
+        return entry['data'] if fresh else None
+
+    @property
+    def stats_cache(self):
+        return caches[self.cache_alias]
+
+    @staticmethod
+    def _stats_key(endpoint, name):
+        return 'fpl-response:{endpoint}:{name}'.format(endpoint=endpoint, name=name)
+
+    def _count(self, endpoint, name):
+        with self._lock:
+            self._pending_stats[self._stats_key(endpoint, name)] += 1
+            if time.monotonic() - self._stats_flushed < self.stats_interval:
+                return
+        self.flush_stats()
+
+    def flush_stats(self):
+        """Add the hits and misses counted in this process since the last flush to the shared totals."""
+        with self._lock:
+            pending, self._pending_stats = self._pending_stats, defaultdict(int)
+            self._stats_flushed = time.monotonic()
+        for key, count in pending.items():
+            _incr(self.stats_cache, key, count)
+
+    def endpoints(self):
+        """Return the endpoints configured with their own TTL, the ones looked up in the cache unless the default is."""
+        return sorted(endpoint for endpoint in self.ttls if endpoint != 'default')
+
+    def stats(self, endpoints=None):
+        self.flush_stats()
+        endpoints = endpoints or self.endpoints()
+        counts = self.stats_cache.get_many([self._stats_key(endpoint, name)
+                                            for endpoint in endpoints for name in ('hits', 'misses')])
+        stats = {}
+        for endpoint in endpoints:
+            hits = counts.get(self._stats_key(endpoint, 'hits'), 0)
+            misses = counts.get(self._stats_key(endpoint, 'misses'), 0)
+            stats[endpoint] = {
+                'hits': hits,
+                'misses': misses,
+                'hit_rate': hits / (hits + misses) if hits + misses else None
+            }
+        return stats
+
+    def reset_stats(self, endpoints=None):
+        self.flush_stats()
+        self.stats_cache.delete_many([self._stats_key(endpoint, name)
+                                      for endpoint in endpoints or self.endpoints() for name in ('hits', 'misses')])
+
+    def set(self, endpoint, key, data, etag=None, last_modified=None):
+        payload = pickle.dumps({
+            'key': key,
+            'expires': time.time() + self.ttl(endpoint),
+            'etag': etag,
+            'last_modified': last_modified,
+            'data': data
+        }, pickle.HIGHEST_PROTOCOL)
+        payload = COMPRESSED + zlib.compress(payload) if self.compress else UNCOMPRESSED + payload
+        fd, tmp_path = tempfile.mkstemp(dir=self.location, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(payload)
+        os.replace(tmp_path, self._path(key))
+
+        with self._lock:
+            if self._size is None:
+                self._size = self._disk_usage()
+            else:
+                self._size += len(payload)
+            if self._size > self.max_size:
+                self._evict()
+
+    def _entries(self):
+        entries = []
+        for name in os.listdir(self.location):
+            try:
+                stat = os.stat(os.path.join(self.location, name))
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, os.path.join(self.location, name)))
+        return entries
+
+    def _disk_usage(self):
+        return sum(size for _, size, _ in self._entries())
+
+    def _evict(self):
+        # Cull to 90% of max_size so evictions are not triggered on every write
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_size * 0.9:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        self._size = total
+
+    def clear(self):
+        with self._lock:
+            for _, _, path in self._entries():
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            self._size = 0
+
+
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    """Return the process-wide response cache, or None when FPL_RESPONSE_CACHE is not configured."""
+    global _response_cache
+    if not settings.FPL_RESPONSE_CACHE:
+        return None
+    with _response_cache_lock:
+        if _response_cache is None:
+            _response_cache = ResponseCache(
+                location=settings.FPL_RESPONSE_CACHE['LOCATION'],
+                max_size=settings.FPL_RESPONSE_CACHE['MAX_SIZE'],
+                ttls=settings.FPL_RESPONSE_CACHE['TTLS'],
+                cache_alias=settings.FPL_CACHE_ALIAS,
+                compress=settings.FPL_RESPONSE_CACHE.get('COMPRESS', False)
+            )
+            atexit.register(_response_cache.flush_stats)
+    return _response_cache
+
+
+@receiver(setting_changed)
+def reset_response_cache(**kwargs):
+    global _response_cache
+    if kwargs['setting'] == 'FPL_RESPONSE_CACHE':
+        _response_cache = None
+
+
+class PageCache:
+    """Rendered league page fragments stored in a Django cache.
+
+    Fragments are keyed on the league and its last_updated time, so a refresh leaves the previous fragment to expire
+    unread. Changes that do not move last_updated, such as live points and payouts, call invalidate to start a new
+    generation of the league's fragments. Hits and misses are counted in the cache so that the totals cover every
+    process sharing it.
+    """
+
+    def __init__(self, cache, timeout):
+        self.cache = cache
+        self.timeout = timeout
+
+    @staticmethod
+    def _league_key(league):
+        return 'fpl-page:{label}:{pk}'.format(label=league._meta.label_lower, pk=league.pk)
+
+    def key(self, league, fragment):
+        last_updated = league.last_updated.timestamp() if league.last_updated else None
+        return '{league}:{fragment}:{last_updated}'.format(league=self._league_key(league), fragment=fragment,
+                                                            last_updated=last_updated)
+
+    def get(self, league, fragment):
+        """Return the cached fragment for league if it is from the league's current generation, or None."""
+        key, generation_key = self.key(league, fragment), self._league_key(league) + ':generation'
+        values = self.cache.get_many([key, generation_key])
+        generation, content = values.get(key, (None, None))
+        hit = content is not None and generation == values.get(generation_key, 0)
+        self._count('hits' if hit else 'misses')
+        return content if hit else None
+
+    def set(self, league, fragment, content):
+        generation = self.cache.get(self._league_key(league) + ':generation', 0)
+        self.cache.set(self.key(league, fragment), (generation, content), self.timeout)
+
+    def invalidate(self, league):
+        _incr(self.cache, self._league_key(league) + ':generation')
+
+    def _count(self, name):
+        _incr(self.cache, 'fpl-page:' + name)
+
+    def stats(self):
+        counts = self.cache.get_many(['fpl-page:hits', 'fpl-page:misses'])
+        hits, misses = counts.get('fpl-page:hits', 0), counts.get('fpl-page:misses', 0)
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': hits / (hits + misses) if hits + misses else None
+        }
+
+    def reset_stats(self):
+        self.cache.delete_many(['fpl-page:hits', 'fpl-page:misses'])
+
+
+def get_page_cache():
+    """Return the league page cache, or None when FPL_PAGE_CACHE is not configured."""
+    if not settings.FPL_PAGE_CACHE:
+        return None
+    return PageCache(caches[settings.FPL_PAGE_CACHE.get('CACHE_ALIAS', 'fpl-pages')],
+                     settings.FPL_PAGE_CACHE['TIMEOUT'])
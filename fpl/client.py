@@ -0,0 +1,276 @@
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from fpl.cache import get_response_cache
+from fpl.ratelimit import get_rate_limiter, parse_retry_after
+
+AUTH_ERROR_STATUSES = (401, 403)
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class BaseFPLClient:
+    def __init__(self, base_url=None):
+        self._base_url = base_url
+        self.stats = defaultdict(lambda: {'requests': 0, 'errors': 0, 'not_modified': 0, 'elapsed': 0.0})
+        self._stats_lock = threading.Lock()
+        self.credentials = None
+
+    @property
+    def base_url(self):
+        return self._base_url or settings.FPL_BASE_URL
+
+    @property
+    def cache(self):
+        return get_response_cache()
+
+    @property
+    def rate_limiter(self):
+        return get_rate_limiter()
+
+    @staticmethod
+    def endpoint(path):
+        return path.split('?', 1)[0].split('/', 1)[0]
+
+    @staticmethod
+    def timeout(endpoint):
+        return settings.FPL_HTTP_TIMEOUTS.get(endpoint, settings.FPL_HTTP_TIMEOUTS['default'])
+
+    def _record(self, endpoint, started, error=False, not_modified=False):
+        with self._stats_lock:
+            stats = self.stats[endpoint]
+            stats['requests'] += 1
+            stats['errors'] += int(error)
+            stats['not_modified'] += int(not_modified)
+            stats['elapsed'] += time.monotonic() - started
+
+    @staticmethod
+    def _login_data(csrftoken, username, password):
+        return {'csrfmiddlewaretoken': csrftoken, 'login': username, 'password': password, 'app': 'plfpl-web',
+                'redirect_uri': 'https://fantasy.premierleague.com/a/login'}
+
+    @staticmethod
+    def _cookies_cache_key(username):
+        return 'fpl:session-cookies:{username}'.format(username=username)
+
+    def _cached_cookies(self, username):
+        return caches[settings.FPL_CACHE_ALIAS].get(self._cookies_cache_key(username))
+
+    def _cache_cookies(self, username, cookies):
+        # Cookies are stored as plain dicts so both the requests and aiohttp clients can restore them
+        timeout = settings.FPL_SESSION_COOKIE_TTL
+        expiries = [cookie['expires'] for cookie in cookies if cookie['expires']]
+        if expiries:
+            timeout = min(timeout, min(expiries) - time.time())
+        if timeout > 0:
+            caches[settings.FPL_CACHE_ALIAS].set(self._cookies_cache_key(username), cookies, timeout)
+
+
+class FPLClient(BaseFPLClient):
+    """Pooled keep-alive HTTP client for the FPL API.
+
+    All outbound FPL traffic goes through an instance of this class so connection reuse, timeouts, retries and
+    request metrics are handled in one place.
+    """
+
+    def __init__(self, base_url=None):
+        super().__init__(base_url)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=settings.FPL_HTTP_POOL_SIZE,
+            pool_maxsize=settings.FPL_HTTP_POOL_SIZE,
+            # Only connection errors are retried here, throttling and server errors are retried in _request so every
+            # attempt goes through the rate limiter
+            max_retries=Retry(
+                total=settings.FPL_HTTP_MAX_RETRIES,
+                read=False,
+                backoff_factor=0.5
+            )
+        )
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def _request(self, method, url, endpoint, **kwargs):
+        attempt = 0
+        while True:
+            rate_limiter = self.rate_limiter
+            if rate_limiter is not None:
+                rate_limiter.acquire()
+            started = time.monotonic()
+            try:
+                response = self.session.request(method, url, timeout=self.timeout(endpoint), **kwargs)
+                response.raise_for_status()
+            except requests.RequestException as e:
+                self._record(endpoint, started, error=True)
+                status_code = e.response.status_code if e.response is not None else None
+                if rate_limiter is not None and status_code is not None:
+                    rate_limiter.feedback(status_code, parse_retry_after(e.response.headers.get('Retry-After')))
+                if status_code not in RETRY_STATUSES or attempt >= settings.FPL_HTTP_MAX_RETRIES:
+                    raise
+                time.sleep(0.5 * 2 ** attempt)
+                attempt += 1
+                continue
+            self._record(endpoint, started, not_modified=response.status_code == 304)
+            return response
+
+    def get(self, path, params=None):
+        url = self.base_url + path
+        endpoint = self.endpoint(path)
+        cache = self.cache
+        cacheable = cache is not None and cache.ttl(endpoint) > 0
+        if cacheable:
+            key = cache.make_key(path, params)
+            data = cache.get(endpoint, key)
+            if data is not None:
+                return data
+
+        try:
+            response = self._request('GET', url, endpoint, params=params)
+        except requests.HTTPError as e:
+            if self.credentials is None or e.response is None or e.response.status_code not in AUTH_ERROR_STATUSES:
+                raise
+            self.authenticate(*self.credentials, force=True)
+            response = self._request('GET', url, endpoint, params=params)
+        data = response.json()
+        if cacheable:
+            cache.set(endpoint, key, data)
+        return data
+
+    def get_conditional(self, path):
+        """Return (data, modified) for path, revalidating a previously stored response with its validators.
+
+        A response still within its cache TTL, or one the server answers 304 Not Modified for, is returned from the
+        response cache with modified set to False.
+        """
+        endpoint = self.endpoint(path)
+        cache = self.cache
+        if cache is None:
+            return self.get(path), True
+
+        key = cache.make_key(path)
+        if cache.ttl(endpoint) > 0:
+            data = cache.get(endpoint, key)
+            if data is not None:
+                return data, False
+        stored = cache.get_entry(key)
+        headers = {}
+        if stored is not None:
+            if stored['etag']:
+                headers['If-None-Match'] = stored['etag']
+            if stored['last_modified']:
+                headers['If-Modified-Since'] = stored['last_modified']
+        response = self._request('GET', self.base_url + path, endpoint, headers=headers)
+        if response.status_code == 304 and stored is not None:
+            cache.set(endpoint, key, stored['data'], stored['etag'], stored['last_modified'])
+            return stored['data'], False
+
+        data = response.json()
+        cache.set(endpoint, key, data, response.headers.get('ETag'), response.headers.get('Last-Modified'))
+        return data, True
+
+    def login(self, username, password):
+        self._request('GET', settings.FPL_HOMEPAGE_URL, 'login')
+        self._request('POST', settings.FPL_LOGIN_URL, 'login',
+                      data=self._login_data(self.session.cookies['csrftoken'], username, password))
+
+    def authenticate(self, username, password, force=False):
+        """Restore cached session cookies for username, only logging in when none are cached or force is set."""
+        self.credentials = (username, password)
+        cookies = None if force else self._cached_cookies(username)
+        if cookies is None:
+            self.session.cookies.clear()
+            self.login(username, password)
+            self._cache_cookies(username, [
+                {'name': cookie.name, 'value': cookie.value, 'domain': cookie.domain, 'path': cookie.path,
+                 'expires': cookie.expires}
+                for cookie in self.session.cookies
+            ])
+        else:
+            for cookie in cookies:
+                self.session.cookies.set_cookie(requests.cookies.create_cookie(**cookie))
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """Return the process-wide shared client, creating it on first use."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = FPLClient()
+    return _client
+
+
+_authorized_clients = {}
+_authorized_clients_lock = threading.Lock()
+_authentication_locks = {}
+
+
+def get_authorized_client(username, password):
+    """Return the process-wide client authenticated as username, authenticating it on first use.
+
+    The client re-authenticates by itself when its session is rejected, so it is shared for as long as the process runs.
+    """
+    credentials = (username, password)
+    with _authorized_clients_lock:
+        client = _authorized_clients.get(credentials)
+        if client is not None:
+            return client
+        authentication_lock = _authentication_locks.setdefault(credentials, threading.Lock())
+    # Logging in is a network round trip, so it only holds up callers waiting on the same credentials
+    with authentication_lock:
+        with _authorized_clients_lock:
+            client = _authorized_clients.get(credentials)
+        if client is None:
+            client = FPLClient()
+            client.authenticate(username, password)
+            with _authorized_clients_lock:
+                _authorized_clients[credentials] = client
+    return client
+
+
+@receiver(setting_changed)
+def reset_authorized_clients(**kwargs):
+    if kwargs['setting'] in ('FPL_BASE_URL', 'FPL_HOMEPAGE_URL', 'FPL_LOGIN_URL'):
+        with _authorized_clients_lock:
+            _authorized_clients.clear()
+
+
+def iter_pages(fetch_page, has_next):
+    """Yield the pages returned by fetch_page(page_number), in page order, until has_next(page) is False.
+
+    Page 1 is fetched directly. Once a page says another one follows, that page is requested in the background while
+    the consumer processes the current one, so no request is made past the last page.
+    """
+    executor = ThreadPoolExecutor(max_workers=1)
+    pending = None
+    try:
+        page_number = 1
+        page = fetch_page(page_number)
+        while True:
+            if has_next(page):
+                page_number += 1
+                pending = executor.submit(fetch_page, page_number)
+            else:
+                pending = None
+            yield page
+            if pending is None:
+                return
+            page = pending.result()
+    finally:
+        if pending is not None:
+            pending.cancel()
+        # Not waiting for an in-flight request lets an abandoned generator be closed from any thread, including by
+        # garbage collection running on the executor's own thread
+        executor.shutdown(wait=False)
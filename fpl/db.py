@@ -0,0 +1,44 @@
+from django.db import connection
+
+UPSERT_BATCH_SIZE = 500
+
+
+def bulk_upsert(model, rows, unique_fields, update_fields, returning=None, batch_size=UPSERT_BATCH_SIZE):
+    """Insert rows into model's table, updating update_fields of rows that conflict on unique_fields.
+
+    rows are dicts keyed by field attname (e.g. manager_id) that all have the same keys. This is the native
+    INSERT ... ON CONFLICT DO UPDATE upsert, which Django's bulk_create only gained in 4.1, so each batch is a single
+    statement instead of a SELECT plus an INSERT or UPDATE per row. Conflicting rows whose values are unchanged are
+    left untouched, and when returning is given the values of those fields are returned for every row that was
+    inserted or changed.
+    """
+    if not rows:
+        return []
+    quote_name = connection.ops.quote_name
+    table = quote_name(model._meta.db_table)
+    fields = list(rows[0])
+
+    def column(field):
+        return quote_name(model._meta.get_field(field).column)
+
+    sql = ('INSERT INTO {table} ({columns}) VALUES {{values}} ON CONFLICT ({unique}) DO UPDATE SET {updates} '
+           'WHERE {changed}').format(
+        table=table,
+        columns=', '.join(column(field) for field in fields),
+        unique=', '.join(column(field) for field in unique_fields),
+        updates=', '.join('{column} = EXCLUDED.{column}'.format(column=column(field)) for field in update_fields),
+        changed=' OR '.join('{table}.{column} IS DISTINCT FROM EXCLUDED.{column}'.format(
+            table=table, column=column(field)) for field in update_fields)
+    )
+    if returning:
+        sql += ' RETURNING {}'.format(', '.join(column(field) for field in returning))
+    placeholder = '({})'.format(', '.join(['%s'] * len(fields)))
+    results = []
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            cursor.execute(sql.format(values=', '.join([placeholder] * len(batch))),
+                           [row[field] for row in batch for field in fields])
+            if returning:
+                results.extend(cursor.fetchall())
+    return results
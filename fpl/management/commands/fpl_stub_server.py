@@ -0,0 +1,49 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+
+from fpl.stub_server import StubFPLServer, SyntheticFPLData
+
+
+class Command(BaseCommand):
+    help = 'Serve synthetic FPL API responses locally for benchmarking and load testing ingestion'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8001)
+        parser.add_argument('--league-size', type=int, default=20, help='Number of entries in every league')
+        parser.add_argument('--page-size', type=int, default=50,
+                            help='Number of standings or matches per page')
+        parser.add_argument('--gameweeks', type=int, default=38)
+        parser.add_argument('--current-gameweek', type=int, default=10,
+                            help='Last gameweek with points in manager histories')
+        parser.add_argument('--start-date', type=datetime.date.fromisoformat,
+                            help='Date of the first gameweek deadline (YYYY-MM-DD), defaults to current-gameweek '
+                                 'weeks ago')
+        parser.add_argument('--latency', type=float, default=0, help='Seconds to wait before every response')
+        parser.add_argument('--error-rate', type=float, default=0,
+                            help='Fraction of requests answered with 503 Service Unavailable')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        data = SyntheticFPLData(
+            league_size=options['league_size'],
+            page_size=options['page_size'],
+            gameweeks=options['gameweeks'],
+            current_gameweek=options['current_gameweek'],
+            start_date=options['start_date'],
+            seed=options['seed']
+        )
+        server = StubFPLServer(data, options['host'], options['port'], options['latency'], options['error_rate'],
+                               verbose=options['verbosity'] > 1)
+        self.stdout.write('Serving synthetic FPL API, point ingestion at it with:')
+        self.stdout.write('  export FPL_BASE_URL={}'.format(server.base_url))
+        self.stdout.write('  export FPL_HOMEPAGE_URL={}'.format(server.homepage_url))
+        self.stdout.write('  export FPL_LOGIN_URL={}'.format(server.login_url))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            self.stdout.write('Served {} requests'.format(server.request_count))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from fpl.aio import ingest_leagues
+from fpl.management.leagues import add_league_arguments, get_leagues
+
+
+class Command(BaseCommand):
+    help = 'Fetch FPL data for leagues concurrently on one event loop and process their payouts'
+
+    def add_arguments(self, parser):
+        add_league_arguments(parser)
+        parser.add_argument('--concurrency', type=int, help='Maximum number of concurrent FPL requests')
+
+    def handle(self, *args, **options):
+        leagues = get_leagues(options)
+        data = ingest_leagues(leagues, concurrency=options['concurrency'])
+        for league in leagues:
+            league.process_payouts(data[league])
+            self.stdout.write('Refreshed {league}'.format(league=league))
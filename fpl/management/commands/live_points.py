@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from fpl.management.leagues import add_league_arguments, get_leagues
+from fpl.models import FPLLeague
+
+
+class Command(BaseCommand):
+    help = 'Store provisional points for managers of leagues with a gameweek in progress'
+
+    def add_arguments(self, parser):
+        add_league_arguments(parser)
+        parser.add_argument('--loop', type=int, metavar='SECONDS',
+                            help='Keep polling every SECONDS seconds instead of once')
+
+    def poll(self, options):
+        for league, changed in FPLLeague.bulk_retrieve_live_points(get_leagues(options)).items():
+            self.stdout.write('{league}: {changed} managers changed'.format(league=league, changed=len(changed)))
+
+    def handle(self, *args, **options):
+        self.poll(options)
+        while options['loop']:
+            time.sleep(options['loop'])
+            self.poll(options)
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from fpl.cache import get_page_cache
+
+
+class Command(BaseCommand):
+    help = 'Show hits, misses and the hit rate of the league page cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='Reset the counts after showing them')
+
+    def handle(self, *args, **options):
+        page_cache = get_page_cache()
+        if page_cache is None:
+            raise CommandError('FPL_PAGE_CACHE is not configured')
+        stats = page_cache.stats()
+        hit_rate = '-' if stats['hit_rate'] is None else '{:.1%}'.format(stats['hit_rate'])
+        self.stdout.write('{hits} hits, {misses} misses, hit rate {hit_rate}'.format(
+            hits=stats['hits'], misses=stats['misses'], hit_rate=hit_rate))
+        if options['reset']:
+            page_cache.reset_stats()
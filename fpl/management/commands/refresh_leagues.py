@@ -0,0 +1,98 @@
+import signal
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.apps import apps
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from fpl import cache as cache_module, client, ratelimit
+from fpl.management.leagues import add_league_arguments, get_leagues
+from fpl.models import Gameweek
+
+
+class LeagueTimeout(Exception):
+    pass
+
+
+def _raise_timeout(signum, frame):
+    raise LeagueTimeout
+
+
+def refresh_league(model_label, pk, timeout=None):
+    """Process payouts for one league, returning (error, elapsed seconds). Runs in a worker process."""
+    league = apps.get_model(model_label).objects.select_related('league__season').get(pk=pk)
+    started = time.monotonic()
+    # SIGALRM interrupts the refresh itself, a timed out H2H refresh is rolled back with its transaction
+    alarm = timeout and hasattr(signal, 'SIGALRM')
+    if alarm:
+        signal.signal(signal.SIGALRM, _raise_timeout)
+        signal.alarm(timeout)
+    try:
+        league.process_payouts(refresh_calendar=False)
+    except LeagueTimeout:
+        return 'timed out after {} seconds'.format(timeout), time.monotonic() - started
+    except Exception as e:
+        return repr(e), time.monotonic() - started
+    finally:
+        if alarm:
+            signal.alarm(0)
+    return None, time.monotonic() - started
+
+
+def _close_connections():
+    # Worker processes must not share the parent's database connections, cache connections or the pooled HTTP
+    # sessions the parent created while fetching the gameweek calendar, or children would read each other's responses
+    django.setup()
+    connections.close_all()
+    for cache in caches.all():
+        cache.close()
+    client._client = None
+    client._authorized_clients = {}
+    client._authentication_locks = {}
+    ratelimit._rate_limiter = None
+    cache_module._response_cache = None
+
+
+class Command(BaseCommand):
+    help = 'Refresh classic and head to head leagues and process their payouts in parallel worker processes'
+
+    def add_arguments(self, parser):
+        add_league_arguments(parser)
+        parser.add_argument('--parallelism', type=int, default=4, help='Number of leagues refreshed at once')
+        parser.add_argument('--timeout', type=int, help='Abandon a league refresh after this many seconds')
+        parser.add_argument('--dry-run', action='store_true', help='List the leagues that would be refreshed')
+
+    def handle(self, *args, **options):
+        leagues = get_leagues(options)
+        if not leagues:
+            return
+        if options['dry_run']:
+            for league in leagues:
+                self.stdout.write('Would refresh {league}'.format(league=league))
+            return
+
+        # The gameweek calendar is shared by every league in a season, so it is refreshed once here
+        for season in {league.league.season for league in leagues}:
+            Gameweek.retrieve_gameweek_data(season)
+
+        tasks = [(league, (league._meta.label, league.pk, options['timeout'])) for league in leagues]
+        if options['parallelism'] == 1:
+            results = [refresh_league(*task) for _, task in tasks]
+        else:
+            connections.close_all()
+            with ProcessPoolExecutor(max_workers=options['parallelism'], initializer=_close_connections) as executor:
+                results = list(executor.map(refresh_league, *zip(*[task for _, task in tasks])))
+
+        failed = 0
+        for (league, _), (error, elapsed) in zip(tasks, results):
+            if error:
+                failed += 1
+                self.stderr.write('Failed to refresh {league} after {elapsed:.1f}s: {error}'.format(
+                    league=league, elapsed=elapsed, error=error))
+            else:
+                self.stdout.write('Refreshed {league} in {elapsed:.1f}s'.format(league=league, elapsed=elapsed))
+        if failed:
+            raise CommandError('{failed} of {total} leagues failed to refresh'.format(failed=failed, total=len(leagues)))
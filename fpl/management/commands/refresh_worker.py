@@ -0,0 +1,47 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from fpl.models import RefreshJob
+
+
+class Command(BaseCommand):
+    help = 'Run queued league refresh jobs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, help='Number of jobs to run at once, defaults to '
+                                                            'FPL_REFRESH_WORKER_CONCURRENCY')
+        parser.add_argument('--poll-interval', type=float, default=5,
+                            help='Seconds to wait before checking an empty queue again')
+        parser.add_argument('--once', action='store_true', help='Exit once no job is due instead of polling')
+
+    def work(self, poll_interval, once):
+        while True:
+            job = RefreshJob.claim()
+            if job is None:
+                if once:
+                    return
+                time.sleep(poll_interval)
+                continue
+            job.run()
+            self.stdout.write(str(job))
+
+    def work_in_thread(self, poll_interval, once):
+        try:
+            self.work(poll_interval, once)
+        finally:
+            connection.close()
+
+    def handle(self, *args, **options):
+        concurrency = options['concurrency'] or settings.FPL_REFRESH_WORKER_CONCURRENCY
+        if concurrency == 1:
+            self.work(options['poll_interval'], options['once'])
+            return
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            workers = [executor.submit(self.work_in_thread, options['poll_interval'], options['once'])
+                       for _ in range(concurrency)]
+            for worker in workers:
+                worker.result()
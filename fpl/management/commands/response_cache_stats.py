@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from fpl.cache import get_response_cache
+
+
+class Command(BaseCommand):
+    help = 'Show hits, misses and the hit rate of the FPL API response cache per endpoint'
+
+    def add_arguments(self, parser):
+        parser.add_argument('endpoints', nargs='*', metavar='ENDPOINT',
+                            help='Endpoints to show, defaults to those with a TTL in FPL_RESPONSE_CACHE')
+        parser.add_argument('--reset', action='store_true', help='Reset the counts after showing them')
+
+    def handle(self, *args, **options):
+        response_cache = get_response_cache()
+        if response_cache is None:
+            raise CommandError('FPL_RESPONSE_CACHE is not configured')
+        for endpoint, stats in response_cache.stats(options['endpoints']).items():
+            hit_rate = '-' if stats['hit_rate'] is None else '{:.1%}'.format(stats['hit_rate'])
+            self.stdout.write('{endpoint}: {hits} hits, {misses} misses, hit rate {hit_rate}'.format(
+                endpoint=endpoint, hits=stats['hits'], misses=stats['misses'], hit_rate=hit_rate))
+        if options['reset']:
+            response_cache.reset_stats(options['endpoints'])
@@ -0,0 +1,27 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from fpl.scheduler import plan_refreshes, schedule_refreshes
+
+
+class Command(BaseCommand):
+    help = 'Queue refreshes for leagues with a live or newly closed gameweek, for the refresh_worker command to run'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='List the refreshes that would be queued')
+        parser.add_argument('--loop', action='store_true',
+                            help='Keep scheduling every FPL_REFRESH_SCHEDULE INTERVAL seconds instead of once')
+
+    def schedule(self, dry_run):
+        planned = plan_refreshes() if dry_run else schedule_refreshes()
+        for league, reason in planned:
+            self.stdout.write('{action} {league} ({reason})'.format(
+                action='Would queue' if dry_run else 'Queued', league=league, reason=reason))
+
+    def handle(self, *args, **options):
+        self.schedule(options['dry_run'])
+        while options['loop']:
+            time.sleep(settings.FPL_REFRESH_SCHEDULE['INTERVAL'])
+            self.schedule(options['dry_run'])
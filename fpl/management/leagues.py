@@ -0,0 +1,28 @@
+import datetime
+
+from fpl.models import ClassicLeague, HeadToHeadLeague
+
+
+def add_league_arguments(parser):
+    parser.add_argument('--season', type=int, help='Season pk to refresh, defaults to seasons in progress')
+    parser.add_argument('--classic', nargs='+', type=int, default=[], metavar='PK',
+                        help='Only refresh these classic leagues')
+    parser.add_argument('--head-to-head', nargs='+', type=int, default=[], metavar='PK',
+                        help='Only refresh these head to head leagues')
+
+
+def get_leagues(options):
+    """Return the leagues selected by the options added by add_league_arguments."""
+    leagues = []
+    for league_type, pks in ((ClassicLeague, options['classic']), (HeadToHeadLeague, options['head_to_head'])):
+        queryset = league_type.objects.select_related('league__season')
+        if options['season']:
+            queryset = queryset.filter(league__season=options['season'])
+        elif not (options['classic'] or options['head_to_head']):
+            today = datetime.date.today()
+            queryset = queryset.filter(league__season__start_date__lte=today,
+                                       league__season__end_date__gt=today - datetime.timedelta(days=14))
+        if options['classic'] or options['head_to_head']:
+            queryset = queryset.filter(pk__in=pks)
+        leagues.extend(queryset)
+    return leagues
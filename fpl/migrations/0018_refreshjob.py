@@ -0,0 +1,39 @@
+# Generated by Django 2.1 on 2026-10-18 00:14
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('fpl', '0017_auto_20180816_2035'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RefreshJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('league_id', models.PositiveIntegerField()),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('succeeded', 'Succeeded'), ('failed', 'Failed')], default='queued', max_length=10)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('run_after', models.DateTimeField(default=django.utils.timezone.now)),
+                ('error', models.TextField(blank=True)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('started', models.DateTimeField(blank=True, null=True)),
+                ('finished', models.DateTimeField(blank=True, null=True)),
+                ('league_content_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='contenttypes.ContentType')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='refreshjob',
+            index=models.Index(fields=['status', 'run_after'], name='fpl_refresh_status_a2a55b_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='refreshjob',
+            index=models.Index(fields=['league_content_type', 'league_id'], name='fpl_refresh_league__babf59_idx'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 2.1 on 2026-10-18 00:31
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('fpl', '0018_refreshjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RefreshLease',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('league_id', models.PositiveIntegerField()),
+                ('owner', models.CharField(max_length=32)),
+                ('expires', models.DateTimeField()),
+                ('league_content_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='contenttypes.ContentType')),
+            ],
+            options={
+                'unique_together': {('league_content_type', 'league_id')},
+            },
+        ),
+    ]
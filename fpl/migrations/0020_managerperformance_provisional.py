@@ -0,0 +1,18 @@
+# Generated by Django 2.1 on 2026-10-18 00:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fpl', '0019_refreshlease'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='managerperformance',
+            name='provisional',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 2.1 on 2026-10-18 10:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('fpl', '0020_managerperformance_provisional'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LeagueStanding',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('league_id', models.PositiveIntegerField()),
+                ('score', models.IntegerField(null=True)),
+                ('h2h_score', models.IntegerField(null=True)),
+                ('rank', models.PositiveIntegerField()),
+                ('league_content_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='contenttypes.ContentType')),
+                ('manager', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='fpl.Manager')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='leaguestanding',
+            index=models.Index(fields=['league_content_type', 'league_id', 'rank'], name='fpl_leagues_league__a3c41a_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='leaguestanding',
+            unique_together={('league_content_type', 'league_id', 'manager')},
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 2.1 on 2026-10-18 11:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fpl', '0021_leaguestanding'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='classicleague',
+            name='standings_updated',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='headtoheadleague',
+            name='standings_updated',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+    ]
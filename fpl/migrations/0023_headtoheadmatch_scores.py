@@ -0,0 +1,23 @@
+# Generated by Django 2.1 on 2026-10-19 09:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fpl', '0022_standings_updated'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='headtoheadmatch',
+            name='manager_1_score',
+            field=models.IntegerField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='headtoheadmatch',
+            name='manager_2_score',
+            field=models.IntegerField(editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 2.1 on 2026-10-18 18:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fpl', '0023_headtoheadmatch_scores'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='classicleague',
+            name='manager_count',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='classicleague',
+            name='page_count',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='headtoheadleague',
+            name='manager_count',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='headtoheadleague',
+            name='page_count',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+    ]
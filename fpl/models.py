@@ -1,55 +1,182 @@
 import itertools
+import time
+import traceback
+import uuid
+from collections import defaultdict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 
 import datetime
 import decimal
-import requests
 from django.conf import settings
-from django.db import models, transaction
-from django.db.models import Sum, F, Max, Q
+from django.contrib.contenttypes.fields import GenericForeignKey
+from django.contrib.contenttypes.models import ContentType
+from django.db import IntegrityError, models, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.db.models import Sum, F, Max, Q, Exists, OuterRef, Subquery, Window
+from django.db.models.functions import Coalesce, DenseRank
 from django.utils import timezone
 from django.utils.dateparse import parse_datetime
 
+from fpl.cache import get_page_cache
+from fpl.client import get_authorized_client, get_client, iter_pages
+from fpl.db import bulk_upsert
 from leagues.models import League, Payout, LeagueEntrant, Season
 
-BASE_URL = 'https://fantasy.premierleague.com/drf/'
-
 
 class FPLLeague(models.Model):
     league = models.OneToOneField(League, on_delete=models.CASCADE)
     fpl_league_id = models.IntegerField()
     last_updated = models.DateTimeField(null=True, blank=True, editable=False)
+    # Moves with last_updated and also when live points change the standings between refreshes
+    standings_updated = models.DateTimeField(null=True, blank=True, editable=False)
+    # Entries and pages seen by the last refresh, which fpl.scheduler estimates the next refresh's requests from
+    manager_count = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    page_count = models.PositiveIntegerField(null=True, blank=True, editable=False)
+
+    # Standings attribute managers are ranked by
+    rank_by = 'current_score'
 
     @property
     def managers(self):
-        # TODO: Add tests for season scores
-        managers = Manager.objects.filter(
+        # Totals are read from the league's standings, which rebuild_standings keeps up to date at ingest time
+        if self.standings_updated is None:
+            # Built on first read for leagues ingested before standings existed, finished seasons are never refreshed
+            self.rebuild_standings()
+        return Manager.objects.filter(
+            leaguestanding__league_content_type=ContentType.objects.get_for_model(self),
+            leaguestanding__league_id=self.pk,
+            entrant__leagueentrant__league=self.league
+        ).annotate(current_score=F('leaguestanding__score'),
+                   current_h2h_score=F('leaguestanding__h2h_score'),
+                   paid_entry=F('entrant__leagueentrant__paid_entry')
+                   ).select_related('entrant').order_by('leaguestanding__rank', '-leaguestanding__score')
+
+    def standings(self):
+        """Return the league's managers annotated with their current_score, best first."""
+        return Manager.objects.filter(
             entrant__leagueentrant__league=self.league,
             season=self.league.season
-        ).annotate(current_score=Sum('managerperformance__score'),
-                   paid_entry=F('entrant__leagueentrant__paid_entry')).order_by('-current_score')
+        ).annotate(current_score=Sum('managerperformance__score')).order_by('-current_score')
 
-        return managers
+    @transaction.atomic
+    def rebuild_standings(self):
+        """Replace the league's LeagueStanding rows with totals computed by standings."""
+        content_type = ContentType.objects.get_for_model(self)
+        LeagueStanding.objects.filter(league_content_type=content_type, league_id=self.pk).delete()
+        league_standings = []
+        rank = previous_score = None
+        for position, manager in enumerate(self.standings(), start=1):
+            score = getattr(manager, self.rank_by)
+            # Tied managers share the higher rank
+            if rank is None or score != previous_score:
+                rank, previous_score = position, score
+            league_standings.append(LeagueStanding(
+                league_content_type=content_type,
+                league_id=self.pk,
+                manager=manager,
+                score=manager.current_score,
+                h2h_score=getattr(manager, 'current_h2h_score', None),
+                rank=rank
+            ))
+        LeagueStanding.objects.bulk_create(league_standings)
+        self.standings_updated = timezone.now()
+        type(self).objects.filter(pk=self.pk).update(standings_updated=self.standings_updated)
+        transaction.on_commit(self.invalidate_page_cache)
+
+    @staticmethod
+    def invalidate_standings(**filters):
+        """Have the standings of the leagues matching filters rebuilt on their next read."""
+        for model in (ClassicLeague, HeadToHeadLeague):
+            model.objects.filter(**filters).update(standings_updated=None)
+
+    def invalidate_page_cache(self):
+        page_cache = get_page_cache()
+        if page_cache is not None:
+            page_cache.invalidate(self)
 
     @staticmethod
     def update_last_updated(func):
-        def func_wrapper(self):
+        def func_wrapper(self, *args, **kwargs):
             output = None
             if datetime.date.today() < self.league.season.end_date + datetime.timedelta(days=14):
-                output = func(self)
+                output = func(self, *args, **kwargs)
                 self.last_updated = timezone.now()
                 self.save()
             return output
 
         return func_wrapper
 
-    def retrieve_league_data(self):
+    def retrieve_league_data(self, pages=None, histories=None):
         raise NotImplementedError
 
-    def _process_payouts(self, payout_proxy):
+    def live_managers(self):
+        return Manager.objects.filter(entrant__leagueentrant__league=self.league, season=self.league.season)
+
+    def retrieve_live_points(self):
+        """Store provisional points for the league's managers if its season has a gameweek in progress."""
+        return FPLLeague.bulk_retrieve_live_points([self])[self]
+
+    @staticmethod
+    def bulk_retrieve_live_points(leagues):
+        """Store provisional points for the managers of leagues whose season has a gameweek in progress.
+
+        Managers are shared by every league in a season, so each is polled once however many leagues it is in. Only
+        leagues with a manager whose points changed have their standings rebuilt. Returns {league: (manager_id,
+        gameweek_id) of the league's changed performances}.
+        """
+        leagues_by_season = defaultdict(list)
+        for league in leagues:
+            leagues_by_season[league.league.season].append(league)
+        changed = {}
+        for season, season_leagues in leagues_by_season.items():
+            gameweek = Gameweek.live(season)
+            if gameweek is None:
+                changed.update((league, set()) for league in season_leagues)
+                continue
+            league_managers = {league: list(league.live_managers()) for league in season_leagues}
+            managers = {manager.pk: manager for managers in league_managers.values() for manager in managers}
+            changed_performances = Manager.bulk_retrieve_live_points(list(managers.values()), gameweek)
+            for league, managers in league_managers.items():
+                manager_ids = {manager.pk for manager in managers}
+                changed[league] = {performance for performance in changed_performances
+                                   if performance[0] in manager_ids}
+                if changed[league]:
+                    league.rebuild_standings()
+        return changed
+
+    @contextmanager
+    def single_flight(self):
+        """Yield True while holding this league's refresh lease, or False once a concurrent refresh has finished."""
+        owner = RefreshLease.acquire(self)
+        if owner is None:
+            deadline = time.monotonic() + settings.FPL_REFRESH_JOB_TIMEOUT
+            while RefreshLease.held(self) and time.monotonic() < deadline:
+                time.sleep(settings.FPL_REFRESH_LOCK_POLL_INTERVAL)
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            RefreshLease.release(self, owner)
+
+    def _process_payouts(self, payout_proxy, data=None, refresh_calendar=True):
+        # data optionally holds prefetched API responses (see fpl.aio.fetch_leagues) keyed by endpoint. Callers
+        # refreshing many leagues retrieve the gameweek calendar once themselves and pass refresh_calendar=False.
+        with self.single_flight() as leader:
+            if leader:
+                self._refresh(payout_proxy, data or {}, refresh_calendar)
+            else:
+                # Another process refreshed the league while this one waited, reuse its result
+                self.refresh_from_db(fields=['last_updated'])
+
+    def _refresh(self, payout_proxy, data, refresh_calendar):
         final_gameday = Gameweek.objects.filter(season=self.league.season).aggregate(final_gameday=Max('end_date'))[
             'final_gameday']
-        Gameweek.retrieve_gameweek_data(self.league.season)
-        self.retrieve_league_data()
+        if refresh_calendar:
+            Gameweek.retrieve_gameweek_data(self.league.season, data.get('fixtures'), data.get('bootstrap-static'))
+        self.retrieve_league_data(data.get('pages'), data.get('histories'))
 
         most_recent_gameweek_id = Gameweek.objects.filter(
             season=self.league.season,
@@ -65,18 +192,11 @@ class FPLLeague(models.Model):
         for payout in unfinalised_payouts:
             payout.refresh_from_db()
             payout.calculate_winner()
+        self.invalidate_page_cache()
 
     @staticmethod
     def get_authorized_session():
-        # TODO: Cache cookies
-        session = requests.Session()
-        session.get('https://fantasy.premierleague.com')
-        session.post('https://users.premierleague.com/accounts/login/',
-                     data={'csrfmiddlewaretoken': session.cookies['csrftoken'], 'login': settings.FPL_USERNAME,
-                           'password': settings.FPL_PASSWORD, 'app': 'plfpl-web',
-                           'redirect_uri': 'https://fantasy.premierleague.com/a/login'})
-
-        return session
+        return get_authorized_client(settings.FPL_USERNAME, settings.FPL_PASSWORD)
 
     def __str__(self):
         return str(self.league)
@@ -86,76 +206,115 @@ class FPLLeague(models.Model):
 
 
 class ClassicLeague(FPLLeague):
-    def process_payouts(self):
-        self._process_payouts(ClassicPayout)
-
-    @FPLLeague.update_last_updated
-    def retrieve_league_data(self):
-        response = requests.get(
-            BASE_URL + 'leagues-classic-standings/{fpl_league_id}'.format(
-                fpl_league_id=self.fpl_league_id
+    def process_payouts(self, data=None, refresh_calendar=True):
+        self._process_payouts(ClassicPayout, data, refresh_calendar)
+
+    def fetch_page(self, page_number):
+        return get_client().get(
+            'leagues-classic-standings/{fpl_league_id}?ls-page={page_number}'.format(
+                fpl_league_id=self.fpl_league_id,
+                page_number=page_number
             )
         )
-        data = response.json()
-        self.league.name = data['league']['name']
-        self.league.save()
-        for manager in data['standings']['results']:
-            manager, _ = Manager.objects.update_or_create(
-                season=self.league.season,
-                fpl_manager_id=manager['entry'],
-                defaults={
-                    'team_name': manager['entry_name']
-                }
-            )
-            manager.retrieve_performance_data(self.league.season)
+
+    def iter_pages(self):
+        return iter_pages(self.fetch_page, lambda page: page['standings']['has_next'])
+
+    @FPLLeague.update_last_updated
+    def retrieve_league_data(self, pages=None, histories=None):
+        # Pages are processed as they arrive so memory is bounded by two pages, not the league size
+        if pages is None:
+            pages = self.iter_pages()
+        gameweek_ids = Gameweek.ids_by_number(self.league.season)
+        self.manager_count = self.page_count = 0
+        for page_number, data in enumerate(pages, start=1):
+            if page_number == 1:
+                self.league.name = data['league']['name']
+                self.league.save()
+            self.manager_count += len(data['standings']['results'])
+            self.page_count = page_number
+            managers = []
+            for manager in data['standings']['results']:
+                manager, _ = Manager.objects.update_or_create(
+                    season=self.league.season,
+                    fpl_manager_id=manager['entry'],
+                    defaults={
+                        'team_name': manager['entry_name']
+                    }
+                )
+                managers.append(manager)
+            Manager.bulk_retrieve_performance_data(managers, self.league.season, histories, gameweek_ids)
+        self.rebuild_standings()
 
 
 class HeadToHeadLeague(FPLLeague):
+    rank_by = 'current_h2h_score'
 
-    @property
-    def managers(self):
-        # TODO: Add tests for season scores
-        managers = super().managers
-        # Can't use annotate again due to https://code.djangoproject.com/ticket/10060
-        for manager in managers:
-            manager.current_h2h_score = HeadToHeadPerformance.objects.filter(
-                manager=manager
-            ).aggregate(
-                current_h2h_score=Sum('score')
-            )['current_h2h_score']
-        managers = sorted(managers, key=lambda x: x.current_h2h_score, reverse=True)
-        return managers
+    def standings(self):
+        """Return the league's managers annotated with their current_score and current_h2h_score, best first."""
+        def total(performances):
+            # A correlated subquery per total, as annotating two Sums over separate joins multiplies the rows summed
+            return Coalesce(Subquery(performances.filter(
+                manager=OuterRef('pk')
+            ).values('manager').annotate(total=Sum('score')).values('total')[:1], output_field=models.IntegerField()), 0)
 
-    def process_payouts(self):
-        self._process_payouts(HeadToHeadPayout)
+        return Manager.objects.filter(
+            entrant__leagueentrant__league=self.league,
+            season=self.league.season
+        ).annotate(
+            current_score=total(ManagerPerformance.objects.all()),
+            current_h2h_score=total(HeadToHeadPerformance.objects.filter(h2h_league=self))
+        ).order_by('-current_h2h_score', '-current_score')
+
+    def live_managers(self):
+        # Opponents play every match whether or not they are linked to an entrant, AVERAGE has no picks to poll
+        return Manager.objects.filter(
+            Q(entrant__leagueentrant__league=self.league) |
+            Q(pk__in=HeadToHeadMatch.objects.filter(h2h_league=self).values('manager_1')) |
+            Q(pk__in=HeadToHeadMatch.objects.filter(h2h_league=self).values('manager_2')),
+            season=self.league.season,
+            fpl_manager_id__gt=0
+        ).distinct()
 
-    @transaction.atomic
-    @FPLLeague.update_last_updated
-    def retrieve_league_data(self):
-        data = {
-            'matches': {
-                'results': []
-            }
-        }
-        has_next = True
-        page_number = 1
-        session = self.get_authorized_session()
-        while has_next:
-            response = session.get(
-                BASE_URL + 'leagues-entries-and-h2h-matches/league/{fpl_league_id}?page={page_number}'.format(
+    def process_payouts(self, data=None, refresh_calendar=True):
+        self._process_payouts(HeadToHeadPayout, data, refresh_calendar)
+
+    def iter_pages(self):
+        client = self.get_authorized_session()
+        return iter_pages(
+            lambda page_number: client.get(
+                'leagues-entries-and-h2h-matches/league/{fpl_league_id}?page={page_number}'.format(
                     fpl_league_id=self.fpl_league_id,
                     page_number=page_number
                 )
-            )
-            new_data = response.json()
-            data['league'] = new_data['league']
-            data['league-entries'] = new_data['league-entries']
-            data['matches']['results'] = data['matches']['results'] + new_data['matches']['results']
-            page_number += 1
-            has_next = new_data['matches']['has_next']
+            ),
+            lambda page: page['matches']['has_next']
+        )
 
+    @transaction.atomic
+    @FPLLeague.update_last_updated
+    def retrieve_league_data(self, pages=None, histories=None):
+        # Each page is applied as it arrives, in API order, so at most two pages are held in memory
+        if pages is None:
+            pages = self.iter_pages()
+        gameweek_ids = Gameweek.ids_by_number(self.league.season)
+        average_manager_id = manager_ids = None
+        changed_matches = set()
+        for page_number, data in enumerate(pages, start=1):
+            if page_number == 1:
+                average_manager_id, _ = self.update_league_entries(data, histories, gameweek_ids)
+                manager_ids = Manager.ids_by_fpl_id(self.league.season)
+                self.manager_count = len(data['league-entries'])
+            self.page_count = page_number
+            changed_matches |= self.update_matches(data['matches']['results'], average_manager_id, gameweek_ids,
+                                                   manager_ids)
+        self.score_completed_matches(changed_matches)
+        self.rebuild_standings()
+
+    def update_league_entries(self, data, histories=None, gameweek_ids=None):
         self.league.name = data['league']['name']
         self.league.save()
+        managers = []
         for manager in data['league-entries']:
             manager, _ = Manager.objects.update_or_create(
                 season=self.league.season,
@@ -164,7 +323,10 @@ class HeadToHeadLeague(FPLLeague):
                     'team_name': manager['entry_name']
                 }
             )
-            manager.retrieve_performance_data(self.league.season)
+            managers.append(manager)
+        changed_performances = Manager.bulk_retrieve_performance_data(managers, self.league.season, histories,
+                                                                      gameweek_ids)
+        average_manager_id = None
         if len(data['league-entries']) % 2 != 0:
             average_manager_id = -1 * int(self.fpl_league_id) # Unique ID needed for each league with an AVERAGE manager
             manager, _ = Manager.objects.update_or_create(
@@ -174,37 +336,76 @@ class HeadToHeadLeague(FPLLeague):
                     'team_name': 'AVERAGE'
                 }
             )
-
-        for match in data['matches']['results']:
+        return average_manager_id, changed_performances
+
+    def update_matches(self, matches, average_manager_id=None, gameweek_ids=None, manager_ids=None):
+        if gameweek_ids is None:
+            gameweek_ids = Gameweek.ids_by_number(self.league.season)
+        if manager_ids is None:
+            manager_ids = Manager.ids_by_fpl_id(self.league.season)
+        h2h_matches = []
+        performances = {}
+        for match in matches:
             manager_1_id = match['entry_1_entry']
             if manager_1_id is None and match['entry_1_name'] == 'AVERAGE':
                 manager_1_id = average_manager_id
             manager_2_id = match['entry_2_entry']
             if manager_2_id is None and match['entry_2_name'] == 'AVERAGE':
                 manager_2_id = average_manager_id
-            manager_1 = Manager.objects.get(fpl_manager_id=manager_1_id)
-            manager_2 = Manager.objects.get(fpl_manager_id=manager_2_id)
-            h2h_match, _ = HeadToHeadMatch.objects.update_or_create(
-                fpl_match_id=match['id'],
+            h2h_match = {
+                'fpl_match_id': match['id'],
+                'h2h_league_id': self.pk,
+                'gameweek_id': gameweek_ids[match['event']],
+                'manager_1_id': manager_ids[manager_1_id],
+                'manager_2_id': manager_ids[manager_2_id]
+            }
+            h2h_matches.append(h2h_match)
+            # Keyed so a manager appearing twice in a gameweek cannot hit the same row twice in one upsert
+            for manager_id, points in ((h2h_match['manager_1_id'], match['entry_1_points']),
+                                       (h2h_match['manager_2_id'], match['entry_2_points'])):
+                performances[manager_id, h2h_match['gameweek_id']] = {
+                    'manager_id': manager_id,
+                    'gameweek_id': h2h_match['gameweek_id'],
+                    'score': points,
+                    'provisional': False
+                }
+        changed_matches = bulk_upsert(HeadToHeadMatch, h2h_matches, unique_fields=('fpl_match_id',),
+                                      update_fields=('h2h_league_id', 'gameweek_id', 'manager_1_id', 'manager_2_id'),
+                                      returning=('id',))
+        ManagerPerformance.bulk_upsert(list(performances.values()))
+        # New or reassigned matches need scoring even if neither manager's score changed
+        return {match_id for match_id, in changed_matches}
+
+    def score_completed_matches(self, changed_matches=()):
+        """Score this league's completed matches that are unscored, changed, or scored from since changed performances.
+
+        changed_matches holds the ids of the matches update_matches created or reassigned. Performances are shared by
+        every league in the season, so a score corrected while refreshing another league is picked up here as well.
+        """
+        if changed_matches:
+            # A manager moved out of a match keeps no score for its gameweek unless another match gives them one
+            HeadToHeadPerformance.objects.filter(
                 h2h_league=self,
-                gameweek=Gameweek.objects.get(number=match['event'], season=self.league.season),
-                manager_1=manager_1,
-                manager_2=manager_2
-            )
-            ManagerPerformance.objects.update_or_create(manager=manager_1, gameweek=h2h_match.gameweek,
-                                                        score=match['entry_1_points'])
-            ManagerPerformance.objects.update_or_create(manager=manager_2, gameweek=h2h_match.gameweek,
-                                                        score=match['entry_2_points'])
-
-        # TODO: Fix redundant query/iteration
+                gameweek__in=HeadToHeadMatch.objects.filter(pk__in=changed_matches).values('gameweek')
+            ).annotate(in_match=Exists(HeadToHeadMatch.objects.filter(
+                h2h_league=self,
+                gameweek=OuterRef('gameweek')
+            ).filter(Q(manager_1=OuterRef('manager')) | Q(manager_2=OuterRef('manager'))))).filter(
+                in_match=False
+            ).delete()
         most_recent_gameweek = Gameweek.objects.filter(
             season=self.league.season,
             end_date__lte=datetime.date.today()
         ).aggregate(most_recent_gameweek=models.Max('number'))['most_recent_gameweek']
-        completed_h2h_matches = HeadToHeadMatch.objects.filter(h2h_league__league__season=self.league.season,
-                                                               gameweek__number__lte=most_recent_gameweek)
-        for h2h_match in completed_h2h_matches:
-            h2h_match.calculate_score()
+        stale_h2h_matches = HeadToHeadMatch.objects.filter(
+            h2h_league=self,
+            gameweek__number__lte=most_recent_gameweek
+        ).filter(
+            Q(pk__in=changed_matches) | Q(manager_1_score=None) | Q(manager_2_score=None) |
+            ~Q(manager_1_score=HeadToHeadMatch.performance('manager_1')) |
+            ~Q(manager_2_score=HeadToHeadMatch.performance('manager_2'))
+        )
+        HeadToHeadMatch.bulk_calculate_scores(stale_h2h_matches)
 
 
 class Manager(models.Model):
@@ -213,22 +414,96 @@ class Manager(models.Model):
     team_name = models.CharField(max_length=50)
     fpl_manager_id = models.IntegerField()
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        manager = super().from_db(db, field_names, values)
+        # Kept so that saving can tell when the manager was linked to a different entrant
+        manager._loaded_entrant_id = dict(zip(field_names, values)).get('entrant_id')
+        return manager
+
+    def fetch_performance_data(self):
+        return get_client().get(
+            'entry/{fpl_manager_id}/history'.format(
+                fpl_manager_id=self.fpl_manager_id
+            )
+        )
+
+    def performance_rows(self, data, gameweek_ids):
+        return [
+            {
+                'manager_id': self.pk,
+                'gameweek_id': gameweek_ids[gameweek['event']],
+                'score': gameweek['points'] - gameweek['event_transfers_cost'],
+                'provisional': False
+            }
+            for gameweek in data['history']
+        ]
+
+    def update_performance_data(self, season, data, gameweek_ids=None):
+        if gameweek_ids is None:
+            gameweek_ids = Gameweek.ids_by_number(season)
+        ManagerPerformance.bulk_upsert(self.performance_rows(data, gameweek_ids))
+
     def retrieve_performance_data(self, season):
         if datetime.date.today() < season.end_date + datetime.timedelta(days=14):
-            response = requests.get(
-                BASE_URL + 'entry/{fpl_manager_id}/history'.format(
-                    fpl_manager_id=self.fpl_manager_id
-                )
+            self.update_performance_data(season, self.fetch_performance_data())
+
+    @staticmethod
+    def ids_by_fpl_id(season):
+        """Return {fpl_manager_id: manager pk} for season's managers."""
+        return dict(Manager.objects.filter(season=season).values_list('fpl_manager_id', 'pk'))
+
+    @staticmethod
+    def bulk_retrieve_performance_data(managers, season, histories=None, gameweek_ids=None, max_workers=None):
+        # Histories are fetched concurrently but written on the calling thread so DB work stays in its transaction
+        if datetime.date.today() < season.end_date + datetime.timedelta(days=14):
+            histories = dict(histories or {})
+            missing = [manager for manager in managers if manager.fpl_manager_id not in histories]
+            with ThreadPoolExecutor(max_workers=max_workers or settings.FPL_MAX_WORKERS) as executor:
+                for manager, data in zip(missing, executor.map(Manager.fetch_performance_data, missing)):
+                    histories[manager.fpl_manager_id] = data
+            if gameweek_ids is None:
+                gameweek_ids = Gameweek.ids_by_number(season)
+            return ManagerPerformance.bulk_upsert([
+                row
+                for manager in managers
+                for row in manager.performance_rows(histories[manager.fpl_manager_id], gameweek_ids)
+            ])
+        return set()
+
+    def fetch_picks(self, gameweek_number):
+        return get_client().get(
+            'entry/{fpl_manager_id}/event/{gameweek_number}/picks'.format(
+                fpl_manager_id=self.fpl_manager_id,
+                gameweek_number=gameweek_number
             )
-            data = response.json()
-            for gameweek in data['history']:
-                manager_performance, _ = ManagerPerformance.objects.update_or_create(
-                    manager=self,
-                    gameweek=Gameweek.objects.get(number=gameweek['event'], season=season),
-                    defaults={
-                        'score': gameweek['points'] - gameweek['event_transfers_cost']
-                    }
-                )
+        )
+
+    @staticmethod
+    def live_score(picks, element_points):
+        score = sum(element_points.get(pick['element'], 0) * pick['multiplier'] for pick in picks['picks'])
+        return score - picks['entry_history']['event_transfers_cost']
+
+    @staticmethod
+    def bulk_retrieve_live_points(managers, gameweek, max_workers=None):
+        """Store managers' in-progress points for gameweek as provisional performances with one upsert.
+
+        Live element points are fetched once per call and picks once per manager, both through the response cache
+        so frequent polling of many leagues stays within its TTLs.
+        """
+        live = get_client().get('event/{number}/live'.format(number=gameweek.number))
+        element_points = Gameweek.element_points(live)
+        with ThreadPoolExecutor(max_workers=max_workers or settings.FPL_MAX_WORKERS) as executor:
+            picks = list(executor.map(lambda manager: manager.fetch_picks(gameweek.number), managers))
+        return ManagerPerformance.bulk_upsert([
+            {
+                'manager_id': manager.pk,
+                'gameweek_id': gameweek.pk,
+                'score': Manager.live_score(manager_picks, element_points),
+                'provisional': True
+            }
+            for manager, manager_picks in zip(managers, picks)
+        ])
 
     def __str__(self):
         return '{team_name} - {entrant}'.format(team_name=self.team_name, entrant=self.entrant)
@@ -244,11 +519,37 @@ class Gameweek(models.Model):
     end_date = models.DateField()
 
     @staticmethod
-    def retrieve_gameweek_data(season):
+    def ids_by_number(season):
+        """Return {gameweek number: gameweek pk} for season, loaded once per refresh and passed to ingestion."""
+        return dict(Gameweek.objects.filter(season=season).values_list('number', 'pk'))
+
+    @staticmethod
+    def live(season):
+        """Return season's gameweek in progress, or None."""
+        today = datetime.date.today()
+        return Gameweek.objects.filter(season=season, start_date__lte=today, end_date__gt=today).first()
+
+    @staticmethod
+    def element_points(live):
+        """Return {element id: points} from an event/{number}/live response."""
+        elements = live['elements']
+        if isinstance(elements, dict):
+            elements = [dict(element, id=int(element_id)) for element_id, element in elements.items()]
+        return {element['id']: element['stats']['total_points'] for element in elements}
+
+    @staticmethod
+    def retrieve_gameweek_data(season, fixtures=None, bootstrap_static=None):
         today = datetime.date.today()
         if season.start_date < today < season.end_date + datetime.timedelta(days=14):
-            fixtures_response = requests.get(BASE_URL + 'fixtures')
-            fixtures = fixtures_response.json()
+            client = get_client()
+            fixtures_modified = bootstrap_static_modified = True
+            if fixtures is None:
+                fixtures, fixtures_modified = client.get_conditional('fixtures')
+            if bootstrap_static is None:
+                bootstrap_static, bootstrap_static_modified = client.get_conditional('bootstrap-static')
+            if not (fixtures_modified or bootstrap_static_modified) and Gameweek.objects.filter(season=season).exists():
+                return
+
             gameweek_end_dates = {}
             for fixture in fixtures:
                 if fixture['kickoff_time'] and fixture['event']:
@@ -257,9 +558,7 @@ class Gameweek(models.Model):
                     if end_date >= gameweek_end_dates.get(gameweek, end_date):
                         gameweek_end_dates[gameweek] = end_date
 
-            response = requests.get(BASE_URL + 'bootstrap-static')
-            data = response.json()
-            for event in data['events']:
+            for event in bootstrap_static['events']:
                 gameweek, _ = Gameweek.objects.update_or_create(
                     season=season,
                     number=event['id'],
@@ -283,6 +582,14 @@ class ManagerPerformance(models.Model):
     manager = models.ForeignKey(Manager, on_delete=models.CASCADE)
     gameweek = models.ForeignKey(Gameweek, on_delete=models.CASCADE)
     score = models.IntegerField()
+    # Live points for a gameweek in progress, replaced by the manager's history once the gameweek is finalised
+    provisional = models.BooleanField(default=False)
+
+    @staticmethod
+    def bulk_upsert(rows):
+        """Upsert rows, returning the (manager_id, gameweek_id) of every performance that was created or changed."""
+        return set(bulk_upsert(ManagerPerformance, rows, unique_fields=('manager_id', 'gameweek_id'),
+                               update_fields=('score', 'provisional'), returning=('manager_id', 'gameweek_id')))
 
     def __str__(self):
         return '{manager} - {gameweek}: {score}'.format(
@@ -301,21 +608,31 @@ class HeadToHeadMatch(models.Model):
     gameweek = models.ForeignKey(Gameweek, on_delete=models.CASCADE)
     manager_1 = models.ForeignKey(Manager, on_delete=models.CASCADE, related_name='+')
     manager_2 = models.ForeignKey(Manager, on_delete=models.CASCADE, related_name='+')
+    # The ManagerPerformance scores the match was last scored from
+    manager_1_score = models.IntegerField(null=True, editable=False)
+    manager_2_score = models.IntegerField(null=True, editable=False)
+
+    @staticmethod
+    def performance(manager):
+        """Return the score of the match's manager_1 or manager_2 in its gameweek as a subquery."""
+        return Subquery(ManagerPerformance.objects.filter(
+            manager=OuterRef(manager),
+            gameweek=OuterRef('gameweek')
+        ).values('score')[:1])
+
+    @staticmethod
+    def points(manager_1_performance, manager_2_performance):
+        if manager_1_performance == manager_2_performance:
+            return 1, 1
+        elif manager_1_performance > manager_2_performance:
+            return 3, 0
+        return 0, 3
 
     @transaction.atomic
     def calculate_score(self):
         manager_1_performance = ManagerPerformance.objects.get(manager=self.manager_1, gameweek=self.gameweek).score
         manager_2_performance = ManagerPerformance.objects.get(manager=self.manager_2, gameweek=self.gameweek).score
-
-        if manager_1_performance == manager_2_performance:
-            manager_1_score = 1
-            manager_2_score = 1
-        elif manager_1_performance > manager_2_performance:
-            manager_1_score = 3
-            manager_2_score = 0
-        else:
-            manager_1_score = 0
-            manager_2_score = 3
+        manager_1_score, manager_2_score = self.points(manager_1_performance, manager_2_performance)
 
         HeadToHeadPerformance.objects.update_or_create(h2h_league=self.h2h_league,
                                                        manager=self.manager_1,
@@ -329,6 +646,51 @@ class HeadToHeadMatch(models.Model):
                                                        defaults={
                                                            'score': manager_2_score
                                                        })
+        self.manager_1_score = manager_1_performance
+        self.manager_2_score = manager_2_performance
+        self.save(update_fields=['manager_1_score', 'manager_2_score'])
+
+    @staticmethod
+    def bulk_calculate_scores(h2h_matches):
+        """Score every match in the h2h_matches queryset with one read and two upserts, as calculate_score would."""
+        h2h_matches = h2h_matches.annotate(
+            manager_1_performance=HeadToHeadMatch.performance('manager_1'),
+            manager_2_performance=HeadToHeadMatch.performance('manager_2')
+        ).values('fpl_match_id', 'h2h_league_id', 'gameweek_id', 'manager_1_id', 'manager_2_id',
+                 'manager_1_performance', 'manager_2_performance')
+        h2h_performances = []
+        scored_matches = []
+        unscorable_matches = []
+        for h2h_match in h2h_matches:
+            # Like calculate_score, a match cannot be scored without both managers' performances
+            if h2h_match['manager_1_performance'] is None or h2h_match['manager_2_performance'] is None:
+                unscorable_matches.append(h2h_match['fpl_match_id'])
+                continue
+            scores = HeadToHeadMatch.points(h2h_match['manager_1_performance'], h2h_match['manager_2_performance'])
+            for manager_id, score in zip((h2h_match['manager_1_id'], h2h_match['manager_2_id']), scores):
+                h2h_performances.append({
+                    'h2h_league_id': h2h_match['h2h_league_id'],
+                    'manager_id': manager_id,
+                    'gameweek_id': h2h_match['gameweek_id'],
+                    'score': score
+                })
+            scored_matches.append({
+                'fpl_match_id': h2h_match['fpl_match_id'],
+                'h2h_league_id': h2h_match['h2h_league_id'],
+                'gameweek_id': h2h_match['gameweek_id'],
+                'manager_1_id': h2h_match['manager_1_id'],
+                'manager_2_id': h2h_match['manager_2_id'],
+                'manager_1_score': h2h_match['manager_1_performance'],
+                'manager_2_score': h2h_match['manager_2_performance']
+            })
+        if unscorable_matches:
+            raise ManagerPerformance.DoesNotExist(
+                'Missing ManagerPerformance for H2H matches {}'.format(', '.join(map(str, unscorable_matches)))
+            )
+        bulk_upsert(HeadToHeadPerformance, h2h_performances,
+                    unique_fields=('h2h_league_id', 'manager_id', 'gameweek_id'), update_fields=('score',))
+        bulk_upsert(HeadToHeadMatch, scored_matches, unique_fields=('fpl_match_id',),
+                    update_fields=('manager_1_score', 'manager_2_score'))
 
 
 class HeadToHeadPerformance(models.Model):
@@ -341,22 +703,35 @@ class HeadToHeadPerformance(models.Model):
         unique_together = ('h2h_league', 'manager', 'gameweek')
 
 
+class LeagueStanding(models.Model):
+    """A manager's totals and rank in a ClassicLeague or HeadToHeadLeague, see FPLLeague.rebuild_standings."""
+    league_content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    league_id = models.PositiveIntegerField()
+    league = GenericForeignKey('league_content_type', 'league_id')
+    manager = models.ForeignKey(Manager, on_delete=models.CASCADE)
+    score = models.IntegerField(null=True)
+    h2h_score = models.IntegerField(null=True)
+    rank = models.PositiveIntegerField()
+
+    def __str__(self):
+        return '{league} - {rank}: {manager}'.format(league=self.league, rank=self.rank, manager=self.manager)
+
+    class Meta:
+        unique_together = ('league_content_type', 'league_id', 'manager')
+        indexes = [
+            models.Index(fields=['league_content_type', 'league_id', 'rank']),
+        ]
+
+
 class FPLPayout(Payout):
     def _calculate_winner(self, managers):
-        if not managers:
-            raise ValueError('Cannot calculate payout without participating managers')
-
-        # TODO: Move processing to DB with a window function in Django 2.0
-        current_rank = {
-            'rank': 0,
-            'score': None
-        }
+        # Tied scores share a rank and the next score takes the following rank
+        managers = managers.annotate(rank=Window(expression=DenseRank(), order_by=F('score').desc()))
+        managers_by_rank = defaultdict(list)
         for manager in managers:
-            if manager.score != current_rank['score']:
-                current_rank['rank'] += 1
-                current_rank['score'] = manager.score
-
-            manager.rank = current_rank['rank']
+            managers_by_rank[manager.rank].append(manager)
+        if not managers_by_rank:
+            raise ValueError('Cannot calculate payout without participating managers')
 
         related_payouts = Payout.objects.filter(
             league=self.league,
@@ -369,7 +744,7 @@ class FPLPayout(Payout):
         )
 
         for payout in itertools.chain(related_payouts, [self]):
-            payout.winning_managers = [manager for manager in managers if manager.rank == payout.position]
+            payout.winning_managers = managers_by_rank[payout.position]
             if len(payout.winning_managers) > 1 and related_payouts:
                 raise NotImplementedError(
                     'Payouts with multiple positions involving ties must be manually resolved'
@@ -441,3 +816,162 @@ class HeadToHeadPayout(FPLPayout):
 
     class Meta:
         proxy = True
+
+
+class RefreshJob(models.Model):
+    """Queued process_payouts run for a ClassicLeague or HeadToHeadLeague, executed by the refresh_worker command."""
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (SUCCEEDED, 'Succeeded'),
+        (FAILED, 'Failed'),
+    )
+
+    league_content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    league_id = models.PositiveIntegerField()
+    league = GenericForeignKey('league_content_type', 'league_id')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    attempts = models.PositiveIntegerField(default=0)
+    # Earliest time a queued job may start, or when a running job's lease expires and it may be claimed again
+    run_after = models.DateTimeField(default=timezone.now)
+    error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    started = models.DateTimeField(null=True, blank=True)
+    finished = models.DateTimeField(null=True, blank=True)
+
+    @staticmethod
+    def for_league(league):
+        return RefreshJob.objects.filter(
+            league_content_type=ContentType.objects.get_for_model(league),
+            league_id=league.pk
+        )
+
+    @staticmethod
+    def enqueue(league, run_after=None):
+        """Queue a refresh of league, returning the already queued or running job for it if there is one."""
+        with transaction.atomic():
+            # Locking the league serialises enqueues for it, as there may be no job row to lock yet
+            type(league).objects.select_for_update().get(pk=league.pk)
+            job = RefreshJob.for_league(league).filter(status__in=[RefreshJob.QUEUED, RefreshJob.RUNNING]).first()
+            if job is None:
+                job = RefreshJob.objects.create(league=league, run_after=run_after or timezone.now())
+        return job
+
+    @staticmethod
+    def claim():
+        """Mark the next runnable job as running and return it, or None if no job is due."""
+        now = timezone.now()
+        # A job whose lease expired on its last attempt crashed every worker that ran it, so it is not retried
+        RefreshJob.objects.filter(
+            status=RefreshJob.RUNNING,
+            run_after__lte=now,
+            attempts__gte=settings.FPL_REFRESH_JOB_MAX_ATTEMPTS
+        ).update(status=RefreshJob.FAILED, finished=now, error='Lease expired on the final attempt')
+        with transaction.atomic():
+            job = RefreshJob.objects.select_for_update(skip_locked=True).filter(
+                status__in=[RefreshJob.QUEUED, RefreshJob.RUNNING],
+                run_after__lte=now
+            ).order_by('run_after').first()
+            if job is None:
+                return None
+            job.status = RefreshJob.RUNNING
+            job.attempts += 1
+            job.started = now
+            job.run_after = now + datetime.timedelta(seconds=settings.FPL_REFRESH_JOB_TIMEOUT)
+            job.save()
+        return job
+
+    def run(self):
+        try:
+            self.league.process_payouts()
+        except Exception:
+            self.error = traceback.format_exc()
+            if self.attempts < settings.FPL_REFRESH_JOB_MAX_ATTEMPTS:
+                self.status = RefreshJob.QUEUED
+                self.run_after = timezone.now() + datetime.timedelta(
+                    seconds=settings.FPL_REFRESH_JOB_RETRY_DELAY * 2 ** (self.attempts - 1)
+                )
+            else:
+                self.status = RefreshJob.FAILED
+                self.finished = timezone.now()
+        else:
+            self.status = RefreshJob.SUCCEEDED
+            self.finished = timezone.now()
+        self.save()
+
+    def __str__(self):
+        return '{league} refresh ({status})'.format(league=self.league, status=self.get_status_display())
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_after']),
+            models.Index(fields=['league_content_type', 'league_id']),
+        ]
+
+
+class RefreshLease(models.Model):
+    """Per-league lock held while a league is refreshed, so concurrent refreshes of it run once."""
+    league_content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    league_id = models.PositiveIntegerField()
+    owner = models.CharField(max_length=32)
+    # A lease left behind by a crashed process can be taken over once it expires
+    expires = models.DateTimeField()
+
+    @staticmethod
+    def for_league(league):
+        return RefreshLease.objects.filter(
+            league_content_type=ContentType.objects.get_for_model(league),
+            league_id=league.pk
+        )
+
+    @staticmethod
+    def acquire(league):
+        """Return an owner token if the lease for league was acquired, or None if another refresh holds it."""
+        now = timezone.now()
+        RefreshLease.for_league(league).filter(expires__lte=now).delete()
+        owner = uuid.uuid4().hex
+        try:
+            with transaction.atomic():
+                RefreshLease.objects.create(
+                    league_content_type=ContentType.objects.get_for_model(league),
+                    league_id=league.pk,
+                    owner=owner,
+                    expires=now + datetime.timedelta(seconds=settings.FPL_REFRESH_JOB_TIMEOUT)
+                )
+        except IntegrityError:
+            return None
+        return owner
+
+    @staticmethod
+    def held(league):
+        return RefreshLease.for_league(league).filter(expires__gt=timezone.now()).exists()
+
+    @staticmethod
+    def release(league, owner):
+        RefreshLease.for_league(league).filter(owner=owner).delete()
+
+    class Meta:
+        unique_together = ('league_content_type', 'league_id')
+
+
+@receiver(post_save, sender=Manager)
+def invalidate_manager_standings(sender, instance, **kwargs):
+    # Standings only hold managers linked to a league entrant, so linking or unlinking one changes them
+    previous_entrant_id = getattr(instance, '_loaded_entrant_id', None)
+    if instance.entrant_id != previous_entrant_id:
+        FPLLeague.invalidate_standings(
+            league__season=instance.season_id,
+            league__leagueentrant__entrant__in=[entrant_id for entrant_id in (previous_entrant_id, instance.entrant_id)
+                                                if entrant_id is not None]
+        )
+    instance._loaded_entrant_id = instance.entrant_id
+
+
+@receiver(post_save, sender=LeagueEntrant)
+@receiver(post_delete, sender=LeagueEntrant)
+def invalidate_league_entrant_standings(sender, instance, **kwargs):
+    FPLLeague.invalidate_standings(league=instance.league_id)
@@ -0,0 +1,111 @@
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+THROTTLE_STATUSES = (429, 500, 502, 503, 504)
+
+
+class RateLimiter:
+    """Token bucket limiter for outbound FPL requests shared by every process using the same cache.
+
+    Implemented as GCRA: the cache holds the theoretical arrival time of the next request, so each reservation is a
+    single read and write under a short cache lock. Throttling responses double the emission interval, which then
+    decays back to the configured rate with the given half life.
+    """
+
+    def __init__(self, rate, burst, cache_alias, max_penalty=32, penalty_half_life=60, key_prefix='fpl:ratelimit'):
+        self.interval = 1.0 / rate
+        self.burst = burst
+        self.cache_alias = cache_alias
+        self.max_penalty = max_penalty
+        self.penalty_half_life = penalty_half_life
+        self.tat_key = key_prefix + ':tat'
+        self.penalty_key = key_prefix + ':penalty'
+        self.lock_key = key_prefix + ':lock'
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    @contextmanager
+    def _locked(self):
+        # cache.add is atomic on memcached, redis and database caches, which is what makes this safe across hosts, and
+        # on fpl.cache.LockingFileBasedCache across the processes of one host
+        token = uuid.uuid4().hex
+        while not self.cache.add(self.lock_key, token, 5):
+            time.sleep(0.001)
+        try:
+            yield
+        finally:
+            if self.cache.get(self.lock_key) == token:
+                self.cache.delete(self.lock_key)
+
+    def penalty(self, now=None):
+        now = now or time.time()
+        penalty, since = self.cache.get(self.penalty_key, (1, now))
+        return max(1.0, penalty * 0.5 ** ((now - since) / self.penalty_half_life))
+
+    def reserve(self):
+        """Reserve a slot for one request and return how many seconds to wait before sending it."""
+        with self._locked():
+            now = time.time()
+            interval = self.interval * self.penalty(now)
+            tat = max(self.cache.get(self.tat_key, now), now)
+            self.cache.set(self.tat_key, tat + interval, max(60, int(tat + interval - now) + 1))
+        return max(0.0, tat - interval * (self.burst - 1) - now)
+
+    def acquire(self):
+        time.sleep(self.reserve())
+
+    def feedback(self, status_code, retry_after=None):
+        """Slow down after a throttling or server error response."""
+        if status_code not in THROTTLE_STATUSES:
+            return
+        with self._locked():
+            now = time.time()
+            penalty = min(self.max_penalty, self.penalty(now) * 2)
+            self.cache.set(self.penalty_key, (penalty, now), self.penalty_half_life * 10)
+            if retry_after:
+                # Offset by the burst tolerance so the next reservation waits the full Retry-After
+                tolerance = self.interval * penalty * (self.burst - 1)
+                tat = max(self.cache.get(self.tat_key, now), now + retry_after + tolerance)
+                self.cache.set(self.tat_key, tat, max(60, int(tat - now) + 1))
+
+
+_rate_limiter = None
+_rate_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    """Return the process-wide rate limiter, or None when FPL_RATE_LIMIT is not configured."""
+    global _rate_limiter
+    if not settings.FPL_RATE_LIMIT:
+        return None
+    with _rate_limiter_lock:
+        if _rate_limiter is None:
+            _rate_limiter = RateLimiter(
+                rate=settings.FPL_RATE_LIMIT['RATE'],
+                burst=settings.FPL_RATE_LIMIT['BURST'],
+                cache_alias=settings.FPL_RATE_LIMIT.get('CACHE_ALIAS', settings.FPL_CACHE_ALIAS)
+            )
+    return _rate_limiter
+
+
+@receiver(setting_changed)
+def reset_rate_limiter(**kwargs):
+    global _rate_limiter
+    if kwargs['setting'] == 'FPL_RATE_LIMIT':
+        _rate_limiter = None
+
+
+def parse_retry_after(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,108 @@
+import datetime
+from collections import defaultdict
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db.models import Count
+from django.utils import timezone
+
+from fpl.models import ClassicLeague, Gameweek, HeadToHeadLeague, RefreshJob
+
+LIVE = 'live'
+CLOSED = 'closed'
+NEW_SEASON = 'new season'
+
+
+def refresh_reason(league, gameweeks, now):
+    """Return why league should be refreshed at now given its season's gameweeks, or None if it is up to date.
+
+    Leagues are refreshed every LIVE_INTERVAL seconds while a gameweek is in progress and once after each gameweek
+    closes. A league in a season without a gameweek calendar yet is refreshed once to retrieve it.
+    """
+    today = timezone.localdate(now)
+    last_updated = league.last_updated
+    if not gameweeks:
+        return NEW_SEASON if last_updated is None else None
+    if any(gameweek.start_date <= today < gameweek.end_date for gameweek in gameweeks):
+        live_interval = datetime.timedelta(seconds=settings.FPL_REFRESH_SCHEDULE['LIVE_INTERVAL'])
+        if last_updated is None or now - last_updated >= live_interval:
+            return LIVE
+        return None
+    closed = [gameweek.end_date for gameweek in gameweeks if gameweek.end_date <= today]
+    if closed:
+        closed_at = timezone.make_aware(datetime.datetime.combine(max(closed), datetime.time.min))
+        if last_updated is None or last_updated < closed_at:
+            return CLOSED
+    return None
+
+
+def estimated_requests(league):
+    """Return how many FPL requests refreshing league is expected to make.
+
+    A refresh makes two calendar requests, one per page of standings or matches and one history request per manager,
+    which are estimated from the last refresh. Leagues never refreshed are estimated from their entrants.
+    """
+    if league.manager_count is None:
+        return max(league.entrant_count, 1) + 3
+    return league.manager_count + league.page_count + 2
+
+
+def request_budget():
+    """Return how many FPL requests one scheduling run may plan, or None when requests are not rate limited."""
+    if not settings.FPL_RATE_LIMIT:
+        return None
+    return int(settings.FPL_RATE_LIMIT['RATE'] * settings.FPL_REFRESH_SCHEDULE['INTERVAL'] *
+               settings.FPL_REFRESH_SCHEDULE['BUDGET_FRACTION'])
+
+
+def plan_refreshes(now=None):
+    """Return [(league, reason)] for the leagues due a refresh, most urgent first, within the request budget.
+
+    Only seasons in progress are considered, so nothing is planned between seasons. Leagues with a queued or running
+    refresh job are skipped, and leagues that do not fit in this run's budget are left for the next run.
+    """
+    now = now or timezone.now()
+    today = timezone.localdate(now)
+    gameweeks = defaultdict(list)
+    for gameweek in Gameweek.objects.filter(season__start_date__lte=today,
+                                            season__end_date__gt=today - datetime.timedelta(days=14)):
+        gameweeks[gameweek.season_id].append(gameweek)
+    active_jobs = set(RefreshJob.objects.filter(
+        status__in=[RefreshJob.QUEUED, RefreshJob.RUNNING]
+    ).values_list('league_content_type', 'league_id'))
+
+    due = []
+    for league_type in (ClassicLeague, HeadToHeadLeague):
+        content_type = ContentType.objects.get_for_model(league_type)
+        leagues = league_type.objects.select_related('league__season').filter(
+            league__season__start_date__lte=today,
+            league__season__end_date__gt=today - datetime.timedelta(days=14)
+        ).annotate(entrant_count=Count('league__leagueentrant'))
+        for league in leagues:
+            if (content_type.pk, league.pk) in active_jobs:
+                continue
+            reason = refresh_reason(league, gameweeks[league.league.season_id], now)
+            if reason is not None:
+                due.append((league, reason))
+
+    # Live leagues first, then the least recently updated
+    epoch = timezone.make_aware(datetime.datetime(1970, 1, 1))
+    due.sort(key=lambda item: (item[1] != LIVE, item[0].last_updated or epoch))
+    budget = request_budget()
+    planned = []
+    for league, reason in due:
+        cost = estimated_requests(league)
+        if budget is not None:
+            if cost > budget and planned:
+                break
+            budget -= cost
+        planned.append((league, reason))
+    return planned
+
+
+def schedule_refreshes(now=None):
+    """Enqueue a RefreshJob for every league returned by plan_refreshes, returning the plan."""
+    planned = plan_refreshes(now)
+    for league, _ in planned:
+        RefreshJob.enqueue(league)
+    return planned
@@ -0,0 +1,293 @@
+import datetime
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs, urlsplit
+
+FIXTURES_PER_GAMEWEEK = 10
+ELEMENTS = 500
+
+
+class SyntheticFPLData:
+    """Deterministic synthetic FPL API responses for benchmarking ingestion offline.
+
+    Every league has league_size entries whose ids are derived from the league id, and every manager's points are
+    derived from the seed and manager id, so classic standings, H2H matches and manager histories agree with each
+    other across requests and server restarts.
+    """
+
+    def __init__(self, league_size=20, page_size=50, gameweeks=38, current_gameweek=10, start_date=None, seed=0):
+        self.league_size = league_size
+        self.page_size = page_size
+        self.gameweeks = gameweeks
+        self.current_gameweek = current_gameweek
+        self.start_date = start_date or datetime.date.today() - datetime.timedelta(weeks=current_gameweek)
+        self.seed = seed
+
+    def deadline(self, gameweek):
+        start = datetime.datetime.combine(self.start_date, datetime.time(10, 30))
+        return start + datetime.timedelta(weeks=gameweek - 1)
+
+    def manager_ids(self, league_id):
+        return [league_id * 100000 + i for i in range(1, self.league_size + 1)]
+
+    def points(self, manager_id, gameweek):
+        return random.Random('{}:{}:{}'.format(self.seed, manager_id, gameweek)).randint(20, 100)
+
+    def transfers_cost(self, manager_id, gameweek):
+        return random.Random('{}:{}:{}:cost'.format(self.seed, manager_id, gameweek)).choice([0, 0, 0, 4, 8])
+
+    def history(self, manager_id):
+        return {
+            'history': [
+                {
+                    'event': gameweek,
+                    'points': self.points(manager_id, gameweek),
+                    'event_transfers_cost': self.transfers_cost(manager_id, gameweek)
+                }
+                for gameweek in range(1, self.current_gameweek + 1)
+            ]
+        }
+
+    def live(self, gameweek):
+        return {
+            'elements': [
+                {'id': element, 'stats': {'total_points': self.points(element, gameweek) // 10}}
+                for element in range(1, ELEMENTS + 1)
+            ]
+        }
+
+    def picks(self, manager_id, gameweek):
+        elements = random.Random('{}:{}:{}:picks'.format(self.seed, manager_id, gameweek)).sample(
+            range(1, ELEMENTS + 1), 15)
+        return {
+            'picks': [
+                {'element': element, 'multiplier': 2 if position == 0 else int(position < 11)}
+                for position, element in enumerate(elements)
+            ],
+            'entry_history': {'event_transfers_cost': self.transfers_cost(manager_id, gameweek)}
+        }
+
+    def fixtures(self):
+        return [
+            {
+                'id': (gameweek - 1) * FIXTURES_PER_GAMEWEEK + i + 1,
+                'event': gameweek,
+                'kickoff_time': (self.deadline(gameweek) + datetime.timedelta(hours=2, days=i // 4)).strftime(
+                    '%Y-%m-%dT%H:%M:%SZ')
+            }
+            for gameweek in range(1, self.gameweeks + 1)
+            for i in range(FIXTURES_PER_GAMEWEEK)
+        ]
+
+    def bootstrap_static(self):
+        return {
+            'events': [
+                {
+                    'id': gameweek,
+                    'deadline_time': self.deadline(gameweek).strftime('%Y-%m-%dT%H:%M:%SZ'),
+                    'finished': gameweek < self.current_gameweek
+                }
+                for gameweek in range(1, self.gameweeks + 1)
+            ]
+        }
+
+    def _page(self, items, page_number):
+        start = (page_number - 1) * self.page_size
+        return items[start:start + self.page_size], start + self.page_size < len(items)
+
+    def classic_standings(self, league_id, page_number):
+        totals = [
+            (sum(self.points(manager_id, gameweek) - self.transfers_cost(manager_id, gameweek)
+                 for gameweek in range(1, self.current_gameweek + 1)), manager_id)
+            for manager_id in self.manager_ids(league_id)
+        ]
+        totals.sort(reverse=True)
+        results, has_next = self._page([
+            {
+                'entry': manager_id,
+                'entry_name': 'Team {}'.format(manager_id),
+                'rank': rank,
+                'total': total
+            }
+            for rank, (total, manager_id) in enumerate(totals, start=1)
+        ], page_number)
+        return {
+            'league': {'id': league_id, 'name': 'Classic League {}'.format(league_id)},
+            'standings': {'has_next': has_next, 'number': page_number, 'results': results}
+        }
+
+    def h2h_matches(self, league_id):
+        # Circle method round robin, with an AVERAGE opponent when the league has an odd number of entries
+        entries = self.manager_ids(league_id)
+        if len(entries) % 2:
+            entries = entries + [None]
+        # Each league's ids start past every match the previous league can have, however large the leagues are
+        first_id = (league_id - 1) * self.gameweeks * len(entries) // 2
+        matches = []
+        for gameweek in range(1, self.gameweeks + 1):
+            offset = (gameweek - 1) % (len(entries) - 1)
+            rotated = [entries[0]] + (entries[1:][-offset:] + entries[1:][:-offset] if offset else entries[1:])
+            for i in range(len(rotated) // 2):
+                entry_1, entry_2 = rotated[i], rotated[-i - 1]
+                matches.append({
+                    'id': first_id + len(matches) + 1,
+                    'event': gameweek,
+                    'entry_1_entry': entry_1,
+                    'entry_1_name': 'Team {}'.format(entry_1) if entry_1 else 'AVERAGE',
+                    'entry_1_points': self._match_points(entries, entry_1, gameweek),
+                    'entry_2_entry': entry_2,
+                    'entry_2_name': 'Team {}'.format(entry_2) if entry_2 else 'AVERAGE',
+                    'entry_2_points': self._match_points(entries, entry_2, gameweek)
+                })
+        return matches
+
+    def _match_points(self, entries, manager_id, gameweek):
+        if gameweek > self.current_gameweek:
+            return 0
+        if manager_id is None:
+            scores = [self._match_points(entries, entry, gameweek) for entry in entries if entry is not None]
+            return sum(scores) // len(scores)
+        return self.points(manager_id, gameweek) - self.transfers_cost(manager_id, gameweek)
+
+    def h2h_page(self, league_id, page_number):
+        results, has_next = self._page(self.h2h_matches(league_id), page_number)
+        return {
+            'league': {'id': league_id, 'name': 'Head To Head League {}'.format(league_id)},
+            'league-entries': [
+                {'entry': manager_id, 'entry_name': 'Team {}'.format(manager_id)}
+                for manager_id in self.manager_ids(league_id)
+            ],
+            'matches': {'has_next': has_next, 'number': page_number, 'results': results}
+        }
+
+
+class StubFPLHandler(BaseHTTPRequestHandler):
+    routes = [
+        (re.compile(r'^/drf/leagues-classic-standings/(?P<league_id>\d+)$'), 'classic_standings'),
+        (re.compile(r'^/drf/leagues-entries-and-h2h-matches/league/(?P<league_id>\d+)$'), 'h2h_page'),
+        (re.compile(r'^/drf/entry/(?P<manager_id>\d+)/history$'), 'history'),
+        (re.compile(r'^/drf/entry/(?P<manager_id>\d+)/event/(?P<gameweek>\d+)/picks$'), 'picks'),
+        (re.compile(r'^/drf/event/(?P<gameweek>\d+)/live$'), 'live'),
+        (re.compile(r'^/drf/fixtures$'), 'fixtures'),
+        (re.compile(r'^/drf/bootstrap-static$'), 'bootstrap_static'),
+    ]
+
+    def _send(self, status, body=b'', headers=None):
+        self.send_response(status)
+        for header, value in (headers or {}).items():
+            self.send_header(header, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _respond(self):
+        self.server.count_request(self.path)
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if self.server.error_rate and random.random() < self.server.error_rate:
+            self._send(503)
+            return None
+
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        if url.path == '/':
+            self._send(200, headers={'Set-Cookie': 'csrftoken=stub; Path=/'})
+            return None
+        if url.path == '/accounts/login/':
+            self._send(302, headers={'Location': '/', 'Set-Cookie': 'sessionid=stub; Path=/'})
+            return None
+        for pattern, name in self.routes:
+            match = pattern.match(url.path)
+            if match:
+                break
+        else:
+            self._send(404)
+            return None
+
+        data = self.server.data
+        if name == 'classic_standings':
+            payload = data.classic_standings(int(match.group('league_id')), int(query.get('ls-page', ['1'])[0]))
+        elif name == 'h2h_page':
+            payload = data.h2h_page(int(match.group('league_id')), int(query.get('page', ['1'])[0]))
+        elif name == 'history':
+            payload = data.history(int(match.group('manager_id')))
+        elif name == 'picks':
+            payload = data.picks(int(match.group('manager_id')), int(match.group('gameweek')))
+        elif name == 'live':
+            payload = data.live(int(match.group('gameweek')))
+        else:
+            payload = getattr(data, name)()
+
+        body = json.dumps(payload).encode('utf-8')
+        etag = '"{}"'.format(hashlib.sha1(body).hexdigest())
+        if self.headers.get('If-None-Match') == etag:
+            self._send(304, headers={'ETag': etag})
+            return None
+        self._send(200, body, {'Content-Type': 'application/json', 'ETag': etag})
+
+    def do_GET(self):
+        self._respond()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self._respond()
+
+    def log_message(self, *args):
+        if self.server.verbose:
+            super().log_message(*args)
+
+
+class StubFPLServer(ThreadingMixIn, HTTPServer):
+    """Local HTTP server answering the FPL endpoints used by ingestion with SyntheticFPLData.
+
+    Point FPL_BASE_URL, FPL_HOMEPAGE_URL and FPL_LOGIN_URL at base_url, homepage_url and login_url to run ingestion
+    against it.
+    """
+    daemon_threads = True
+
+    def __init__(self, data, host='127.0.0.1', port=0, latency=0, error_rate=0, verbose=False):
+        self.data = data
+        self.latency = latency
+        self.error_rate = error_rate
+        self.verbose = verbose
+        self.request_count = 0
+        # Requests per path, including the query string
+        self.requests = Counter()
+        self._count_lock = threading.Lock()
+        super().__init__((host, port), StubFPLHandler)
+
+    def count_request(self, path):
+        with self._count_lock:
+            self.request_count += 1
+            self.requests[path] += 1
+
+    @property
+    def root_url(self):
+        return 'http://{host}:{port}'.format(host=self.server_address[0], port=self.server_address[1])
+
+    @property
+    def base_url(self):
+        return self.root_url + '/drf/'
+
+    @property
+    def homepage_url(self):
+        return self.root_url + '/'
+
+    @property
+    def login_url(self):
+        return self.root_url + '/accounts/login/'
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
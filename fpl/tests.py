@@ -1,14 +1,54 @@
 import datetime
 import decimal
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import skipIf
+
+import requests
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.core.cache import caches
+from django.core.management import call_command, CommandError
+from django.test import TestCase, override_settings
 from django.urls import reverse
 from django.utils import timezone
-from unittest.mock import Mock, patch
+from unittest.mock import MagicMock, Mock, patch
 
+from fpl import aio, scheduler, stub_server
+from fpl.cache import LockingFileBasedCache, ResponseCache, get_page_cache, get_response_cache
+from fpl.client import FPLClient, get_authorized_client, get_client, iter_pages
+from fpl.management.commands import refresh_leagues
+from fpl.ratelimit import RateLimiter
 from fpl.models import (ClassicLeague, HeadToHeadLeague, HeadToHeadMatch, HeadToHeadPerformance, Gameweek,
-                        Manager, ManagerPerformance, ClassicPayout, HeadToHeadPayout)
-from leagues.models import League, LeagueEntrant, Season
+                        Manager, ManagerPerformance, ClassicPayout, HeadToHeadPayout, LeagueStanding, RefreshJob,
+                        RefreshLease)
+from leagues.models import League, LeagueEntrant, Payout, Season
+
+LOCMEM_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'fpl': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'fpl-tests',
+    },
+    'fpl-pages': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'fpl-pages-tests',
+    }
+}
+# Keeps every test off the on-disk caches configured in settings
+test_settings = override_settings(CACHES=LOCMEM_CACHES, FPL_RESPONSE_CACHE=None)
+
+
+def setUpModule():
+    test_settings.enable()
+
+
+def tearDownModule():
+    test_settings.disable()
 
 
 class ClassicLeagueTestCase(TestCase):
@@ -32,15 +72,16 @@ class ClassicLeagueTestCase(TestCase):
         ])
 
 
-    @patch('fpl.models.Manager.retrieve_performance_data')
+    @patch('fpl.models.Manager.bulk_retrieve_performance_data')
     @patch('fpl.models.datetime')
-    @patch('fpl.models.requests.get')
-    def test_retrieve_league_data(self, mock_requests_get, mock_datetime, _):
+    @patch('fpl.client.FPLClient.get')
+    def test_retrieve_league_data(self, mock_client_get, mock_datetime, _):
         league_data = {
             'league': {
                 'name': 'Test League 1'
             },
             'standings': {
+                'has_next': False,
                 'results': [
                     {
                         'entry': 1,
@@ -61,9 +102,7 @@ class ClassicLeagueTestCase(TestCase):
                 ]
             }
         }
-        mock_response = Mock()
-        mock_response.json.return_value = league_data
-        mock_requests_get.return_value = mock_response
+        mock_client_get.return_value = league_data
         mock_datetime.date.today.return_value = datetime.date(2018, 5, 10)
         mock_datetime.timedelta.side_effect = lambda *args, **kw: datetime.timedelta(*args, **kw)
 
@@ -74,15 +113,17 @@ class ClassicLeagueTestCase(TestCase):
         self.assertEqual(Manager.objects.get(fpl_manager_id=1).team_name, 'Test Manager Team')
         self.assertEqual(League.objects.get().name, 'Test League 1')
         self.assertIsNotNone(classic_league.last_updated)
+        self.assertEqual(LeagueStanding.objects.count(), 3)
 
-    @patch('fpl.models.Manager.retrieve_performance_data')
-    @patch('fpl.models.requests.get')
-    def test_retrieve_league_data_after_season_end_does_not_update(self, mock_requests_get, _):
+    @patch('fpl.models.Manager.bulk_retrieve_performance_data')
+    @patch('fpl.client.FPLClient.get')
+    def test_retrieve_league_data_after_season_end_does_not_update(self, mock_client_get, _):
         league_data = {
             'league': {
                 'name': 'Test League 1'
             },
             'standings': {
+                'has_next': False,
                 'results': [
                     {
                         'entry': 1,
@@ -103,9 +144,7 @@ class ClassicLeagueTestCase(TestCase):
                 ]
             }
         }
-        mock_response = Mock()
-        mock_response.json.return_value = league_data
-        mock_requests_get.return_value = mock_response
+        mock_client_get.return_value = league_data
 
         classic_league = ClassicLeague.objects.get()
         today = datetime.date.today()
@@ -119,7 +158,103 @@ class ClassicLeagueTestCase(TestCase):
         self.assertEqual(League.objects.get().name, 'Test League')
         self.assertIsNone(classic_league.last_updated)
 
-        mock_requests_get.assert_not_called()
+        mock_client_get.assert_not_called()
+
+    @patch('fpl.models.Manager.bulk_retrieve_performance_data')
+    @patch('fpl.models.datetime')
+    @patch('fpl.client.FPLClient.get')
+    def test_retrieve_league_data_paginated(self, mock_client_get, mock_datetime, mock_bulk_retrieve):
+        pages = {
+            'leagues-classic-standings/1?ls-page=1': {
+                'league': {
+                    'name': 'Test League 1'
+                },
+                'standings': {
+                    'has_next': True,
+                    'results': [
+                        {
+                            'entry': 1,
+                            'entry_name': 'Team 1'
+                        },
+                        {
+                            'entry': 2,
+                            'entry_name': 'Team 2'
+                        }
+                    ]
+                }
+            },
+            'leagues-classic-standings/1?ls-page=2': {
+                'league': {
+                    'name': 'Test League 1'
+                },
+                'standings': {
+                    'has_next': False,
+                    'results': [
+                        {
+                            'entry': 3,
+                            'entry_name': 'Team 3'
+                        },
+                        {
+                            'entry': 4,
+                            'entry_name': 'Team 4'
+                        }
+                    ]
+                }
+            }
+        }
+        mock_client_get.side_effect = lambda path: pages[path]
+        mock_datetime.date.today.return_value = datetime.date(2018, 5, 10)
+        mock_datetime.timedelta.side_effect = lambda *args, **kw: datetime.timedelta(*args, **kw)
+
+        classic_league = ClassicLeague.objects.get()
+        classic_league.retrieve_league_data()
+
+        self.assertEqual(Manager.objects.count(), 4)
+        self.assertEqual(mock_bulk_retrieve.call_count, 2)
+        self.assertEqual([manager.fpl_manager_id for manager in mock_bulk_retrieve.call_args_list[0][0][0]], [1, 2])
+        self.assertEqual([manager.fpl_manager_id for manager in mock_bulk_retrieve.call_args_list[1][0][0]], [3, 4])
+        classic_league.refresh_from_db()
+        self.assertEqual((classic_league.manager_count, classic_league.page_count), (4, 2))
+
+    @patch('fpl.models.datetime')
+    @patch('fpl.client.FPLClient.get')
+    def test_retrieve_league_data_prefetched(self, mock_client_get, mock_datetime):
+        mock_datetime.date.today.return_value = datetime.date(2018, 5, 10)
+        mock_datetime.timedelta.side_effect = lambda *args, **kw: datetime.timedelta(*args, **kw)
+        classic_league = ClassicLeague.objects.get()
+        Gameweek.objects.create(number=1, start_date='2017-08-01', end_date='2017-08-02',
+                                season=classic_league.league.season)
+        pages = [{
+            'league': {
+                'name': 'Test League 1'
+            },
+            'standings': {
+                'has_next': False,
+                'results': [
+                    {
+                        'entry': 1,
+                        'entry_name': 'Test Manager Team'
+                    }
+                ]
+            }
+        }]
+        histories = {
+            1: {
+                'history': [
+                    {
+                        'event': 1,
+                        'points': 10,
+                        'event_transfers_cost': 0
+                    }
+                ]
+            }
+        }
+
+        classic_league.retrieve_league_data(pages, histories)
+
+        mock_client_get.assert_not_called()
+        self.assertEqual(League.objects.get().name, 'Test League 1')
+        self.assertEqual(ManagerPerformance.objects.get().score, 10)
 
     @patch('fpl.models.Gameweek.retrieve_gameweek_data')
     @patch('fpl.models.ClassicLeague.retrieve_league_data')
@@ -205,6 +340,7 @@ class ClassicLeagueTestCase(TestCase):
         ManagerPerformance.objects.create(manager=manager_3, gameweek=gameweek_2, score=20)
         ManagerPerformance.objects.create(manager=manager_3, gameweek=gameweek_3, score=15)
 
+        classic_league.rebuild_standings()
         self.assertEqual(len(classic_league.managers), 3)
         self.assertEqual(classic_league.managers[0].current_score, 35)
         self.assertEqual(classic_league.managers[1].current_score, 20)
@@ -254,6 +390,7 @@ class ClassicLeagueTestCase(TestCase):
         self.assertTrue(classic_league.managers[1].paid_entry)
         self.assertTrue(classic_league.managers[2].paid_entry)
 
+        classic_league_2.rebuild_standings()
         self.assertEqual(len(classic_league_2.managers), 3)
         self.assertEqual(classic_league_2.managers[0].current_score, 50)
         self.assertEqual(classic_league_2.managers[1].current_score, 35)
@@ -262,6 +399,60 @@ class ClassicLeagueTestCase(TestCase):
         self.assertFalse(classic_league_2.managers[1].paid_entry)
         self.assertFalse(classic_league_2.managers[2].paid_entry)
 
+    def test_rebuild_standings(self):
+        classic_league = ClassicLeague.objects.get()
+        gameweek = Gameweek.objects.create(number=1, start_date='2018-08-01', end_date='2018-08-02',
+                                           season=classic_league.league.season)
+        manager_1, manager_2, manager_3 = Manager.objects.order_by('fpl_manager_id')
+        ManagerPerformance.objects.create(manager=manager_1, gameweek=gameweek, score=10)
+        ManagerPerformance.objects.create(manager=manager_2, gameweek=gameweek, score=20)
+        ManagerPerformance.objects.create(manager=manager_3, gameweek=gameweek, score=10)
+
+        classic_league.rebuild_standings()
+        ManagerPerformance.objects.filter(manager=manager_3).update(score=30)
+        classic_league.rebuild_standings()
+
+        self.assertEqual(LeagueStanding.objects.count(), 3)
+        self.assertEqual([(standing.manager, standing.score, standing.rank) for standing in
+                          LeagueStanding.objects.order_by('rank')],
+                         [(manager_3, 30, 1), (manager_2, 20, 2), (manager_1, 10, 3)])
+        with self.assertNumQueries(1):
+            self.assertEqual(list(classic_league.managers), [manager_3, manager_2, manager_1])
+
+        ManagerPerformance.objects.filter(manager=manager_3).update(score=20)
+        classic_league.rebuild_standings()
+        self.assertEqual([standing.rank for standing in LeagueStanding.objects.order_by('rank')], [1, 1, 3])
+
+    def test_managers_builds_missing_standings(self):
+        classic_league = ClassicLeague.objects.get()
+        gameweek = Gameweek.objects.create(number=1, start_date='2018-08-01', end_date='2018-08-02',
+                                           season=classic_league.league.season)
+        for manager, score in zip(Manager.objects.order_by('fpl_manager_id'), (10, 30, 20)):
+            ManagerPerformance.objects.create(manager=manager, gameweek=gameweek, score=score)
+
+        self.assertEqual([manager.current_score for manager in classic_league.managers], [30, 20, 10])
+        self.assertIsNotNone(ClassicLeague.objects.get().standings_updated)
+        with self.assertNumQueries(1):
+            list(classic_league.managers)
+
+    def test_managers_after_linking_manager(self):
+        Manager.objects.filter(fpl_manager_id=3).update(entrant=None)
+        classic_league = ClassicLeague.objects.get()
+        classic_league.rebuild_standings()
+        self.assertEqual(len(classic_league.managers), 2)
+
+        manager = Manager.objects.get(fpl_manager_id=3)
+        manager.entrant = self.entrant_3
+        manager.save()
+        self.assertEqual(len(ClassicLeague.objects.get().managers), 3)
+
+        manager.team_name = 'Renamed'
+        manager.save()
+        self.assertIsNotNone(ClassicLeague.objects.get().standings_updated)
+
+        LeagueEntrant.objects.filter(entrant=self.entrant_3).delete()
+        self.assertEqual(len(ClassicLeague.objects.get().managers), 2)
+
 
 class HeadToHeadLeagueTestCase(TestCase):
 
@@ -289,8 +480,8 @@ class HeadToHeadLeagueTestCase(TestCase):
             Gameweek(number=3, start_date='2017-08-15', end_date='2017-08-16', season=self.season)
         ])
 
-    @patch('fpl.models.HeadToHeadMatch.calculate_score')
-    @patch('fpl.models.Manager.retrieve_performance_data')
+    @patch('fpl.models.HeadToHeadMatch.bulk_calculate_scores')
+    @patch('fpl.models.Manager.bulk_retrieve_performance_data')
     @patch('fpl.models.datetime')
     @patch('fpl.models.FPLLeague.get_authorized_session')
     def test_retrieve_league_data(self, mock_get_authorized_session, mock_datetime, *_):
@@ -340,11 +531,9 @@ class HeadToHeadLeagueTestCase(TestCase):
             }
         }
 
-        mock_response = Mock()
-        mock_response.json.return_value = league_data
-        mock_session = Mock()
-        mock_session.get.return_value = mock_response
-        mock_get_authorized_session.return_value = mock_session
+        mock_client = Mock()
+        mock_client.get.return_value = league_data
+        mock_get_authorized_session.return_value = mock_client
         mock_datetime.date.today.return_value = datetime.date(2018, 5, 10)
         mock_datetime.timedelta.side_effect = lambda *args, **kw: datetime.timedelta(*args, **kw)
 
@@ -358,8 +547,78 @@ class HeadToHeadLeagueTestCase(TestCase):
         self.assertEqual(HeadToHeadMatch.objects.count(), 2)
         self.assertIsNotNone(h2h_league.last_updated)
 
-    @patch('fpl.models.HeadToHeadMatch.calculate_score')
-    @patch('fpl.models.Manager.retrieve_performance_data')
+    @patch('fpl.models.HeadToHeadMatch.bulk_calculate_scores')
+    @patch('fpl.models.Manager.bulk_retrieve_performance_data')
+    @patch('fpl.models.datetime')
+    @patch('fpl.models.FPLLeague.get_authorized_session')
+    def test_retrieve_league_data_paginated(self, mock_get_authorized_session, mock_datetime, *_):
+        league_entries = [
+            {
+                'entry': 1,
+                'entry_name': 'Team 1'
+            },
+            {
+                'entry': 2,
+                'entry_name': 'Team 2'
+            }
+        ]
+        pages = {
+            'leagues-entries-and-h2h-matches/league/1?page=1': {
+                'league': {
+                    'name': 'Test League 1'
+                },
+                'league-entries': league_entries,
+                'matches': {
+                    'has_next': True,
+                    'results': [
+                        {
+                            'id': 1,
+                            'event': 1,
+                            'entry_1_entry': 1,
+                            'entry_1_points': 10,
+                            'entry_2_entry': 2,
+                            'entry_2_points': 20
+                        }
+                    ]
+                }
+            },
+            'leagues-entries-and-h2h-matches/league/1?page=2': {
+                'league': {
+                    'name': 'Test League 1'
+                },
+                'league-entries': league_entries,
+                'matches': {
+                    'has_next': False,
+                    'results': [
+                        {
+                            'id': 2,
+                            'event': 2,
+                            'entry_1_entry': 2,
+                            'entry_1_points': 30,
+                            'entry_2_entry': 1,
+                            'entry_2_points': 40
+                        }
+                    ]
+                }
+            }
+        }
+        mock_client = Mock()
+        mock_client.get.side_effect = lambda path: pages[path]
+        mock_get_authorized_session.return_value = mock_client
+        mock_datetime.date.today.return_value = datetime.date(2018, 5, 10)
+        mock_datetime.timedelta.side_effect = lambda *args, **kw: datetime.timedelta(*args, **kw)
+
+        h2h_league = HeadToHeadLeague.objects.get()
+        h2h_league.retrieve_league_data()
+
+        self.assertEqual(list(HeadToHeadMatch.objects.order_by('fpl_match_id').values_list(
+            'fpl_match_id', 'gameweek__number', 'manager_1__fpl_manager_id', 'manager_2__fpl_manager_id'
+        )), [(1, 1, 1, 2), (2, 2, 2, 1)])
+        self.assertEqual(ManagerPerformance.objects.get(manager__fpl_manager_id=1, gameweek__number=2).score, 40)
+        self.assertEqual((h2h_league.manager_count, h2h_league.page_count), (2, 2))
+
+    @patch('fpl.models.HeadToHeadMatch.bulk_calculate_scores')
+    @patch('fpl.models.Manager.bulk_retrieve_performance_data')
     @patch('fpl.models.datetime')
     @patch('fpl.models.FPLLeague.get_authorized_session')
     def test_retrieve_league_data_odd_number_of_entrants(self, mock_get_authorized_session, mock_datetime, *_):
@@ -405,11 +664,9 @@ class HeadToHeadLeagueTestCase(TestCase):
             }
         }
 
-        mock_response = Mock()
-        mock_response.json.return_value = league_data
-        mock_session = Mock()
-        mock_session.get.return_value = mock_response
-        mock_get_authorized_session.return_value = mock_session
+        mock_client = Mock()
+        mock_client.get.return_value = league_data
+        mock_get_authorized_session.return_value = mock_client
         mock_datetime.date.today.return_value = datetime.date(2018, 5, 10)
         mock_datetime.timedelta.side_effect = lambda *args, **kw: datetime.timedelta(*args, **kw)
 
@@ -424,8 +681,8 @@ class HeadToHeadLeagueTestCase(TestCase):
         average_manager = Manager.objects.get(season=self.season, fpl_manager_id=h2h_league.fpl_league_id*-1)
         self.assertEqual(average_manager.team_name, 'AVERAGE')
 
-    @patch('fpl.models.HeadToHeadMatch.calculate_score')
-    @patch('fpl.models.Manager.retrieve_performance_data')
+    @patch('fpl.models.HeadToHeadMatch.bulk_calculate_scores')
+    @patch('fpl.models.Manager.bulk_retrieve_performance_data')
     @patch('fpl.models.FPLLeague.get_authorized_session')
     def test_retrieve_league_data_after_season_end_does_not_update(self, mock_get_authorized_session, *_):
         league_data = {
@@ -474,11 +731,9 @@ class HeadToHeadLeagueTestCase(TestCase):
             }
         }
 
-        mock_response = Mock()
-        mock_response.json.return_value = league_data
-        mock_session = Mock()
-        mock_session.get.return_value = mock_response
-        mock_get_authorized_session.return_value = mock_session
+        mock_client = Mock()
+        mock_client.get.return_value = league_data
+        mock_get_authorized_session.return_value = mock_client
         h2h_league = HeadToHeadLeague.objects.get()
         today = datetime.date.today()
         season = Season.objects.create(start_date='2018-08-01', end_date=today - datetime.timedelta(days=14))
@@ -568,6 +823,7 @@ class HeadToHeadLeagueTestCase(TestCase):
         HeadToHeadPerformance.objects.create(h2h_league=h2h_league, manager=manager_3, gameweek=gameweek_2, score=20)
         HeadToHeadPerformance.objects.create(h2h_league=h2h_league, manager=manager_3, gameweek=gameweek_3, score=15)
 
+        h2h_league.rebuild_standings()
         self.assertEqual(len(h2h_league.managers), 3)
         self.assertEqual(h2h_league.managers[0].current_h2h_score, 35)
         self.assertEqual(h2h_league.managers[1].current_h2h_score, 20)
@@ -609,6 +865,7 @@ class HeadToHeadLeagueTestCase(TestCase):
         HeadToHeadPerformance.objects.create(h2h_league=h2h_league_2, manager=manager_3, gameweek=gameweek_5, score=25)
         HeadToHeadPerformance.objects.create(h2h_league=h2h_league_2, manager=manager_3, gameweek=gameweek_6, score=20)
 
+        h2h_league_2.rebuild_standings()
         self.assertEqual(len(h2h_league_2.managers), 3)
         self.assertEqual(h2h_league_2.managers[0].current_h2h_score, 50)
         self.assertEqual(h2h_league_2.managers[1].current_h2h_score, 35)
@@ -617,6 +874,137 @@ class HeadToHeadLeagueTestCase(TestCase):
         self.assertFalse(h2h_league_2.managers[1].paid_entry)
         self.assertFalse(h2h_league_2.managers[2].paid_entry)
 
+    def test_standings(self):
+        h2h_league = HeadToHeadLeague.objects.select_related('league__season').get()
+        gameweek_1, gameweek_2, _ = Gameweek.objects.order_by('start_date')
+        manager_1, manager_2, manager_3 = Manager.objects.order_by('fpl_manager_id')
+        for manager, scores, h2h_scores in ((manager_1, (50, 60), (3, 3)), (manager_2, (40, 40), (3, 0)),
+                                            (manager_3, (70, 30), (0, 3))):
+            for gameweek, score, h2h_score in zip((gameweek_1, gameweek_2), scores, h2h_scores):
+                ManagerPerformance.objects.create(manager=manager, gameweek=gameweek, score=score)
+                HeadToHeadPerformance.objects.create(h2h_league=h2h_league, manager=manager, gameweek=gameweek,
+                                                     score=h2h_score)
+
+        with self.assertNumQueries(1):
+            standings = [(manager, manager.current_score, manager.current_h2h_score)
+                         for manager in h2h_league.standings()]
+        self.assertEqual(standings, [(manager_1, 110, 6), (manager_3, 100, 3), (manager_2, 80, 3)])
+
+
+    def test_update_matches(self):
+        h2h_league = HeadToHeadLeague.objects.get()
+        other_season = Season.objects.create(start_date='2016-08-01', end_date='2017-05-13')
+        Manager.objects.create(team_name='Old Team 1', fpl_manager_id=1, season=other_season)
+        manager_1, manager_2, manager_3 = Manager.objects.filter(season=self.season).order_by('fpl_manager_id')
+        HeadToHeadMatch.objects.create(fpl_match_id=1, h2h_league=h2h_league, gameweek=Gameweek.objects.get(number=1),
+                                       manager_1=manager_1, manager_2=manager_3)
+        matches = [
+            {'id': 1, 'event': 1, 'entry_1_entry': 1, 'entry_1_points': 10, 'entry_2_entry': 2, 'entry_2_points': 20},
+            {'id': 2, 'event': 2, 'entry_1_entry': 3, 'entry_1_points': 30, 'entry_2_entry': 1, 'entry_2_points': 40}
+        ]
+        gameweek_ids = Gameweek.ids_by_number(self.season)
+        manager_ids = Manager.ids_by_fpl_id(self.season)
+
+        # One upsert for the matches and one for the manager performances
+        with self.assertNumQueries(2):
+            h2h_league.update_matches(matches, gameweek_ids=gameweek_ids, manager_ids=manager_ids)
+
+        self.assertEqual(HeadToHeadMatch.objects.count(), 2)
+        self.assertEqual(HeadToHeadMatch.objects.get(fpl_match_id=1).manager_2, manager_2)
+        self.assertEqual(HeadToHeadMatch.objects.get(fpl_match_id=2).manager_1, manager_3)
+        self.assertEqual(ManagerPerformance.objects.get(manager=manager_1, gameweek__number=2).score, 40)
+        self.assertEqual(ManagerPerformance.objects.count(), 4)
+
+
+    @patch('fpl.models.datetime')
+    def test_score_completed_matches_only_changed(self, mock_datetime):
+        mock_datetime.date.today.return_value = datetime.date(2018, 5, 10)
+        h2h_league = HeadToHeadLeague.objects.get()
+        other_league = HeadToHeadLeague.objects.create(
+            league=League.objects.create(name='Other League', entry_fee=10, season=self.season), fpl_league_id=2)
+        manager_1, manager_2, manager_3 = Manager.objects.order_by('fpl_manager_id')
+        gameweek_1, gameweek_2, gameweek_3 = Gameweek.objects.order_by('number')
+        for gameweek in (gameweek_1, gameweek_2, gameweek_3):
+            for manager, score in ((manager_1, 30), (manager_2, 20), (manager_3, 10)):
+                ManagerPerformance.objects.create(manager=manager, gameweek=gameweek, score=score)
+        for fpl_match_id, league, gameweek, manager_a, manager_b in ((1, h2h_league, gameweek_1, manager_1, manager_2),
+                                                                    (2, h2h_league, gameweek_2, manager_1, manager_3),
+                                                                    (3, h2h_league, gameweek_3, manager_2, manager_3),
+                                                                    (4, other_league, gameweek_1, manager_1, manager_2)):
+            HeadToHeadMatch.objects.create(fpl_match_id=fpl_match_id, h2h_league=league, gameweek=gameweek,
+                                           manager_1=manager_a, manager_2=manager_b)
+        h2h_league.score_completed_matches()
+
+        ManagerPerformance.objects.filter(manager=manager_1, gameweek=gameweek_1).update(score=10)
+        with patch('fpl.models.HeadToHeadMatch.bulk_calculate_scores') as mock_bulk_calculate_scores:
+            h2h_league.score_completed_matches()
+        self.assertEqual(list(mock_bulk_calculate_scores.call_args[0][0]), [HeadToHeadMatch.objects.get(fpl_match_id=1)])
+
+        h2h_league.score_completed_matches()
+
+        def score(manager, gameweek):
+            return HeadToHeadPerformance.objects.get(h2h_league=h2h_league, manager=manager, gameweek=gameweek).score
+        self.assertEqual(score(manager_1, gameweek_1), 0)
+        self.assertEqual(score(manager_1, gameweek_2), 3)
+        self.assertEqual(score(manager_2, gameweek_3), 3)
+        self.assertFalse(HeadToHeadPerformance.objects.filter(h2h_league=other_league).exists())
+
+    @patch('fpl.models.datetime')
+    def test_score_completed_matches_after_correction_through_other_league(self, mock_datetime):
+        mock_datetime.date.today.return_value = datetime.date(2018, 5, 10)
+        h2h_league = HeadToHeadLeague.objects.get()
+        manager_1, manager_2, _ = Manager.objects.order_by('fpl_manager_id')
+        gameweek_1 = Gameweek.objects.get(number=1)
+        matches = [
+            {'id': 1, 'event': 1, 'entry_1_entry': 1, 'entry_1_points': 50, 'entry_2_entry': 2, 'entry_2_points': 40}
+        ]
+        h2h_league.update_matches(matches)
+        h2h_league.score_completed_matches()
+        self.assertEqual(HeadToHeadPerformance.objects.get(manager=manager_1, gameweek=gameweek_1).score, 3)
+
+        # A classic league sharing the manager ingests a corrected history first
+        manager_1.update_performance_data(self.season, {
+            'history': [{'event': 1, 'points': 30, 'event_transfers_cost': 0}]
+        })
+        # The H2H refresh then sees the corrected points as unchanged
+        matches[0]['entry_1_points'] = 30
+        self.assertEqual(h2h_league.update_matches(matches), set())
+        h2h_league.score_completed_matches()
+
+        self.assertEqual(HeadToHeadPerformance.objects.get(manager=manager_1, gameweek=gameweek_1).score, 0)
+        self.assertEqual(HeadToHeadPerformance.objects.get(manager=manager_2, gameweek=gameweek_1).score, 3)
+
+    def test_update_matches_returns_changed_matches(self):
+        h2h_league = HeadToHeadLeague.objects.get()
+        matches = [
+            {'id': 1, 'event': 1, 'entry_1_entry': 1, 'entry_1_points': 10, 'entry_2_entry': 2, 'entry_2_points': 20}
+        ]
+
+        self.assertEqual(h2h_league.update_matches(matches), {HeadToHeadMatch.objects.get(fpl_match_id=1).pk})
+        self.assertEqual(h2h_league.update_matches(matches), set())
+        matches[0]['entry_2_points'] = 25
+        self.assertEqual(h2h_league.update_matches(matches), set())
+        matches[0]['entry_2_entry'] = 3
+        self.assertEqual(h2h_league.update_matches(matches), {HeadToHeadMatch.objects.get(fpl_match_id=1).pk})
+
+    @patch('fpl.models.datetime')
+    def test_score_completed_matches_after_reassignment(self, mock_datetime):
+        mock_datetime.date.today.return_value = datetime.date(2018, 5, 10)
+        h2h_league = HeadToHeadLeague.objects.get()
+        manager_1, manager_2, manager_3 = Manager.objects.order_by('fpl_manager_id')
+        gameweek_1 = Gameweek.objects.get(number=1)
+        matches = [
+            {'id': 1, 'event': 1, 'entry_1_entry': 1, 'entry_1_points': 10, 'entry_2_entry': 2, 'entry_2_points': 20}
+        ]
+        h2h_league.score_completed_matches(h2h_league.update_matches(matches))
+
+        # Reassigned to a manager with the same points, so no stored score differs from the performances
+        matches[0]['entry_2_entry'] = 3
+        h2h_league.score_completed_matches(h2h_league.update_matches(matches))
+
+        self.assertEqual(HeadToHeadPerformance.objects.get(manager=manager_3, gameweek=gameweek_1).score, 3)
+        self.assertFalse(HeadToHeadPerformance.objects.filter(manager=manager_2, gameweek=gameweek_1).exists())
+
 
 class HeadToHeadMatchTestCase(TestCase):
     def test_calculate_score(self):
@@ -647,6 +1035,59 @@ class HeadToHeadMatchTestCase(TestCase):
         self.assertEqual(manager_1_h2h_performance.score, 0)
         self.assertEqual(manager_2_h2h_performance.score, 3)
 
+    def test_bulk_calculate_scores(self):
+        season = Season.objects.create(start_date='2017-08-01', end_date='2018-05-15')
+        league = League.objects.create(name='Test League', entry_fee=10, season=season)
+        h2h_league = HeadToHeadLeague.objects.create(league=league, fpl_league_id=1)
+        Manager.objects.bulk_create([
+            Manager(team_name='Team {}'.format(i), fpl_manager_id=i, season=season) for i in range(1, 5)
+        ])
+        gameweek_1 = Gameweek.objects.create(number=1, start_date='2017-08-01', end_date='2017-08-03', season=season)
+        gameweek_2 = Gameweek.objects.create(number=2, start_date='2017-08-08', end_date='2017-08-10', season=season)
+        for manager, scores in zip(Manager.objects.order_by('fpl_manager_id'), ((10, 30), (20, 30), (20, 5), (5, 50))):
+            ManagerPerformance.objects.create(manager=manager, gameweek=gameweek_1, score=scores[0])
+            ManagerPerformance.objects.create(manager=manager, gameweek=gameweek_2, score=scores[1])
+        manager_1, manager_2, manager_3, manager_4 = Manager.objects.order_by('fpl_manager_id')
+        for fpl_match_id, gameweek, manager_a, manager_b in ((1, gameweek_1, manager_1, manager_2),
+                                                            (2, gameweek_1, manager_3, manager_4),
+                                                            (3, gameweek_2, manager_1, manager_2),
+                                                            (4, gameweek_2, manager_3, manager_4)):
+            HeadToHeadMatch.objects.create(fpl_match_id=fpl_match_id, h2h_league=h2h_league, gameweek=gameweek,
+                                           manager_1=manager_a, manager_2=manager_b)
+        HeadToHeadPerformance.objects.create(h2h_league=h2h_league, manager=manager_1, gameweek=gameweek_1, score=3)
+
+        with self.assertNumQueries(3):
+            HeadToHeadMatch.bulk_calculate_scores(HeadToHeadMatch.objects.all())
+        bulk_scores = {(performance.manager_id, performance.gameweek_id): performance.score
+                       for performance in HeadToHeadPerformance.objects.all()}
+
+        HeadToHeadPerformance.objects.all().delete()
+        for h2h_match in HeadToHeadMatch.objects.all():
+            h2h_match.calculate_score()
+        self.assertEqual(bulk_scores, {(performance.manager_id, performance.gameweek_id): performance.score
+                                       for performance in HeadToHeadPerformance.objects.all()})
+        self.assertEqual(bulk_scores[manager_1.pk, gameweek_1.pk], 0)
+        self.assertEqual(bulk_scores[manager_1.pk, gameweek_2.pk], 1)
+        self.assertEqual(bulk_scores[manager_3.pk, gameweek_1.pk], 3)
+
+    def test_bulk_calculate_scores_missing_performance(self):
+        season = Season.objects.create(start_date='2017-08-01', end_date='2018-05-15')
+        league = League.objects.create(name='Test League', entry_fee=10, season=season)
+        h2h_league = HeadToHeadLeague.objects.create(league=league, fpl_league_id=1)
+        manager_1 = Manager.objects.create(team_name='Team 1', fpl_manager_id=1, season=season)
+        manager_2 = Manager.objects.create(team_name='Team 2', fpl_manager_id=2, season=season)
+        gameweek = Gameweek.objects.create(number=1, start_date='2017-08-01', end_date='2017-08-03', season=season)
+        ManagerPerformance.objects.create(manager=manager_1, gameweek=gameweek, score=10)
+        h2h_match = HeadToHeadMatch.objects.create(fpl_match_id=7, h2h_league=h2h_league, gameweek=gameweek,
+                                                   manager_1=manager_1, manager_2=manager_2)
+
+        # Raises like calculate_score rather than skipping the match
+        with self.assertRaises(ManagerPerformance.DoesNotExist):
+            h2h_match.calculate_score()
+        with self.assertRaisesMessage(ManagerPerformance.DoesNotExist, 'H2H matches 7'):
+            HeadToHeadMatch.bulk_calculate_scores(HeadToHeadMatch.objects.all())
+        self.assertFalse(HeadToHeadPerformance.objects.exists())
+
 
 class ManagerTestCase(TestCase):
     def setUp(self):
@@ -663,8 +1104,8 @@ class ManagerTestCase(TestCase):
         ManagerPerformance.objects.create(manager=manager_1, gameweek=gameweek_1, score=0)
 
     @patch('fpl.models.datetime')
-    @patch('fpl.models.requests.get')
-    def test_retrieve_performance_data(self, mock_requests_get, mock_datetime):
+    @patch('fpl.client.FPLClient.get')
+    def test_retrieve_performance_data(self, mock_client_get, mock_datetime):
         performance_data = {
             'history': [
                 {
@@ -679,9 +1120,7 @@ class ManagerTestCase(TestCase):
                 }
             ]
         }
-        mock_response = Mock()
-        mock_response.json.return_value = performance_data
-        mock_requests_get.return_value = mock_response
+        mock_client_get.return_value = performance_data
         mock_datetime.date.today.return_value = datetime.date(2018, 5, 10)
         mock_datetime.timedelta.side_effect = lambda *args, **kw: datetime.timedelta(*args, **kw)
 
@@ -704,8 +1143,8 @@ class ManagerTestCase(TestCase):
             2
         )
 
-    @patch('fpl.models.requests.get')
-    def test_retrieve_league_performance_after_season_end_does_not_update(self, mock_requests_get):
+    @patch('fpl.client.FPLClient.get')
+    def test_retrieve_league_performance_after_season_end_does_not_update(self, mock_client_get):
         performance_data = {
             'history': [
                 {
@@ -720,9 +1159,7 @@ class ManagerTestCase(TestCase):
                 }
             ]
         }
-        mock_response = Mock()
-        mock_response.json.return_value = performance_data
-        mock_requests_get.return_value = mock_response
+        mock_client_get.return_value = performance_data
 
         manager = Manager.objects.get()
         today = datetime.date.today()
@@ -737,14 +1174,86 @@ class ManagerTestCase(TestCase):
             ).score,
             0
         )
-        mock_requests_get.assert_not_called()
+        mock_client_get.assert_not_called()
+
+    @patch('fpl.models.ThreadPoolExecutor', wraps=ThreadPoolExecutor)
+    @patch('fpl.models.datetime')
+    @patch('fpl.client.FPLClient.get')
+    def test_bulk_retrieve_performance_data(self, mock_client_get, mock_datetime, mock_executor):
+        histories = {
+            'entry/1/history': {
+                'history': [
+                    {
+                        'event': 1,
+                        'points': 10,
+                        'event_transfers_cost': 0
+                    }
+                ]
+            },
+            'entry/2/history': {
+                'history': [
+                    {
+                        'event': 1,
+                        'points': 20,
+                        'event_transfers_cost': 4
+                    },
+                    {
+                        'event': 2,
+                        'points': 30,
+                        'event_transfers_cost': 0
+                    }
+                ]
+            }
+        }
+        mock_client_get.side_effect = lambda path: histories[path]
+        mock_datetime.date.today.return_value = datetime.date(2018, 5, 10)
+        mock_datetime.timedelta.side_effect = lambda *args, **kw: datetime.timedelta(*args, **kw)
+
+        manager_1 = Manager.objects.get()
+        manager_2 = Manager.objects.create(team_name='Team 2', fpl_manager_id=2, season=self.season)
+        Manager.bulk_retrieve_performance_data([manager_1, manager_2], self.season, max_workers=2)
+
+        mock_executor.assert_called_once_with(max_workers=2)
+        self.assertEqual(ManagerPerformance.objects.count(), 3)
+        self.assertEqual(ManagerPerformance.objects.get(manager=manager_1, gameweek__number=1).score, 10)
+        self.assertEqual(ManagerPerformance.objects.get(manager=manager_2, gameweek__number=1).score, 16)
+        self.assertEqual(ManagerPerformance.objects.get(manager=manager_2, gameweek__number=2).score, 30)
+
+    @patch('fpl.models.datetime')
+    def test_bulk_retrieve_performance_data_upserts(self, mock_datetime):
+        mock_datetime.date.today.return_value = datetime.date(2018, 5, 10)
+        mock_datetime.timedelta.side_effect = lambda *args, **kw: datetime.timedelta(*args, **kw)
+        manager_1 = Manager.objects.get()
+        manager_2 = Manager.objects.create(team_name='Team 2', fpl_manager_id=2, season=self.season)
+        histories = {
+            1: {'history': [{'event': 1, 'points': 10, 'event_transfers_cost': 0}]},
+            2: {'history': [{'event': 1, 'points': 20, 'event_transfers_cost': 4},
+                            {'event': 2, 'points': 30, 'event_transfers_cost': 0}]}
+        }
+
+        # A single upsert for every manager's history once the gameweek map is loaded
+        gameweek_ids = Gameweek.ids_by_number(self.season)
+        with self.assertNumQueries(1):
+            Manager.bulk_retrieve_performance_data([manager_1, manager_2], self.season, histories, gameweek_ids)
+
+        self.assertEqual(ManagerPerformance.objects.count(), 3)
+        self.assertEqual(ManagerPerformance.objects.get(manager=manager_1, gameweek__number=1).score, 10)
+        self.assertEqual(ManagerPerformance.objects.get(manager=manager_2, gameweek__number=1).score, 16)
 
 
 class GameweekTestCase(TestCase):
+    def test_ids_by_number(self):
+        season_1 = Season.objects.create(start_date='2017-08-01', end_date='2018-05-15')
+        season_2 = Season.objects.create(start_date='2018-08-01', end_date='2019-05-15')
+        gameweek_1 = Gameweek.objects.create(number=1, start_date='2017-08-01', end_date='2017-08-03', season=season_1)
+        gameweek_2 = Gameweek.objects.create(number=2, start_date='2017-08-08', end_date='2017-08-11', season=season_1)
+        Gameweek.objects.create(number=1, start_date='2018-08-01', end_date='2018-08-03', season=season_2)
+
+        self.assertEqual(Gameweek.ids_by_number(season_1), {1: gameweek_1.pk, 2: gameweek_2.pk})
 
     @patch('fpl.models.datetime')
-    @patch('fpl.models.requests.get')
-    def test_retrieve_gameweek_data(self, mock_requests_get, mock_datetime):
+    @patch('fpl.client.FPLClient.get_conditional')
+    def test_retrieve_gameweek_data(self, mock_get_conditional, mock_datetime):
         fixture_data = [
             {
                 "kickoff_time": "2017-08-11T18:45:00Z",
@@ -773,9 +1282,7 @@ class GameweekTestCase(TestCase):
             ]
         }
 
-        mock_response = Mock()
-        mock_response.json.side_effect = [fixture_data, gameweek_data]
-        mock_requests_get.return_value = mock_response
+        mock_get_conditional.side_effect = [(fixture_data, True), (gameweek_data, True)]
         mock_datetime.date.today.return_value = datetime.date(2018, 5, 10)
         mock_datetime.timedelta.side_effect = lambda *args, **kw: datetime.timedelta(*args, **kw)
 
@@ -789,23 +1296,39 @@ class GameweekTestCase(TestCase):
         self.assertEqual(Gameweek.objects.get(number=1).start_date, datetime.date(2017, 8, 11))
         self.assertEqual(Gameweek.objects.get(number=2).start_date, datetime.date(2017, 8, 18))
 
-    @patch('fpl.models.requests.get')
+    @patch('fpl.client.FPLClient.get_conditional', return_value=(MagicMock(), True))
     @patch('fpl.models.timezone.now', side_effect=lambda: datetime.datetime.now())
-    def test_retrieve_gameweek_data_does_nothing_after_season_end(self, mock_timezone_now, mock_requests_get):
+    def test_retrieve_gameweek_data_does_nothing_after_season_end(self, mock_timezone_now, mock_get_conditional):
         season = Season.objects.create(start_date='2017-08-01', end_date=timezone.now() - datetime.timedelta(days=13))
         season.refresh_from_db()
 
         Gameweek.retrieve_gameweek_data(season)
 
-        self.assertEqual(mock_requests_get.call_count, 2)
+        self.assertEqual(mock_get_conditional.call_count, 2)
 
-        mock_requests_get.reset_mock()
+        mock_get_conditional.reset_mock()
 
         season = Season.objects.create(start_date='2017-08-01', end_date=timezone.now() - datetime.timedelta(days=14))
         season.refresh_from_db()
 
         Gameweek.retrieve_gameweek_data(season)
-        mock_requests_get.assert_not_called()
+        mock_get_conditional.assert_not_called()
+
+    @patch('fpl.models.datetime')
+    @patch('fpl.client.FPLClient.get_conditional')
+    def test_retrieve_gameweek_data_not_modified(self, mock_get_conditional, mock_datetime):
+        mock_get_conditional.side_effect = [([], False), ({'events': [{'id': 1}]}, False)]
+        mock_datetime.date.today.return_value = datetime.date(2018, 5, 10)
+        mock_datetime.timedelta.side_effect = lambda *args, **kw: datetime.timedelta(*args, **kw)
+
+        season = Season.objects.create(start_date='2017-08-01', end_date='2018-05-13')
+        season.refresh_from_db()
+        Gameweek.objects.create(number=1, start_date='2017-08-01', end_date='2017-08-03', season=season)
+
+        Gameweek.retrieve_gameweek_data(season)
+
+        self.assertEqual(mock_get_conditional.call_count, 2)
+        self.assertEqual(Gameweek.objects.get().start_date, datetime.date(2017, 8, 1))
 
 
 class ClassicPayoutTestCase(TestCase):
@@ -954,6 +1477,25 @@ class ClassicPayoutTestCase(TestCase):
         with self.assertRaises(NotImplementedError):
             payout_2.calculate_winner()
 
+    def test_calculate_multiple_positions(self):
+        payout_1, payout_2, payout_3 = [ClassicPayout.objects.create(
+            league=self.league,
+            name='Test Payout {}'.format(position),
+            amount=10,
+            position=position,
+            start_date='2017-08-01',
+            end_date='2017-08-31',
+            paid_out=False
+        ) for position in (1, 2, 3)]
+
+        payout_1.calculate_winner()
+        payout_2.calculate_winner()
+        payout_3.calculate_winner()
+
+        self.assertEqual(payout_1.winner, self.entrant_3)
+        self.assertEqual(payout_2.winner, self.entrant_2)
+        self.assertEqual(payout_3.winner, self.entrant_1)
+
 
 class HeadToHeadPayoutTestCase(TestCase):
     def setUp(self):
@@ -1109,14 +1651,15 @@ class ClassicLeagueRefreshViewTestCase(TestCase):
         league_1 = League.objects.create(name='Test League 1', entry_fee=10, season=season)
         classic_league = ClassicLeague.objects.create(league=league_1, fpl_league_id=1)
         response = self.client.post(reverse('fpl:season:classic:process-payouts', args=[season.pk, classic_league.pk]))
-        mock_process_payouts.assert_called_once()
-
-        mock_process_payouts.reset_mock()
+        self.assertRedirects(response, reverse('fpl:season:classic:detail', args=[season.pk, classic_league.pk]))
+        mock_process_payouts.assert_not_called()
+        self.assertEqual(RefreshJob.for_league(classic_league).get().status, RefreshJob.QUEUED)
 
+        RefreshJob.objects.all().delete()
         classic_league.last_updated = timezone.now()
         classic_league.save()
         response = self.client.post(reverse('fpl:season:classic:process-payouts', args=[season.pk, classic_league.pk]))
-        mock_process_payouts.assert_not_called()
+        self.assertFalse(RefreshJob.objects.exists())
 
 
 class ClassicLeagueListViewTestCase(TestCase):
@@ -1143,6 +1686,7 @@ class ClassicLeagueListViewTestCase(TestCase):
                                  ['<ClassicLeague: (2017-08-01 - 2018-05-15) - Test League 1>', '<ClassicLeague: (2017-08-01 - 2018-05-15) - Test League 2>'])
 
 
+@override_settings(FPL_PAGE_CACHE=None)
 class ClassicLeagueDetailViewTestCase(TestCase):
     def test_league_exists(self):
         response = self.client.get(reverse('fpl:season:classic:detail', args=[1, 1]))
@@ -1182,6 +1726,7 @@ class ClassicLeagueDetailViewTestCase(TestCase):
             ManagerPerformance(manager=manager_2, gameweek=gameweek_2, score=10),
             ManagerPerformance(manager=manager_3, gameweek=gameweek_2, score=30)
         ])
+        classic_league.rebuild_standings()
 
         response = self.client.get(reverse('fpl:season:classic:detail', args=[season.pk, classic_league.pk]))
         self.assertQuerysetEqual(response.context['object'].managers.order_by('team_name'),
@@ -1294,13 +1839,14 @@ class HeadToHeadLeagueRefreshViewTestCase(TestCase):
         league_1 = League.objects.create(name='Test League 1', entry_fee=10, season=season)
         head_to_head_league = HeadToHeadLeague.objects.create(league=league_1, fpl_league_id=1)
         response = self.client.post(reverse('fpl:season:head-to-head:process-payouts', args=[season.pk, head_to_head_league.pk]))
-        mock_process_payouts.assert_called_once()
-        mock_process_payouts.reset_mock()
+        mock_process_payouts.assert_not_called()
+        self.assertEqual(RefreshJob.for_league(head_to_head_league).get().status, RefreshJob.QUEUED)
 
+        RefreshJob.objects.all().delete()
         head_to_head_league.last_updated = timezone.now()
         head_to_head_league.save()
         response = self.client.post(reverse('fpl:season:head-to-head:process-payouts', args=[season.pk, head_to_head_league.pk]))
-        mock_process_payouts.assert_not_called()
+        self.assertFalse(RefreshJob.objects.exists())
 
 
 class HeadToHeadLeagueListViewTestCase(TestCase):
@@ -1327,6 +1873,7 @@ class HeadToHeadLeagueListViewTestCase(TestCase):
                                  ['<HeadToHeadLeague: (2017-08-01 - 2018-05-15) - Test League 1>', '<HeadToHeadLeague: (2017-08-01 - 2018-05-15) - Test League 2>'])
 
 
+@override_settings(FPL_PAGE_CACHE=None)
 class HeadToHeadLeagueDetailViewTestCase(TestCase):
     def test_league_exists(self):
         season = Season.objects.create(start_date='2017-08-01', end_date='2018-05-13')
@@ -1368,6 +1915,7 @@ class HeadToHeadLeagueDetailViewTestCase(TestCase):
             HeadToHeadPerformance(h2h_league=head_to_head_league, manager=manager_2, gameweek=gameweek_2, score=1),
             HeadToHeadPerformance(h2h_league=head_to_head_league, manager=manager_3, gameweek=gameweek_2, score=3)
         ])
+        head_to_head_league.rebuild_standings()
 
         response = self.client.get(reverse('fpl:season:head-to-head:detail', args=[season.pk, head_to_head_league.pk]))
         self.assertQuerysetEqual(sorted(response.context['object'].managers, key=lambda x: x.team_name),
@@ -1470,3 +2018,878 @@ class HeadToHeadLeagueDetailViewTestCase(TestCase):
         self.assertContains(response, 'Last Updated')
         ampm = ''.join([i.lower() + '.' for i in now.strftime('%p')])
         self.assertContains(response, now.strftime('%b. %-d, %Y, %-I:%M ' + ampm))
+
+
+@override_settings(FPL_RATE_LIMIT=None)
+class FPLClientTestCase(TestCase):
+    @override_settings(FPL_BASE_URL='http://fpl.test/drf/')
+    @patch('fpl.client.requests.Session.request')
+    def test_get(self, mock_request):
+        mock_request.return_value.json.return_value = {'events': []}
+        client = FPLClient()
+
+        self.assertEqual(client.get('bootstrap-static'), {'events': []})
+        self.assertEqual(client.get('entry/1/history'), {'events': []})
+
+        mock_request.assert_any_call('GET', 'http://fpl.test/drf/bootstrap-static', params=None,
+                                     timeout=(3.05, 30))
+        mock_request.assert_any_call('GET', 'http://fpl.test/drf/entry/1/history', params=None,
+                                     timeout=(3.05, 10))
+        self.assertEqual(client.stats['bootstrap-static']['requests'], 1)
+        self.assertEqual(client.stats['entry']['requests'], 1)
+        self.assertEqual(client.stats['entry']['errors'], 0)
+
+    @patch('fpl.client.requests.Session.request')
+    def test_get_records_errors(self, mock_request):
+        mock_request.return_value.raise_for_status.side_effect = requests.HTTPError()
+        client = FPLClient()
+
+        with self.assertRaises(requests.HTTPError):
+            client.get('fixtures')
+        self.assertEqual(client.stats['fixtures']['errors'], 1)
+
+    @patch('fpl.client.requests.Session.request')
+    def test_get_conditional(self, mock_request):
+        modified = Mock(status_code=200, headers={'ETag': '"v1"', 'Last-Modified': 'Fri, 10 Aug 2018 12:00:00 GMT'})
+        modified.json.return_value = {'events': []}
+        not_modified = Mock(status_code=304, headers={})
+        mock_request.side_effect = [modified, not_modified]
+        client = FPLClient()
+
+        with tempfile.TemporaryDirectory() as location, override_settings(FPL_RESPONSE_CACHE={
+            'LOCATION': location, 'MAX_SIZE': 1024 * 1024, 'TTLS': {}
+        }):
+            self.assertEqual(client.get_conditional('bootstrap-static'), ({'events': []}, True))
+            self.assertEqual(client.get_conditional('bootstrap-static'), ({'events': []}, False))
+        self.assertEqual(mock_request.call_args[1]['headers'], {
+            'If-None-Match': '"v1"',
+            'If-Modified-Since': 'Fri, 10 Aug 2018 12:00:00 GMT'
+        })
+        self.assertEqual(client.stats['bootstrap-static']['not_modified'], 1)
+
+    @patch('fpl.client.FPLClient.authenticate')
+    def test_get_authorized_client(self, mock_authenticate):
+        with self.settings(FPL_BASE_URL='http://fpl.test/drf/'):
+            client = get_authorized_client('user', 'password')
+
+            self.assertIs(get_authorized_client('user', 'password'), client)
+            self.assertIsNot(get_authorized_client('other', 'password'), client)
+            self.assertEqual(mock_authenticate.call_args_list, [(('user', 'password'),), (('other', 'password'),)])
+        self.assertIsNot(get_authorized_client('user', 'password'), client)
+
+    @patch('fpl.client.FPLClient.authenticate')
+    def test_get_authorized_client_concurrent_logins(self, mock_authenticate):
+        slow_started = threading.Event()
+        other_authenticated = threading.Event()
+        authenticated = []
+
+        def authenticate(username, password):
+            if username == 'slow':
+                slow_started.set()
+                other_authenticated.wait(5)
+            authenticated.append(username)
+        mock_authenticate.side_effect = authenticate
+
+        with self.settings(FPL_BASE_URL='http://fpl.test/drf/'):
+            slow = threading.Thread(target=get_authorized_client, args=('slow', 'password'))
+            slow.start()
+            slow_started.wait(5)
+            # Another account logs in while the first login is still in flight
+            get_authorized_client('other', 'password')
+            other_authenticated.set()
+            slow.join()
+        self.assertEqual(authenticated, ['other', 'slow'])
+
+    def test_iter_pages(self):
+        fetched = []
+
+        def fetch_page(page_number):
+            fetched.append(page_number)
+            return {'number': page_number, 'has_next': page_number < 3}
+
+        pages = iter_pages(fetch_page, lambda page: page['has_next'])
+
+        self.assertEqual([page['number'] for page in pages], [1, 2, 3])
+        self.assertEqual(fetched, [1, 2, 3])
+
+    def test_iter_pages_single_page(self):
+        fetch_page = Mock(return_value={'has_next': False})
+
+        self.assertEqual(list(iter_pages(fetch_page, lambda page: page['has_next'])), [{'has_next': False}])
+        fetch_page.assert_called_once_with(1)
+
+    @patch('fpl.client.time.sleep')
+    @patch('fpl.client.requests.Session.request')
+    def test_get_retries_throttled_requests(self, mock_request, _):
+        throttled = Mock(status_code=429, headers={'Retry-After': '2'})
+        throttled.raise_for_status.side_effect = requests.HTTPError(response=throttled)
+        success = Mock(status_code=200)
+        success.json.return_value = {'history': []}
+        mock_request.side_effect = [throttled, success]
+        rate_limiter = Mock()
+        rate_limiter.reserve.return_value = 0
+
+        with patch('fpl.client.get_rate_limiter', return_value=rate_limiter):
+            self.assertEqual(FPLClient().get('entry/1/history'), {'history': []})
+
+        self.assertEqual(rate_limiter.acquire.call_count, 2)
+        rate_limiter.feedback.assert_called_once_with(429, 2.0)
+
+    def test_get_client_is_shared(self):
+        self.assertIs(get_client(), get_client())
+
+    @patch('fpl.client.FPLClient.login')
+    def test_authenticate_reuses_cached_cookies(self, mock_login):
+        def login(username, password):
+            client.session.cookies.set('sessionid', 'abc', domain='.premierleague.com')
+
+        caches['fpl'].clear()
+        client = FPLClient()
+        mock_login.side_effect = login
+        client.authenticate('user', 'password')
+        mock_login.assert_called_once_with('user', 'password')
+
+        mock_login.reset_mock()
+        client = FPLClient()
+        client.authenticate('user', 'password')
+        mock_login.assert_not_called()
+        self.assertEqual(client.session.cookies['sessionid'], 'abc')
+
+    @patch('fpl.client.FPLClient.login')
+    @patch('fpl.client.requests.Session.request')
+    def test_get_logs_in_again_when_unauthorized(self, mock_request, mock_login):
+        unauthorized = Mock(status_code=403)
+        unauthorized.raise_for_status.side_effect = requests.HTTPError(response=unauthorized)
+        authorized = Mock()
+        authorized.json.return_value = {'matches': []}
+        mock_request.side_effect = [unauthorized, authorized]
+        caches['fpl'].clear()
+
+        client = FPLClient()
+        client.authenticate('user', 'password')
+        self.assertEqual(client.get('leagues-entries-and-h2h-matches/league/1?page=1'), {'matches': []})
+        self.assertEqual(mock_login.call_count, 2)
+
+
+@skipIf(aio.aiohttp is None, 'aiohttp is not installed')
+@override_settings(FPL_RATE_LIMIT=None)
+class AsyncIngestionTestCase(TestCase):
+    def setUp(self):
+        self.data = stub_server.SyntheticFPLData(league_size=3, page_size=2, gameweeks=6, current_gameweek=2)
+        season = Season.objects.create(start_date=self.data.start_date,
+                                       end_date=self.data.start_date + datetime.timedelta(weeks=6))
+        # Both leagues have the same FPL id, so they share their managers
+        self.classic_league = ClassicLeague.objects.create(
+            league=League.objects.create(name='Classic', entry_fee=10, season=season), fpl_league_id=1)
+        self.head_to_head_league = HeadToHeadLeague.objects.create(
+            league=League.objects.create(name='Head To Head', entry_fee=10, season=season), fpl_league_id=1)
+
+    def test_ingest_leagues(self):
+        with stub_server.StubFPLServer(self.data) as server:
+            with self.settings(FPL_HOMEPAGE_URL=server.homepage_url, FPL_LOGIN_URL=server.login_url):
+                data = aio.ingest_leagues([self.classic_league, self.head_to_head_league],
+                                          base_url=server.base_url)
+
+        manager_ids = self.data.manager_ids(1)
+        self.assertEqual([server.requests['/drf/entry/{}/history'.format(manager_id)] for manager_id in manager_ids],
+                         [1, 1, 1])
+        self.assertEqual(server.requests['/drf/fixtures'], 1)
+        self.assertEqual(data[self.classic_league]['fixtures'], self.data.fixtures())
+        self.assertEqual(data[self.head_to_head_league]['bootstrap-static'], self.data.bootstrap_static())
+        self.assertEqual(data[self.classic_league]['pages'], [self.data.classic_standings(1, 1),
+                                                              self.data.classic_standings(1, 2)])
+        self.assertEqual(data[self.head_to_head_league]['pages'][-1]['matches']['has_next'], False)
+        self.assertEqual(data[self.head_to_head_league]['pages'][0], self.data.h2h_page(1, 1))
+        for league in (self.classic_league, self.head_to_head_league):
+            self.assertEqual(data[league]['histories'], {
+                manager_id: self.data.history(manager_id) for manager_id in manager_ids
+            })
+
+    @override_settings(FPL_RATE_LIMIT={'RATE': 10, 'BURST': 20})
+    @patch('fpl.ratelimit.RateLimiter.reserve')
+    def test_ingest_leagues_reserves_off_event_loop(self, mock_reserve):
+        threads = []
+        mock_reserve.side_effect = lambda: threads.append(threading.current_thread()) or 0
+
+        with stub_server.StubFPLServer(self.data) as server:
+            aio.ingest_leagues([self.classic_league], base_url=server.base_url)
+
+        self.assertEqual(len(threads), server.request_count)
+        self.assertNotIn(threading.current_thread(), threads)
+
+    @patch('fpl.cache.ResponseCache.set')
+    @patch('fpl.cache.ResponseCache.get', return_value=None)
+    def test_ingest_leagues_uses_response_cache_off_event_loop(self, mock_get, mock_set):
+        threads = []
+        mock_get.side_effect = lambda *args: threads.append(threading.current_thread())
+        mock_set.side_effect = lambda *args: threads.append(threading.current_thread())
+
+        with tempfile.TemporaryDirectory() as location, stub_server.StubFPLServer(self.data) as server:
+            with self.settings(FPL_RESPONSE_CACHE={'LOCATION': location, 'MAX_SIZE': 1024 * 1024,
+                                                   'TTLS': {'default': 60}}):
+                aio.ingest_leagues([self.classic_league], base_url=server.base_url)
+
+        self.assertEqual(len(threads), 2 * server.request_count)
+        self.assertNotIn(threading.current_thread(), threads)
+
+    @patch('fpl.models.ClassicLeague.process_payouts')
+    @patch('fpl.management.commands.ingest_fpl.ingest_leagues')
+    def test_ingest_fpl_command(self, mock_ingest_leagues, mock_process_payouts):
+        mock_ingest_leagues.return_value = {self.classic_league: {'pages': []}}
+
+        call_command('ingest_fpl', '--classic', str(self.classic_league.pk), stdout=Mock())
+
+        mock_ingest_leagues.assert_called_once_with([self.classic_league], concurrency=None)
+        mock_process_payouts.assert_called_once_with({'pages': []})
+
+
+class SyntheticFPLDataTestCase(TestCase):
+    def setUp(self):
+        self.data = stub_server.SyntheticFPLData(league_size=5, page_size=2, gameweeks=6, current_gameweek=3)
+
+    def test_classic_standings(self):
+        pages = [self.data.classic_standings(1, page_number) for page_number in (1, 2, 3)]
+
+        self.assertEqual([page['standings']['has_next'] for page in pages], [True, True, False])
+        results = [result for page in pages for result in page['standings']['results']]
+        self.assertEqual(sorted(result['entry'] for result in results), self.data.manager_ids(1))
+        for result in results:
+            history = self.data.history(result['entry'])['history']
+            self.assertEqual(result['total'], sum(event['points'] - event['event_transfers_cost'] for event in history))
+
+    def test_h2h_matches(self):
+        matches = self.data.h2h_matches(1)
+
+        # Odd leagues play an AVERAGE opponent, so every entry plays exactly once per gameweek
+        self.assertEqual(len(matches), 6 * 3)
+        for gameweek in range(1, 7):
+            entries = [entry for match in matches if match['event'] == gameweek
+                       for entry in (match['entry_1_entry'], match['entry_2_entry'])]
+            self.assertCountEqual(entries, self.data.manager_ids(1) + [None])
+        self.assertEqual(len({match['id'] for match in matches}), len(matches))
+        # Match ids never run into the next league's, however large the leagues are
+        self.assertLess(max(match['id'] for match in matches), min(match['id'] for match in self.data.h2h_matches(2)))
+        large = stub_server.SyntheticFPLData(league_size=600, gameweeks=38)
+        self.assertLess(max(match['id'] for match in large.h2h_matches(1)),
+                        min(match['id'] for match in large.h2h_matches(2)))
+
+
+@override_settings(FPL_RATE_LIMIT=None)
+class StubFPLServerTestCase(TestCase):
+    def setUp(self):
+        caches['fpl'].clear()
+        self.data = stub_server.SyntheticFPLData(league_size=7, page_size=3, gameweeks=12, current_gameweek=4)
+        season = Season.objects.create(start_date=self.data.start_date,
+                                       end_date=self.data.start_date + datetime.timedelta(weeks=12))
+        self.classic_league = ClassicLeague.objects.create(
+            league=League.objects.create(name='Classic', entry_fee=10, season=season), fpl_league_id=1)
+        self.head_to_head_league = HeadToHeadLeague.objects.create(
+            league=League.objects.create(name='Head To Head', entry_fee=10, season=season), fpl_league_id=2)
+
+    def test_process_payouts(self):
+        with stub_server.StubFPLServer(self.data) as server:
+            with self.settings(FPL_BASE_URL=server.base_url, FPL_HOMEPAGE_URL=server.homepage_url,
+                               FPL_LOGIN_URL=server.login_url):
+                self.classic_league.process_payouts()
+                self.head_to_head_league.process_payouts()
+
+        self.assertEqual(Gameweek.objects.count(), 12)
+        self.assertEqual(self.classic_league.league.name, 'Classic League 1')
+        self.assertEqual(ManagerPerformance.objects.filter(manager__fpl_manager_id__in=self.data.manager_ids(1))
+                         .count(), 7 * 4)
+        self.assertEqual(HeadToHeadMatch.objects.filter(h2h_league=self.head_to_head_league).count(), 12 * 4)
+
+    @patch('fpl.client.time.sleep')
+    def test_error_rate(self, _):
+        with stub_server.StubFPLServer(self.data, error_rate=1) as server:
+            with self.assertRaises(requests.HTTPError) as cm:
+                FPLClient(server.base_url).get('fixtures')
+
+        self.assertEqual(cm.exception.response.status_code, 503)
+
+
+class RefreshJobTestCase(TestCase):
+    def setUp(self):
+        season = Season.objects.create(start_date='2017-08-01', end_date='2018-05-15')
+        self.classic_league = ClassicLeague.objects.create(
+            league=League.objects.create(name='Classic', entry_fee=10, season=season), fpl_league_id=1)
+        self.head_to_head_league = HeadToHeadLeague.objects.create(
+            league=League.objects.create(name='Head To Head', entry_fee=10, season=season), fpl_league_id=1)
+
+    def test_enqueue(self):
+        job = RefreshJob.enqueue(self.classic_league)
+
+        self.assertEqual(RefreshJob.enqueue(self.classic_league), job)
+        self.assertNotEqual(RefreshJob.enqueue(self.head_to_head_league), job)
+        self.assertEqual(job.league, self.classic_league)
+        job.status = RefreshJob.SUCCEEDED
+        job.save()
+        self.assertNotEqual(RefreshJob.enqueue(self.classic_league), job)
+
+    def test_claim(self):
+        RefreshJob.enqueue(self.classic_league, run_after=timezone.now() + datetime.timedelta(minutes=5))
+        self.assertIsNone(RefreshJob.claim())
+
+        job = RefreshJob.enqueue(self.head_to_head_league)
+        claimed = RefreshJob.claim()
+        self.assertEqual(claimed, job)
+        self.assertEqual(claimed.status, RefreshJob.RUNNING)
+        self.assertEqual(claimed.attempts, 1)
+        # Running jobs are only handed out again once their lease expires
+        self.assertIsNone(RefreshJob.claim())
+        RefreshJob.objects.filter(pk=job.pk).update(run_after=timezone.now())
+        self.assertEqual(RefreshJob.claim().attempts, 2)
+
+    @override_settings(FPL_REFRESH_JOB_MAX_ATTEMPTS=2)
+    def test_claim_expired_lease(self):
+        job = RefreshJob.enqueue(self.classic_league)
+        RefreshJob.claim()
+        # Taking over an expired lease counts as another attempt
+        RefreshJob.objects.filter(pk=job.pk).update(run_after=timezone.now())
+        self.assertEqual(RefreshJob.claim().attempts, 2)
+
+        RefreshJob.objects.filter(pk=job.pk).update(run_after=timezone.now())
+        self.assertIsNone(RefreshJob.claim())
+        job.refresh_from_db()
+        self.assertEqual(job.status, RefreshJob.FAILED)
+        self.assertIsNotNone(job.finished)
+        self.assertNotEqual(RefreshJob.enqueue(self.classic_league), job)
+
+    @override_settings(FPL_REFRESH_JOB_MAX_ATTEMPTS=2)
+    @patch('fpl.models.ClassicLeague.process_payouts')
+    def test_run_retries(self, mock_process_payouts):
+        mock_process_payouts.side_effect = requests.HTTPError('503 Server Error')
+        RefreshJob.enqueue(self.classic_league)
+
+        job = RefreshJob.claim()
+        job.run()
+        self.assertEqual(job.status, RefreshJob.QUEUED)
+        self.assertIn('503 Server Error', job.error)
+        self.assertGreater(job.run_after, timezone.now())
+
+        RefreshJob.objects.filter(pk=job.pk).update(run_after=timezone.now())
+        job = RefreshJob.claim()
+        job.run()
+        self.assertEqual(job.status, RefreshJob.FAILED)
+        self.assertEqual(mock_process_payouts.call_count, 2)
+
+    @patch('fpl.models.HeadToHeadLeague.process_payouts')
+    @patch('fpl.models.ClassicLeague.process_payouts')
+    def test_refresh_worker_command(self, mock_classic_process_payouts, mock_h2h_process_payouts):
+        RefreshJob.enqueue(self.classic_league)
+        RefreshJob.enqueue(self.head_to_head_league)
+
+        call_command('refresh_worker', '--once', '--concurrency', '1', stdout=Mock())
+
+        mock_classic_process_payouts.assert_called_once_with()
+        mock_h2h_process_payouts.assert_called_once_with()
+        self.assertEqual(RefreshJob.objects.filter(status=RefreshJob.SUCCEEDED).count(), 2)
+
+    def test_detail_view_shows_status(self):
+        RefreshJob.enqueue(self.classic_league)
+        response = self.client.get(reverse('fpl:season:classic:detail',
+                                           args=[self.classic_league.league.season.pk, self.classic_league.pk]))
+
+        self.assertContains(response, 'Refresh Status: Queued')
+
+
+@override_settings(FPL_RATE_LIMIT=None)
+class LivePointsTestCase(TestCase):
+    def setUp(self):
+        User = get_user_model()
+        today = datetime.date.today()
+        self.season = Season.objects.create(start_date=today - datetime.timedelta(days=30),
+                                            end_date=today + datetime.timedelta(days=200))
+        self.gameweek = Gameweek.objects.create(number=5, start_date=today - datetime.timedelta(days=1),
+                                                end_date=today + datetime.timedelta(days=2), season=self.season)
+        self.leagues = []
+        for i in (1, 2):
+            league = League.objects.create(name='League {}'.format(i), entry_fee=10, season=self.season)
+            self.leagues.append(ClassicLeague.objects.create(league=league, fpl_league_id=i))
+        for i in (1, 2):
+            entrant = User.objects.create(username='entrant_{}'.format(i))
+            Manager.objects.create(entrant=entrant, team_name='Team {}'.format(i), fpl_manager_id=i,
+                                   season=self.season)
+            for league in self.leagues:
+                LeagueEntrant.objects.create(entrant=entrant, league=league.league, paid_entry=True)
+        self.responses = {
+            'event/5/live': {'elements': {'10': {'stats': {'total_points': 6}}, '11': {'stats': {'total_points': 2}}}},
+            'entry/1/event/5/picks': {'picks': [{'element': 10, 'multiplier': 2}, {'element': 11, 'multiplier': 0}],
+                                      'entry_history': {'event_transfers_cost': 4}},
+            'entry/2/event/5/picks': {'picks': [{'element': 10, 'multiplier': 1}, {'element': 11, 'multiplier': 1}],
+                                      'entry_history': {'event_transfers_cost': 0}}
+        }
+
+    def test_element_points(self):
+        self.assertEqual(Gameweek.element_points(self.responses['event/5/live']), {10: 6, 11: 2})
+        self.assertEqual(Gameweek.element_points({'elements': [{'id': 10, 'stats': {'total_points': 6}}]}), {10: 6})
+
+    @patch('fpl.client.FPLClient.get')
+    def test_retrieve_live_points(self, mock_client_get):
+        mock_client_get.side_effect = lambda path: self.responses[path]
+
+        self.leagues[0].retrieve_live_points()
+
+        self.assertEqual(list(ManagerPerformance.objects.order_by('manager__fpl_manager_id').values_list(
+            'score', 'provisional')), [(8, True), (8, True)])
+
+        # The manager's history replaces the provisional score once the gameweek is finalised
+        manager = Manager.objects.get(fpl_manager_id=1)
+        Manager.bulk_retrieve_performance_data([manager], self.season, {
+            1: {'history': [{'event': 5, 'points': 14, 'event_transfers_cost': 4}]}
+        })
+        performance = ManagerPerformance.objects.get(manager=manager)
+        self.assertEqual((performance.score, performance.provisional), (10, False))
+
+    @patch('fpl.models.Gameweek.live')
+    @patch('fpl.client.FPLClient.get')
+    def test_retrieve_live_points_without_live_gameweek(self, mock_client_get, mock_live):
+        mock_live.return_value = None
+
+        self.leagues[0].retrieve_live_points()
+
+        mock_client_get.assert_not_called()
+        self.assertFalse(ManagerPerformance.objects.exists())
+
+    @patch('fpl.client.FPLClient.get')
+    def test_live_points_command(self, mock_client_get):
+        mock_client_get.side_effect = lambda path: self.responses[path]
+
+        call_command('live_points', '--season', str(self.season.pk), stdout=Mock())
+
+        # Managers in both leagues are polled once
+        self.assertEqual(sorted(call[0][0] for call in mock_client_get.call_args_list), sorted(self.responses))
+        self.assertEqual(ManagerPerformance.objects.filter(provisional=True).count(), 2)
+
+    @patch('fpl.client.FPLClient.get')
+    def test_live_points_command_rebuilds_changed_leagues(self, mock_client_get):
+        mock_client_get.side_effect = lambda path: self.responses[path]
+        entrant = get_user_model().objects.create(username='entrant_3')
+        Manager.objects.create(entrant=entrant, team_name='Team 3', fpl_manager_id=3, season=self.season)
+        league = ClassicLeague.objects.create(
+            league=League.objects.create(name='League 3', entry_fee=10, season=self.season), fpl_league_id=3)
+        LeagueEntrant.objects.create(entrant=entrant, league=league.league, paid_entry=True)
+        self.responses['entry/3/event/5/picks'] = self.responses['entry/2/event/5/picks']
+        call_command('live_points', '--season', str(self.season.pk), stdout=Mock())
+
+        self.responses['entry/1/event/5/picks'] = {'picks': [{'element': 10, 'multiplier': 3}],
+                                                   'entry_history': {'event_transfers_cost': 0}}
+        with patch('fpl.models.ClassicLeague.rebuild_standings', autospec=True) as mock_rebuild_standings:
+            call_command('live_points', '--season', str(self.season.pk), stdout=Mock())
+
+        self.assertCountEqual([call[0][0] for call in mock_rebuild_standings.call_args_list], self.leagues)
+
+    def test_head_to_head_live_managers(self):
+        league = HeadToHeadLeague.objects.create(
+            league=League.objects.create(name='Head To Head', entry_fee=10, season=self.season), fpl_league_id=3)
+        LeagueEntrant.objects.create(entrant=Manager.objects.get(fpl_manager_id=1).entrant, league=league.league,
+                                     paid_entry=True)
+        opponent = Manager.objects.create(team_name='Opponent', fpl_manager_id=3, season=self.season)
+        average = Manager.objects.create(team_name='AVERAGE', fpl_manager_id=-3, season=self.season)
+        HeadToHeadMatch.objects.create(fpl_match_id=1, h2h_league=league, gameweek=self.gameweek,
+                                       manager_1=opponent, manager_2=average)
+
+        self.assertCountEqual(league.live_managers(), [Manager.objects.get(fpl_manager_id=1), opponent])
+
+
+class RefreshLeaseTestCase(TestCase):
+    def setUp(self):
+        season = Season.objects.create(start_date='2017-08-01', end_date='2018-05-15')
+        self.classic_league = ClassicLeague.objects.create(
+            league=League.objects.create(name='Classic', entry_fee=10, season=season), fpl_league_id=1)
+
+    def test_acquire(self):
+        owner = RefreshLease.acquire(self.classic_league)
+
+        self.assertIsNotNone(owner)
+        self.assertIsNone(RefreshLease.acquire(self.classic_league))
+        self.assertTrue(RefreshLease.held(self.classic_league))
+        RefreshLease.release(self.classic_league, 'someone else')
+        self.assertTrue(RefreshLease.held(self.classic_league))
+        RefreshLease.release(self.classic_league, owner)
+        self.assertFalse(RefreshLease.held(self.classic_league))
+
+    def test_acquire_expired(self):
+        RefreshLease.acquire(self.classic_league)
+        RefreshLease.objects.update(expires=timezone.now())
+
+        self.assertIsNotNone(RefreshLease.acquire(self.classic_league))
+
+    @patch('fpl.models.ClassicLeague.retrieve_league_data')
+    @patch('fpl.models.Gameweek.retrieve_gameweek_data')
+    @patch('fpl.models.time.sleep')
+    def test_process_payouts_waits_for_concurrent_refresh(self, mock_sleep, mock_retrieve_gameweek_data,
+                                                          mock_retrieve_league_data):
+        owner = RefreshLease.acquire(self.classic_league)
+        last_updated = timezone.now()
+
+        def finish_refresh(_):
+            ClassicLeague.objects.filter(pk=self.classic_league.pk).update(last_updated=last_updated)
+            RefreshLease.release(self.classic_league, owner)
+        mock_sleep.side_effect = finish_refresh
+
+        self.classic_league.process_payouts()
+
+        mock_sleep.assert_called_once()
+        mock_retrieve_gameweek_data.assert_not_called()
+        mock_retrieve_league_data.assert_not_called()
+        self.assertEqual(self.classic_league.last_updated, last_updated)
+        self.assertFalse(RefreshLease.objects.exists())
+
+
+class RefreshLeaguesCommandTestCase(TestCase):
+    def setUp(self):
+        self.season = Season.objects.create(start_date='2017-08-01', end_date='2018-05-15')
+        self.classic_league = ClassicLeague.objects.create(
+            league=League.objects.create(name='Classic', entry_fee=10, season=self.season), fpl_league_id=1)
+        self.head_to_head_league = HeadToHeadLeague.objects.create(
+            league=League.objects.create(name='Head To Head', entry_fee=10, season=self.season), fpl_league_id=1)
+
+    @patch('fpl.client.FPLClient.authenticate')
+    @patch('fpl.management.commands.refresh_leagues.connections')
+    def test_worker_initializer_resets_shared_client(self, *_):
+        shared_client = get_client()
+        authorized_client = get_authorized_client('user', 'password')
+        refresh_leagues._close_connections()
+        self.assertIsNot(get_client(), shared_client)
+        self.assertIsNot(get_authorized_client('user', 'password'), authorized_client)
+
+    @patch('fpl.models.ClassicLeague.process_payouts')
+    @patch('fpl.models.Gameweek.retrieve_gameweek_data')
+    def test_dry_run(self, mock_retrieve_gameweek_data, mock_process_payouts):
+        stdout = Mock()
+        call_command('refresh_leagues', '--season', str(self.season.pk), '--dry-run', stdout=stdout)
+
+        self.assertEqual(stdout.write.call_count, 2)
+        mock_retrieve_gameweek_data.assert_not_called()
+        mock_process_payouts.assert_not_called()
+
+    @patch('fpl.models.HeadToHeadLeague.process_payouts')
+    @patch('fpl.models.ClassicLeague.process_payouts')
+    @patch('fpl.models.Gameweek.retrieve_gameweek_data')
+    def test_refresh_leagues(self, mock_retrieve_gameweek_data, mock_classic_process_payouts,
+                             mock_h2h_process_payouts):
+        call_command('refresh_leagues', '--season', str(self.season.pk), '--parallelism', '1', stdout=Mock())
+
+        mock_retrieve_gameweek_data.assert_called_once_with(self.season)
+        mock_classic_process_payouts.assert_called_once_with(refresh_calendar=False)
+        mock_h2h_process_payouts.assert_called_once_with(refresh_calendar=False)
+
+    @patch('fpl.models.HeadToHeadLeague.process_payouts')
+    @patch('fpl.models.ClassicLeague.process_payouts')
+    @patch('fpl.models.Gameweek.retrieve_gameweek_data')
+    def test_refresh_leagues_failure(self, _, mock_classic_process_payouts, mock_h2h_process_payouts):
+        mock_classic_process_payouts.side_effect = requests.HTTPError('503 Server Error')
+        stderr = Mock()
+
+        with self.assertRaisesMessage(CommandError, '1 of 2 leagues failed to refresh'):
+            call_command('refresh_leagues', '--season', str(self.season.pk), '--parallelism', '1', stdout=Mock(),
+                         stderr=stderr)
+
+        mock_h2h_process_payouts.assert_called_once_with(refresh_calendar=False)
+        self.assertIn('503 Server Error', stderr.write.call_args[0][0])
+
+
+class SchedulerTestCase(TestCase):
+    def setUp(self):
+        self.season = Season.objects.create(start_date='2017-08-01', end_date='2018-05-15')
+        self.gameweeks = [
+            Gameweek.objects.create(number=1, start_date='2017-08-11', end_date='2017-08-14', season=self.season),
+            Gameweek.objects.create(number=2, start_date='2017-08-19', end_date='2017-08-22', season=self.season)
+        ]
+        for gameweek in self.gameweeks:
+            gameweek.refresh_from_db()
+
+    def test_refresh_reason(self):
+        league = Mock(last_updated=None)
+        live = timezone.make_aware(datetime.datetime(2017, 8, 12, 15))
+        closed = timezone.make_aware(datetime.datetime(2017, 8, 15, 9))
+
+        self.assertEqual(scheduler.refresh_reason(league, self.gameweeks, live), scheduler.LIVE)
+        league.last_updated = live - datetime.timedelta(minutes=5)
+        self.assertIsNone(scheduler.refresh_reason(league, self.gameweeks, live))
+        league.last_updated = live - datetime.timedelta(minutes=20)
+        self.assertEqual(scheduler.refresh_reason(league, self.gameweeks, live), scheduler.LIVE)
+
+        # Once after the gameweek closes, then not again until the next one starts
+        self.assertEqual(scheduler.refresh_reason(league, self.gameweeks, closed), scheduler.CLOSED)
+        league.last_updated = closed - datetime.timedelta(hours=1)
+        self.assertIsNone(scheduler.refresh_reason(league, self.gameweeks, closed))
+        self.assertIsNone(scheduler.refresh_reason(league, self.gameweeks, closed + datetime.timedelta(days=3)))
+
+        self.assertIsNone(scheduler.refresh_reason(league, [], closed))
+        league.last_updated = None
+        self.assertEqual(scheduler.refresh_reason(league, [], closed), scheduler.NEW_SEASON)
+
+    @override_settings(FPL_RATE_LIMIT={'RATE': 1, 'BURST': 1},
+                       FPL_REFRESH_SCHEDULE={'INTERVAL': 10, 'LIVE_INTERVAL': 900, 'BUDGET_FRACTION': 1})
+    def test_schedule_refreshes(self):
+        now = timezone.make_aware(datetime.datetime(2017, 8, 12, 15))
+        classic_leagues = [
+            ClassicLeague.objects.create(league=League.objects.create(name=str(i), entry_fee=10, season=self.season),
+                                         fpl_league_id=i, last_updated=now - datetime.timedelta(hours=i))
+            for i in range(1, 4)
+        ]
+        HeadToHeadLeague.objects.create(league=League.objects.create(name='Queued', entry_fee=10, season=self.season),
+                                        fpl_league_id=4)
+        RefreshJob.enqueue(HeadToHeadLeague.objects.get())
+        old_season = Season.objects.create(start_date='2016-08-01', end_date='2017-05-15')
+        ClassicLeague.objects.create(league=League.objects.create(name='Old', entry_fee=10, season=old_season),
+                                     fpl_league_id=5)
+
+        # Each league is estimated at 4 requests, so a budget of 10 fits the two least recently updated
+        planned = scheduler.schedule_refreshes(now)
+
+        self.assertEqual(planned, [(classic_leagues[2], scheduler.LIVE), (classic_leagues[1], scheduler.LIVE)])
+        self.assertEqual(RefreshJob.objects.filter(status=RefreshJob.QUEUED).count(), 3)
+        self.assertEqual(scheduler.plan_refreshes(now), [(classic_leagues[0], scheduler.LIVE)])
+
+    def test_estimated_requests(self):
+        classic_league = ClassicLeague.objects.create(
+            league=League.objects.create(name='Classic', entry_fee=10, season=self.season), fpl_league_id=1)
+        classic_league.entrant_count = 2
+        self.assertEqual(scheduler.estimated_requests(classic_league), 5)
+
+        # Managers who are not site entrants are fetched too
+        classic_league.manager_count, classic_league.page_count = 1200, 24
+        self.assertEqual(scheduler.estimated_requests(classic_league), 1226)
+
+
+class ResponseCacheTestCase(TestCase):
+    def setUp(self):
+        caches['fpl'].clear()
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache = ResponseCache(self.directory.name, max_size=1024 * 1024, ttls={'entry': 60}, cache_alias='fpl',
+                                   compress=True)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_get(self):
+        key = self.cache.make_key('entry/1/history')
+        self.assertIsNone(self.cache.get('entry', key))
+
+        self.cache.set('entry', key, {'history': []})
+        self.assertEqual(self.cache.get('entry', key), {'history': []})
+        self.assertEqual(self.cache.stats(), {'entry': {'hits': 1, 'misses': 1, 'hit_rate': 0.5}})
+
+    def test_stats_flushed_in_batches(self):
+        cache = ResponseCache(self.directory.name, max_size=1024 * 1024, ttls={'entry': 60}, cache_alias='fpl',
+                              stats_interval=60)
+        cache.get('entry', 'entry/1/history')
+        cache.get('entry', 'entry/2/history')
+        self.assertIsNone(caches['fpl'].get('fpl-response:entry:misses'))
+
+        cache.flush_stats()
+        self.assertEqual(caches['fpl'].get('fpl-response:entry:misses'), 2)
+
+    def test_get_expired(self):
+        key = self.cache.make_key('fixtures')
+        self.cache.set('fixtures', key, [], etag='"v1"')
+
+        self.assertIsNone(self.cache.get('fixtures', key))
+        self.assertEqual(self.cache.get_entry(key)['etag'], '"v1"')
+
+    def test_make_key(self):
+        self.assertEqual(self.cache.make_key('fixtures', {'event': 2, 'a': 1}),
+                         self.cache.make_key('fixtures', {'a': 1, 'event': 2}))
+        self.assertNotEqual(self.cache.make_key('fixtures', {'event': 1}), self.cache.make_key('fixtures'))
+
+    def test_evicts_least_recently_used(self):
+        cache = ResponseCache(self.directory.name, max_size=3500, ttls={'entry': 60}, cache_alias='fpl')
+        for manager_id in range(3):
+            cache.set('entry', 'entry/{}/history'.format(manager_id), 'x' * 900)
+            # Space out modification times so access order is unambiguous
+            past = time.time() - 100 + manager_id
+            os.utime(cache._path('entry/{}/history'.format(manager_id)), (past, past))
+        cache.get('entry', 'entry/0/history')
+
+        cache.set('entry', 'entry/3/history', 'x' * 900)
+
+        self.assertIsNotNone(cache.get_entry('entry/0/history'))
+        self.assertIsNone(cache.get_entry('entry/1/history'))
+        self.assertIsNotNone(cache.get_entry('entry/3/history'))
+
+    def test_response_cache_stats_command(self):
+        with override_settings(FPL_RESPONSE_CACHE={'LOCATION': self.directory.name, 'MAX_SIZE': 1024 * 1024,
+                                                   'TTLS': {'default': 0, 'entry': 60, 'event': 60}}):
+            response_cache = get_response_cache()
+            response_cache.get('entry', 'entry/1/history')
+            response_cache.set('entry', 'entry/1/history', {'history': []})
+            response_cache.get('entry', 'entry/1/history')
+            stdout = Mock()
+            call_command('response_cache_stats', '--reset', stdout=stdout)
+
+            self.assertEqual(stdout.write.call_args_list, [
+                (('entry: 1 hits, 1 misses, hit rate 50.0%\n',),),
+                (('event: 0 hits, 0 misses, hit rate -\n',),)
+            ])
+            self.assertEqual(response_cache.stats()['entry'], {'hits': 0, 'misses': 0, 'hit_rate': None})
+
+
+class PageCacheTestCase(TestCase):
+    def setUp(self):
+        caches['fpl-pages'].clear()
+        season = Season.objects.create(start_date='2017-08-01', end_date='2018-05-13')
+        league = League.objects.create(name='Test League', entry_fee=10, season=season)
+        self.classic_league = ClassicLeague.objects.create(league=league, fpl_league_id=1)
+        self.classic_league.rebuild_standings()
+        self.url = reverse('fpl:season:classic:detail', args=[season.pk, self.classic_league.pk])
+
+    def test_detail_view_cached(self):
+        self.client.get(self.url)
+        with self.assertNumQueries(3):
+            response = self.client.get(self.url)
+        self.assertContains(response, 'Classic League: Test League')
+        self.assertContains(response, 'csrfmiddlewaretoken')
+        self.assertEqual(get_page_cache().stats(), {'hits': 1, 'misses': 1, 'hit_rate': 0.5})
+
+    def test_detail_view_cache_invalidated(self):
+        self.client.get(self.url)
+        League.objects.update(name='Renamed League')
+        self.assertContains(self.client.get(self.url), 'Classic League: Test League')
+
+        self.classic_league.last_updated = timezone.now()
+        self.classic_league.save()
+        self.assertContains(self.client.get(self.url), 'Classic League: Renamed League')
+
+        League.objects.update(name='Test League')
+        self.classic_league.invalidate_page_cache()
+        self.assertContains(self.client.get(self.url), 'Classic League: Test League')
+        self.assertEqual(get_page_cache().stats()['misses'], 3)
+
+    def test_page_cache_stats_command(self):
+        self.client.get(self.url)
+        self.client.get(self.url)
+        stdout = Mock()
+        call_command('page_cache_stats', '--reset', stdout=stdout)
+        stdout.write.assert_called_once_with('1 hits, 1 misses, hit rate 50.0%\n')
+        self.assertEqual(get_page_cache().stats(), {'hits': 0, 'misses': 0, 'hit_rate': None})
+
+    def test_count_culled_between_add_and_incr(self):
+        page_cache = get_page_cache()
+        with patch.object(page_cache.cache, 'add', return_value=False):
+            page_cache.get(self.classic_league, 'detail')
+        self.assertEqual(page_cache.stats()['misses'], 1)
+        self.assertIsNone(caches['fpl'].get('fpl-page:misses'))
+
+
+@override_settings(FPL_PAGE_CACHE=None, FPL_PAGE_MAX_AGE=60)
+class ConditionalViewTestCase(TestCase):
+    def setUp(self):
+        self.season = Season.objects.create(start_date='2017-08-01', end_date='2018-05-13')
+        self.league = League.objects.create(name='Test League', entry_fee=10, season=self.season)
+        self.classic_league = ClassicLeague.objects.create(league=self.league, fpl_league_id=1,
+                                                           last_updated=timezone.now())
+
+    def test_list_view(self):
+        url = reverse('fpl:season:classic:list', args=[self.season.pk])
+        response = self.client.get(url)
+        self.assertEqual(response['Cache-Control'], 'max-age=60, public')
+        self.assertIn('Last-Modified', response)
+
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        self.classic_league.last_updated = timezone.now() + datetime.timedelta(seconds=1)
+        self.classic_league.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+
+        self.league.name = 'Renamed League'
+        self.league.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Renamed League')
+
+    def test_detail_view(self):
+        url = reverse('fpl:season:classic:detail', args=[self.season.pk, self.classic_league.pk])
+        # The first response sets the CSRF cookie the page's ETag depends on
+        self.client.get(url)
+        response = self.client.get(url)
+        self.assertEqual(response['Cache-Control'], 'max-age=60, private')
+
+        # The league, its latest refresh job and its payouts and entrants, but none of the standings
+        with self.assertNumQueries(3):
+            not_modified = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified['ETag'], response['ETag'])
+
+        Payout.objects.create(league=self.league, name='Test Payout', amount=10, position=1,
+                              start_date='2017-08-01', end_date='2017-08-31', paid_out=False)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Test Payout')
+
+        self.classic_league.rebuild_standings()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+    def test_detail_view_entrant_changes(self):
+        url = reverse('fpl:season:classic:detail', args=[self.season.pk, self.classic_league.pk])
+        user = get_user_model().objects.create(username='entrant', first_name='Test', last_name='Entrant')
+        league_entrant = LeagueEntrant.objects.create(entrant=user, league=self.league, paid_entry=False)
+        self.client.get(url)
+        etag = self.client.get(url)['ETag']
+
+        user.last_login = timezone.now()
+        user.save(update_fields=['last_login'])
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        league_entrant.paid_entry = True
+        league_entrant.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+        user.first_name = 'Renamed'
+        user.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+
+class RateLimiterTestCase(TestCase):
+    def setUp(self):
+        caches['fpl'].clear()
+        self.rate_limiter = RateLimiter(rate=2, burst=3, cache_alias='fpl')
+
+    @patch('fpl.ratelimit.time.time', return_value=1000.0)
+    def test_reserve(self, _):
+        self.assertEqual([self.rate_limiter.reserve() for _ in range(5)], [0, 0, 0, 0.5, 1.0])
+
+    @patch('fpl.ratelimit.time.time', return_value=1000.0)
+    def test_feedback_slows_down(self, _):
+        self.rate_limiter.feedback(503)
+        self.assertEqual(self.rate_limiter.penalty(), 2)
+        self.assertEqual([self.rate_limiter.reserve() for _ in range(4)], [0, 0, 0, 1.0])
+
+        self.rate_limiter.feedback(200)
+        self.assertEqual(self.rate_limiter.penalty(), 2)
+
+    def test_penalty_decays(self):
+        with patch('fpl.ratelimit.time.time', return_value=1000.0):
+            self.rate_limiter.feedback(429)
+        with patch('fpl.ratelimit.time.time', return_value=1060.0):
+            self.assertEqual(self.rate_limiter.penalty(), 1)
+
+    @patch('fpl.ratelimit.time.time', return_value=1000.0)
+    def test_feedback_retry_after(self, _):
+        self.rate_limiter.feedback(429, retry_after=10)
+        self.assertEqual(self.rate_limiter.reserve(), 10.0)
+
+
+class LockingFileBasedCacheTestCase(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache = LockingFileBasedCache(self.directory.name, {})
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_add_is_atomic(self):
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            added = list(executor.map(lambda _: self.cache.add('lock', 1, 5), range(32)))
+
+        self.assertEqual(added.count(True), 1)
+
+    def test_incr_is_atomic(self):
+        self.cache.set('count', 0)
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(lambda _: self.cache.incr('count'), range(32)))
+
+        self.assertEqual(self.cache.get('count'), 32)
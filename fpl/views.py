@@ -1,18 +1,64 @@
 # Create your views here.
+import hashlib
+
+from django.conf import settings
+from django.db.models import Count, Max
 from django.shortcuts import get_object_or_404
+from django.template.loader import render_to_string
 from django.urls import reverse
 from django.utils import timezone
+from django.utils.cache import patch_cache_control
+from django.utils.safestring import mark_safe
+from django.views.decorators.http import condition
 from django.views.generic import ListView, DetailView, RedirectView
 
-from fpl.models import ClassicLeague, HeadToHeadLeague
-from leagues.models import Season
+from fpl.cache import get_page_cache
+from fpl.models import ClassicLeague, HeadToHeadLeague, RefreshJob
+from leagues.models import League, Season
+
+
+def make_etag(*parts):
+    return hashlib.md5(':'.join(str(part) for part in parts).encode('utf-8')).hexdigest()
+
+
+class ConditionalMixin:
+    """Answer conditional requests with 304 Not Modified from get_versions before any of the page is built."""
+    cache_control = {}
+
+    def get_versions(self):
+        """Return the page's (etag, last_modified)."""
+        raise NotImplementedError
+
+    def versions(self):
+        if not hasattr(self, '_versions'):
+            self._versions = self.get_versions()
+        return self._versions
 
+    def dispatch(self, request, *args, **kwargs):
+        response = condition(
+            etag_func=lambda *args, **kwargs: self.versions()[0],
+            last_modified_func=lambda *args, **kwargs: self.versions()[1]
+        )(super().dispatch)(request, *args, **kwargs)
+        patch_cache_control(response, max_age=settings.FPL_PAGE_MAX_AGE, **self.cache_control)
+        return response
 
-class LeagueListView(ListView):
+
+class LeagueListView(ConditionalMixin, ListView):
+    # League lists are the same for everyone, so shared proxies may keep them
+    cache_control = {'public': True}
 
     def get_queryset(self):
         return self.model.objects.filter(league__season=self.kwargs['season_pk'])
 
+    def get_versions(self):
+        # Adding a league always moves the latest modified time, so a deletion cannot hide it from the count
+        leagues = self.get_queryset().aggregate(count=Count('pk'), last_updated=Max('last_updated'),
+                                                modified=Max('league__modified'))
+        last_modified = max([time for time in (leagues['last_updated'], leagues['modified']) if time is not None],
+                            default=None)
+        return make_etag(self.kwargs['season_pk'], leagues['count'], leagues['last_updated'],
+                         leagues['modified']), last_modified
+
 
 class ClassicLeagueListView(LeagueListView):
     model = ClassicLeague
@@ -68,22 +114,59 @@ class HeadToHeadLeagueListView(LeagueListView):
         return context
 
 
-class LeagueDetailView(DetailView):
+class LeagueDetailView(ConditionalMixin, DetailView):
+    # The refresh form carries a CSRF token, so only the browser may keep the page
+    cache_control = {'private': True}
     pk_url_kwarg = 'league_pk'
-
-
-class ClassicLeagueDetailView(LeagueDetailView):
-    model = ClassicLeague
     context_object_name = 'league'
     template_name = 'fpl/league_detail.html'
+    content_template_name = 'fpl/league_detail_content.html'
+    league_type = None
+    league_list_name = None
+    url_namespace = None
 
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        context['league_type'] = 'Classic League'
-        context['base_url'] = 'fpl:season:classic:process-payouts'
+    def get_queryset(self):
+        return super().get_queryset().select_related('league__season')
+
+    def get_object(self, queryset=None):
+        if not hasattr(self, '_object'):
+            self._object = super().get_object(queryset)
+        return self._object
+
+    def get_refresh_job(self):
+        if not hasattr(self, '_refresh_job'):
+            self._refresh_job = RefreshJob.for_league(self.get_object()).order_by('-created').first()
+        return self._refresh_job
+
+    def get_content_version(self):
+        """Return a version of everything the cached content shows, which changes whenever any of it does."""
+        if not hasattr(self, '_content_version'):
+            league = self.get_object()
+            related = League.objects.filter(pk=league.league_id).aggregate(
+                payouts=Count('payout', distinct=True),
+                payouts_modified=Max('payout__modified'),
+                entrants=Count('leagueentrant', distinct=True),
+                entrants_modified=Max('leagueentrant__modified')
+            )
+            self._content_version = (league.last_updated, league.standings_updated, related['payouts_modified'],
+                                     related['entrants_modified'], league.league.modified, related['payouts'],
+                                     related['entrants'])
+        return self._content_version
+
+    def get_versions(self):
+        refresh_job = self.get_refresh_job()
+        refresh_job_times = [refresh_job.created, refresh_job.started, refresh_job.finished] if refresh_job else []
+        # The page's CSRF token is only valid with the CSRF cookie it was rendered for
+        etag = make_etag(self.kwargs['season_pk'], self.get_object().pk, *self.get_content_version(),
+                         refresh_job and refresh_job.pk, refresh_job and refresh_job.status,
+                         self.request.COOKIES.get(settings.CSRF_COOKIE_NAME))
+        last_modified = max([time for time in list(self.get_content_version()[:5]) + refresh_job_times
+                             if time is not None], default=None)
+        return etag, last_modified
+
+    def get_navbar_levels(self):
         season = Season.objects.get(pk=self.kwargs['season_pk'])
-        league = self.model.objects.get(pk=self.kwargs['league_pk'])
-        context['navbar_levels'] = [
+        return [
             {
                 'name': 'Seasons',
                 'href': reverse('fpl:season:list')
@@ -93,48 +176,49 @@ class ClassicLeagueDetailView(LeagueDetailView):
                 'href': reverse('fpl:season:detail', args=[season.pk])
             },
             {
-                'name': 'Classic Leagues',
-                'href': reverse('fpl:season:classic:list', args=[season.pk])
+                'name': self.league_list_name,
+                'href': reverse(self.url_namespace + ':list', args=[season.pk])
             },
             {
-                'name': league.league.name,
-                'href': reverse('fpl:season:classic:detail', args=[season.pk, league.pk])
+                'name': self.object.league.name,
+                'href': reverse(self.url_namespace + ':detail', args=[season.pk, self.object.pk])
             }
         ]
 
+    def get_content(self, context):
+        # The breadcrumbs, standings and payouts only change with the league, so they are rendered once per change
+        page_cache = get_page_cache()
+        fragment = 'detail:{season_pk}:{version}'.format(season_pk=self.kwargs['season_pk'],
+                                                         version=make_etag(*self.get_content_version()))
+        content = page_cache.get(self.object, fragment) if page_cache is not None else None
+        if content is None:
+            context['navbar_levels'] = self.get_navbar_levels()
+            content = render_to_string(self.content_template_name, context, self.request)
+            if page_cache is not None:
+                page_cache.set(self.object, fragment, content)
+        return mark_safe(content)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['league_type'] = self.league_type
+        context['base_url'] = self.url_namespace + ':process-payouts'
+        context['refresh_job'] = self.get_refresh_job()
+        context['content'] = self.get_content(context)
         return context
 
 
+class ClassicLeagueDetailView(LeagueDetailView):
+    model = ClassicLeague
+    league_type = 'Classic League'
+    league_list_name = 'Classic Leagues'
+    url_namespace = 'fpl:season:classic'
+
+
 class HeadToHeadLeagueDetailView(LeagueDetailView):
     model = HeadToHeadLeague
-    context_object_name = 'league'
-    template_name = 'fpl/league_detail.html'
-
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        context['league_type'] = 'Head To Head League'
-        context['base_url'] = 'fpl:season:head-to-head:process-payouts'
-        season = Season.objects.get(pk=self.kwargs['season_pk'])
-        league = self.model.objects.get(pk=self.kwargs['league_pk'])
-        context['navbar_levels'] = [
-            {
-                'name': 'Seasons',
-                'href': reverse('fpl:season:list')
-            },
-            {
-                'name': str(season),
-                'href': reverse('fpl:season:detail', args=[season.pk])
-            },
-            {
-                'name': 'Head To Head Leagues',
-                'href': reverse('fpl:season:head-to-head:list', args=[season.pk])
-            },
-            {
-                'name': league.league.name,
-                'href': reverse('fpl:season:head-to-head:detail', args=[season.pk, league.pk])
-            }
-        ]
-        return context
+    league_type = 'Head To Head League'
+    league_list_name = 'Head To Head Leagues'
+    url_namespace = 'fpl:season:head-to-head'
 
 
 class LeagueRefreshView(RedirectView):
@@ -149,7 +233,7 @@ class LeagueRefreshView(RedirectView):
         league = get_object_or_404(self.league_type, pk=league_id)
         last_updated = league.last_updated if league.last_updated else timezone.now() - timezone.timedelta(hours=2)
         if timezone.timedelta(hours=1) < timezone.now() - last_updated:
-            league.process_payouts()
+            RefreshJob.enqueue(league)
         return reverse(self.base_url, args=[season_id, league_id])
 
 
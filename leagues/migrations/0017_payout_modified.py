@@ -0,0 +1,18 @@
+# Generated by Django 2.1 on 2026-10-18 11:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('leagues', '0016_auto_20180816_2020'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payout',
+            name='modified',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
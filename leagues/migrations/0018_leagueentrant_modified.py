@@ -0,0 +1,18 @@
+# Generated by Django 2.1 on 2026-10-18 16:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('leagues', '0017_payout_modified'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='leagueentrant',
+            name='modified',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.1 on 2026-10-18 18:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('leagues', '0018_leagueentrant_modified'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='league',
+            name='modified',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
@@ -1,5 +1,8 @@
 from django.conf import settings
 from django.db import models
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.utils import timezone
 
 
 class League(models.Model):
@@ -7,6 +10,7 @@ class League(models.Model):
     name = models.CharField(max_length=50)
     entrants = models.ManyToManyField(settings.AUTH_USER_MODEL, blank=True, through='LeagueEntrant')
     entry_fee = models.DecimalField(max_digits=8, decimal_places=2, default=0)
+    modified = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return '({season}) - {name}'.format(season=self.season, name=self.name)
@@ -16,6 +20,7 @@ class LeagueEntrant(models.Model):
     entrant = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     league = models.ForeignKey(League, on_delete=models.CASCADE)
     paid_entry = models.BooleanField()
+    modified = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return '{league} - {entrant}'.format(
@@ -27,6 +32,14 @@ class LeagueEntrant(models.Model):
         unique_together = ('entrant', 'league')
 
 
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def touch_league_entrants(sender, instance, update_fields=None, **kwargs):
+    # League pages show entrant names, so name changes are recorded on the entrant's leagues
+    if update_fields is not None and not {'first_name', 'last_name'} & set(update_fields):
+        return
+    LeagueEntrant.objects.filter(entrant=instance).update(modified=timezone.now())
+
+
 class Payout(models.Model):
     league = models.ForeignKey(League, on_delete=models.CASCADE)
     name = models.CharField(max_length=50)
@@ -36,6 +49,7 @@ class Payout(models.Model):
     end_date = models.DateField()
     winner = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=True, blank=True)
     paid_out = models.BooleanField()
+    modified = models.DateTimeField(auto_now=True)
 
     def calculate_winner(self):
         raise NotImplementedError
@@ -133,5 +133,96 @@ USE_TZ = True
 
 STATIC_URL = '/static/'
 
+# Cache
+# https://docs.djangoproject.com/en/2.1/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Shared between processes so FPL session cookies survive restarts and are reused by every worker
+    'fpl': {
+        'BACKEND': 'fpl.cache.LockingFileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, '.cache', 'fpl'),
+    },
+    # League page fragments, kept apart from 'fpl' so culling them never evicts session cookies or rate limiter state
+    'fpl-pages': {
+        'BACKEND': 'fpl.cache.LockingFileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, '.cache', 'fpl-pages'),
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    }
+}
+
 FPL_USERNAME = get_env_variable('FPL_USERNAME')
 FPL_PASSWORD = get_env_variable('FPL_PASSWORD')
+
+# FPL API client
+FPL_BASE_URL = os.environ.get('FPL_BASE_URL', 'https://fantasy.premierleague.com/drf/')
+FPL_HOMEPAGE_URL = os.environ.get('FPL_HOMEPAGE_URL', 'https://fantasy.premierleague.com')
+FPL_LOGIN_URL = os.environ.get('FPL_LOGIN_URL', 'https://users.premierleague.com/accounts/login/')
+FPL_HTTP_POOL_SIZE = 20
+# Upper bound on concurrent manager history fetches during a league refresh
+FPL_MAX_WORKERS = 8
+# Upper bound on in-flight requests for the asyncio ingestion engine (fpl.aio)
+FPL_ASYNC_CONCURRENCY = 50
+FPL_CACHE_ALIAS = 'fpl'
+# Upper bound in seconds on reusing an authenticated FPL session, cookies expiring sooner shorten it
+FPL_SESSION_COOKIE_TTL = 60 * 60 * 12
+FPL_HTTP_MAX_RETRIES = 3
+# (connect, read) timeouts in seconds, keyed by the first path segment of the endpoint
+FPL_HTTP_TIMEOUTS = {
+    'default': (3.05, 10),
+    'bootstrap-static': (3.05, 30),
+    'fixtures': (3.05, 30),
+    'login': (3.05, 15),
+}
+# Disk backed cache of FPL API responses, set to None to disable. TTLs are in seconds and keyed by the first path
+# segment of the endpoint, a TTL of 0 stores the response for conditional revalidation only.
+FPL_RESPONSE_CACHE = {
+    'LOCATION': os.path.join(BASE_DIR, '.cache', 'fpl-responses'),
+    'MAX_SIZE': 256 * 1024 * 1024,
+    'COMPRESS': True,
+    'TTLS': {
+        'default': 0,
+        'entry': 5 * 60,
+        # Live gameweek points, polled by the live_points command
+        'event': 60,
+        'leagues-classic-standings': 5 * 60,
+        'leagues-entries-and-h2h-matches': 5 * 60,
+    },
+}
+# Rendered standings and payouts on league pages, kept for TIMEOUT seconds or until the league changes. CACHE_ALIAS
+# defaults to 'fpl-pages', which must be shared by the web and refresh processes for changes to reach the pages.
+# Set to None to disable.
+FPL_PAGE_CACHE = {
+    'CACHE_ALIAS': 'fpl-pages',
+    'TIMEOUT': 24 * 60 * 60,
+}
+# Seconds browsers and proxies may reuse league pages before revalidating them with their ETag
+FPL_PAGE_MAX_AGE = 60
+# Requests per second and burst size allowed towards the FPL API, shared by every process using the FPL cache.
+# Set to None to disable.
+FPL_RATE_LIMIT = {
+    'RATE': 10,
+    'BURST': 20,
+}
+
+# League refresh jobs run by the refresh_worker command. Failed jobs are retried after RETRY_DELAY seconds, doubling
+# on every attempt. A refresh running for longer than TIMEOUT seconds is assumed dead, its job is handed to another
+# worker and its league's refresh lock can be taken over.
+FPL_REFRESH_JOB_MAX_ATTEMPTS = 3
+FPL_REFRESH_JOB_RETRY_DELAY = 60
+FPL_REFRESH_JOB_TIMEOUT = 15 * 60
+# Seconds between checks while waiting for a concurrent refresh of the same league to finish
+FPL_REFRESH_LOCK_POLL_INTERVAL = 0.5
+FPL_REFRESH_WORKER_CONCURRENCY = 2
+# Refreshes planned by the schedule_refreshes command, which is expected to run every INTERVAL seconds. Live
+# gameweeks are refreshed every LIVE_INTERVAL seconds and each run plans at most BUDGET_FRACTION of the requests
+# FPL_RATE_LIMIT allows over INTERVAL, leaving the rest for user initiated refreshes.
+FPL_REFRESH_SCHEDULE = {
+    'INTERVAL': 5 * 60,
+    'LIVE_INTERVAL': 15 * 60,
+    'BUDGET_FRACTION': 0.5,
+}